@@ -1,7 +1,24 @@
-from flask import Flask, jsonify, request
+from flask import Flask, jsonify, request, Response
 from datetime import datetime
-from auth import authenticate_user, generate_token, token_required, role_required
+from auth import (authenticate_user, generate_token, token_required, role_required, extrair_token, revogar_token,
+                  cache_tokens, observadores_revogacao, usuario_atual)
+from senhas import ServidorOcupado
+from registros import Colecao, substituir_em_conjunto, instantaneos_em_conjunto
+from banco import BancoSQLite, ColecaoSQLite
+from kpis import MotorKPI
+from rollups import Rollups, GRANULARIDADES
+from busca import IndiceBusca
+from datas import periodo
+from cache_http import condicional
+from eventos import Transmissor, publicar_alteracoes
+from diario import Diario
+from lideranca import Lideranca
+from metricas import metricas, instrumentar
+from serializacao import ProvedorJSON
+from importacao import ler_linhas, ErroImportacao
+import exportacao
 import backup
+import hmac
 import os
 
 app = Flask(__name__)
@@ -11,16 +28,44 @@ app.config['SECRET_KEY'] = 'sua-chave-secreta-aqui-mude-em-producao'  # Change t
 from flask_cors import CORS
 CORS(app, resources={r"/api/*": {"origins": "*"}})
 
-# Configurar logging básico
+# Configurar logging básico (nível configurável por ERP_LOG_LEVEL)
 import logging
-logging.basicConfig(level=logging.DEBUG)
+logging.basicConfig(level=os.environ.get('ERP_LOG_LEVEL', 'INFO').upper())
 logger = logging.getLogger(__name__)
 
 print("=== Inicializando servidor Flask ===")
 logger.info("Aplicação Flask iniciada com sucesso")
 
+# Armazenamento: 'memoria' (coleções em memória + diário em disco) ou 'sqlite' (ERP_ARMAZENAMENTO)
+ARMAZENAMENTO = os.environ.get('ERP_ARMAZENAMENTO', 'memoria')
+DADOS_DIR = os.environ.get('ERP_DADOS_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'dados'))
+
+# JSON das respostas e requisições via orjson quando instalado; compacto, salvo ERP_JSON_INDENTADO=1
+ProvedorJSON.indentar = os.environ.get('ERP_JSON_INDENTADO') == '1'
+app.json = ProvedorJSON(app)
+
+# Métricas por rota (/api/metrics) e perfis por amostragem em DADOS_DIR/perfis: com ?profile=1
+# (só admins) ou para a fração ERP_PERFIL_AMOSTRA (0 a 1) das requisições mais lentas que ERP_PERFIL_LENTO_MS
+instrumentar(app, os.path.join(DADOS_DIR, 'perfis'),
+             pode_perfilar=lambda: (usuario_atual() or {}).get('role') == 'admin',
+             amostra=float(os.environ.get('ERP_PERFIL_AMOSTRA', '0')),
+             lento=float(os.environ.get('ERP_PERFIL_LENTO_MS', '500')) / 1000)
+
+if ARMAZENAMENTO == 'sqlite':
+    banco = BancoSQLite(os.path.join(DADOS_DIR, 'erp.sqlite3'))
+
+    def nova_colecao(nome, registros, indices=(), datas=(), compostos=(), somados=(), numericos=()):
+        # Os dados simulados só são gravados quando a tabela ainda não existe
+        return ColecaoSQLite(banco, nome, registros, indices=indices, datas=datas,
+                             compostos=compostos, somados=somados, numericos=numericos)
+elif ARMAZENAMENTO == 'memoria':
+    def nova_colecao(nome, registros, indices=(), datas=(), compostos=(), somados=(), numericos=()):
+        return Colecao(nome, registros, indices=indices, datas=datas, numericos=numericos)
+else:
+    raise ValueError(f"ERP_ARMAZENAMENTO inválido: {ARMAZENAMENTO!r} (use 'memoria' ou 'sqlite')")
+
 # Dados simulados para o módulo Projetos (Ordens de Serviço)
-ordens_servico = [
+ordens_servico = nova_colecao('ordens_servico', [
     {
         'id': 1,
         'cliente': 'João Silva',
@@ -37,10 +82,10 @@ ordens_servico = [
         'data_criacao': '2024-01-10',
         'agendamento': '2024-01-25 14:00'
     }
-]
+], indices=('status', 'cliente'), datas=('data_criacao', 'agendamento'))
 
 # Dados simulados para o módulo Vendas (Orçamentos)
-orcamentos = [
+orcamentos = nova_colecao('orcamentos', [
     {
         'id': 1,
         'cliente': 'João Silva',
@@ -59,10 +104,11 @@ orcamentos = [
         'status': 'aprovado',
         'validade': '2024-02-20'
     }
-]
+], indices=('status', 'cliente'), datas=('data_envio', 'validade'),
+    compostos=[('status', 'data_envio')], somados=('valor',), numericos=('valor',))
 
 # Dados simulados para o módulo Financeiro
-lancamentos_financeiros = [
+lancamentos_financeiros = nova_colecao('lancamentos_financeiros', [
     {
         'id': 1,
         'tipo': 'receber',
@@ -83,12 +129,190 @@ lancamentos_financeiros = [
         'status': 'pago',
         'categoria': 'fornecedor'
     }
-]
+], indices=('tipo', 'status', 'categoria'), datas=('data_vencimento', 'data_pagamento'),
+    # Fluxo de caixa, relatórios e KPIs somam valor por tipo + status + período (índices compostos no SQLite)
+    compostos=[('tipo', 'status', 'data_vencimento'), ('tipo', 'status', 'data_pagamento')], somados=('valor',),
+    # Valores convertidos para número na entrada ('1.234,56' aceito); texto inválido é recusado com 400
+    numericos=('valor',))
+
+if ARMAZENAMENTO == 'memoria':
+    # Durabilidade: toda mutação vai para um diário (write-ahead log) com snapshots periódicos.
+    # Na inicialização o estado é recuperado do último snapshot + diário; os dados simulados
+    # acima só são usados quando o diretório de dados ainda está vazio.
+    diario = Diario(DADOS_DIR)
+    reaplicadas = diario.recuperar(ordens_servico, orcamentos, lancamentos_financeiros)
+    logger.info(f"Estado recuperado de {DADOS_DIR} ({reaplicadas} entradas do diário reaplicadas)")
+    diario.iniciar()
+
+    @app.after_request
+    def confirmar_gravacao(resposta):
+        """Só responde depois que as mutações feitas pela requisição estiverem gravadas em disco.
+
+        Se a gravação do diário falhar, a alteração já está aplicada (e visível)
+        em memória e será gravada no próximo snapshot: a resposta é 503 dizendo
+        isso, para que o cliente não repita a requisição e duplique o registro.
+        """
+        try:
+            diario.aguardar_pendente()
+        except IOError as e:
+            logger.error(f"Alteração aplicada sem confirmação de gravação: {e}")
+            resposta = jsonify({
+                'erro': 'A alteração foi aplicada, mas ainda não foi gravada em disco; '
+                        'não repita a requisição (ela será gravada no próximo snapshot).',
+                'aplicada': True,
+            })
+            resposta.status_code = 503
+        return resposta
+else:
+    logger.info(f"Armazenamento SQLite em {banco.caminho}")
+
+    # Vários processos (workers do gunicorn) servem o mesmo banco: cada requisição começa
+    # aplicando as alterações e logouts feitos pelos outros, invalidando ETags e caches daqui
+    @app.before_request
+    def sincronizar_processos():
+        banco.sincronizar()
+
+    def publicar_revogacao(digest, exp):
+        # Mantida no banco até o token expirar: workers iniciados depois também a recebem
+        banco.publicar('tokens', 'revogar', {'digest': digest, 'exp': exp}, expira=exp)
+
+    def aplicar_revogacao(evento, dados, seq, em):
+        cache_tokens.revogar_digest(bytes.fromhex(dados['digest']), dados['exp'])
+
+    observadores_revogacao.append(publicar_revogacao)
+    banco.ouvir('tokens', aplicar_revogacao, existentes=True)
+
+# Backups diferenciais: rastreia os registros alterados desde o último backup
+backup_incremental = backup.BackupIncremental(ordens_servico, orcamentos, lancamentos_financeiros)
+
+# Totais do dashboard mantidos incrementalmente a cada mutação das coleções (em memória)
+# ou agregados pelo SQLite a cada leitura
+motor_kpis = MotorKPI(ordens_servico, orcamentos, lancamentos_financeiros,
+                      incremental=ARMAZENAMENTO == 'memoria')
+
+# Agregados financeiros por dia, mês e categoria (fluxo de caixa e relatórios por período)
+rollups = Rollups(lancamentos_financeiros)
+
+# Busca por cliente, produto e descrição em todos os módulos (/api/busca), atualizada a cada mutação
+indice_busca = IndiceBusca()
+indice_busca.incluir('projetos', ordens_servico)
+indice_busca.incluir('orcamentos', orcamentos)
+indice_busca.incluir('financeiro', lancamentos_financeiros)
+
+# Eventos de alteração enviados aos dashboards via Server-Sent Events (/api/stream)
+transmissor = Transmissor()
+publicar_alteracoes(transmissor, motor_kpis, ordens_servico, orcamentos, lancamentos_financeiros)
+
+# Limite máximo de registros por página nas listagens
+LIMITE_PAGINA = 1000
+
+def resposta_lista(colecao, filtros_permitidos, **filtros_fixos):
+    """Monta a resposta de uma listagem com paginação por cursor, filtros e projeção de campos.
+
+    Parâmetros aceitos: ?limit=&after_id= (paginação), ?fields=a,b (projeção) e
+    um filtro de igualdade para cada campo em filtros_permitidos (ex.: ?status=).
+    O cursor da próxima página vai no header X-Proximo-After-Id.
+    """
+    try:
+        limit = int(request.args['limit']) if request.args.get('limit') else None
+        after_id = int(request.args['after_id']) if request.args.get('after_id') else None
+        if limit is not None and not 1 <= limit <= LIMITE_PAGINA:
+            raise ValueError
+    except ValueError:
+        return jsonify({'erro': f'Parâmetros de paginação inválidos (limit deve estar entre 1 e {LIMITE_PAGINA})'}), 400
+
+    criterios = dict(filtros_fixos)
+    for campo in filtros_permitidos:
+        if campo in request.args:
+            criterios[campo] = request.args[campo]
+
+    registros, proximo = colecao.pagina(after_id, limit, **criterios)
+
+    campos = [c for c in request.args.get('fields', '').split(',') if c]
+    if campos:
+        registros = [{c: r[c] for c in campos if c in r} for r in registros]
+
+    resposta = jsonify(registros)
+    if proximo is not None:
+        resposta.headers['X-Proximo-After-Id'] = str(proximo)
+    return resposta
+
+# Limite de registros por requisição nas importações em lote (ERP_LOTE_MAX_REGISTROS)
+LIMITE_LOTE = int(os.environ.get('ERP_LOTE_MAX_REGISTROS', '100000'))
+
+def resposta_lote(colecao, completar):
+    """Importa os registros do corpo da requisição (array JSON, NDJSON ou CSV) de uma só vez.
+
+    Cada registro é completado por completar(dados) e validado numa passada
+    (datas e campos numéricos, em qualquer formato) antes de qualquer inserção;
+    os válidos são inseridos juntos com inserir_lote (um bloco de ids, índices
+    e KPIs atualizados uma única vez). Com ?atomico=1 nada é inserido se algum
+    registro for inválido. A resposta traz o resultado de cada linha.
+    """
+    validos, resultados = [], []
+    try:
+        for numero, dados, erro in ler_linhas(request, LIMITE_LOTE):
+            if erro is None:
+                try:
+                    completar(dados)
+                    validos.append(colecao.preparar(dados))
+                    resultados.append({'linha': numero, 'id': None})
+                    continue
+                except ValueError as e:
+                    erro = str(e)
+            resultados.append({'linha': numero, 'erro': erro})
+    except ErroImportacao as e:
+        return jsonify({'erro': str(e)}), e.status
+
+    erros = len(resultados) - len(validos)
+    if erros and (request.args.get('atomico') == '1' or not validos):
+        return jsonify({'erro': f'{erros} registro(s) inválido(s); nada foi importado',
+                        'inseridos': 0, 'erros': erros, 'resultados': resultados}), 400
+
+    inseridos = iter(colecao.inserir_lote(validos, preparados=True))
+    for resultado in resultados:
+        if 'id' in resultado:
+            resultado['id'] = next(inseridos)['id']
+    return jsonify({'inseridos': len(validos), 'erros': erros, 'resultados': resultados}), 200 if erros else 201
+
+def resposta_exportacao(colecao, filtros_permitidos, campos_padrao):
+    """Exporta os registros da coleção em CSV ou NDJSON, em fluxo e com memória constante.
+
+    Parâmetros aceitos: ?formato=csv|ndjson, ?fields=a,b (colunas), um filtro
+    de igualdade para cada campo em filtros_permitidos e ?de=&ate= sobre o
+    campo de data ?campo_data= (padrão: o primeiro da coleção). Os registros
+    vêm de um instantâneo, que não bloqueia as escritas; ele é liberado quando
+    a resposta termina ou o cliente desconecta.
+    """
+    formato = request.args.get('formato', 'csv')
+    if formato not in exportacao.FORMATOS:
+        return jsonify({'erro': f"Formato inválido: use {', '.join(exportacao.FORMATOS)}"}), 400
+    campo_data = request.args.get('campo_data', colecao.campos_data[0])
+    if campo_data not in colecao.campos_data:
+        return jsonify({'erro': f"campo_data inválido: use {', '.join(colecao.campos_data)}"}), 400
+    try:
+        de, ate = periodo(request.args)
+    except ValueError as e:
+        return jsonify({'erro': str(e)}), 400
+
+    criterios = {campo: request.args[campo] for campo in filtros_permitidos if campo in request.args}
+    campos = [c for c in request.args.get('fields', '').split(',') if c]
+    if formato == 'csv' and not campos:
+        campos = list(campos_padrao)
+
+    instantaneo = instantaneos_em_conjunto(colecao)[colecao.nome]
+    registros = instantaneo.percorrer((campo_data, de, ate) if de or ate else None, **criterios)
+    nome = f"{colecao.nome}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{formato}"
+    resposta = Response(exportacao.gerar(registros, formato, campos), mimetype=exportacao.FORMATOS[formato],
+                        headers={'Content-Disposition': f'attachment; filename="{nome}"',
+                                 'Cache-Control': 'no-store', 'X-Accel-Buffering': 'no'})
+    # O servidor chama close() ao fim do envio ou quando o cliente desconecta
+    resposta.call_on_close(instantaneo.fechar)
+    return resposta
 
 @app.route('/')
 def home():
-    print("Acessando rota raiz '/'")
-    logger.info("Requisição para rota home")
+    logger.debug("Requisição para rota home")
     return "Sistema de Gestão Integrada - Toldos Fortaleza"
 
 @app.route('/api/login', methods=['POST'])
@@ -101,7 +325,12 @@ def login():
     if not username or not password:
         return jsonify({'message': 'Username e password são obrigatórios!'}), 400
     
-    user = authenticate_user(username, password)
+    try:
+        user = authenticate_user(username, password)
+    except ServidorOcupado:
+        resposta = jsonify({'message': 'Muitas tentativas de login simultâneas, tente novamente.'})
+        resposta.headers['Retry-After'] = '1'
+        return resposta, 503
     if user:
         token = generate_token({
             'username': username,
@@ -119,40 +348,71 @@ def login():
     
     return jsonify({'message': 'Credenciais inválidas!'}), 401
 
+@app.route('/api/logout', methods=['POST'])
+@token_required
+def logout(current_user):
+    """Revoga o token atual; ele deixa de ser aceito mesmo antes de expirar"""
+    revogar_token(extrair_token())
+    return jsonify({'message': 'Logout realizado com sucesso!'}), 200
+
 @app.route('/api/projetos', methods=['GET'])
 def projetos_wrapper(*args, **kwargs):
-    print("Requisição recebida para /api/projetos")
-    logger.info("Tentando acessar /api/projetos")
+    logger.debug("Tentando acessar /api/projetos")
     return listar_projetos(*args, **kwargs)
 
 @token_required
+@condicional(ordens_servico)
 def listar_projetos(current_user):
-    print(f"Autenticação OK para listar_projetos. Usuário: {current_user['username']}")
-    logger.info(f"Listando projetos para usuário: {current_user['username']}")
-    return jsonify(ordens_servico)
+    logger.debug("Listando projetos para usuário: %s", current_user['username'])
+    return resposta_lista(ordens_servico, ('status', 'cliente'))
 
 @app.route('/api/projetos', methods=['POST'])
 @token_required
 @role_required('admin')
 def criar_projeto(current_user):
     novo_projeto = request.json
-    novo_projeto['id'] = len(ordens_servico) + 1
     novo_projeto['data_criacao'] = datetime.now().strftime('%Y-%m-%d')
     novo_projeto['criado_por'] = current_user['username']
-    ordens_servico.append(novo_projeto)
+    try:
+        novo_projeto = ordens_servico.inserir(novo_projeto)
+    except ValueError as e:
+        return jsonify({'erro': str(e)}), 400
     return jsonify(novo_projeto), 201
 
+@app.route('/api/projetos/bulk', methods=['POST'])
+@token_required
+@role_required('admin')
+def importar_projetos(current_user):
+    # Importação de histórico: data de criação e autor informados são mantidos
+    hoje = datetime.now().strftime('%Y-%m-%d')
+
+    def completar(projeto):
+        if not projeto.get('data_criacao'):
+            projeto['data_criacao'] = hoje
+        if not projeto.get('criado_por'):
+            projeto['criado_por'] = current_user['username']
+    return resposta_lote(ordens_servico, completar)
+
+@app.route('/api/projetos/exportar', methods=['GET'])
+@token_required
+def exportar_projetos(current_user):
+    return resposta_exportacao(ordens_servico, ('status', 'cliente'),
+                               ('id', 'cliente', 'produto', 'status', 'data_criacao', 'agendamento', 'criado_por'))
+
 @app.route('/api/projetos/<int:id>', methods=['PUT'])
 @token_required
 def atualizar_projeto(current_user, id):
-    projeto = next((p for p in ordens_servico if p['id'] == id), None)
+    projeto = ordens_servico.obter(id)
     if projeto:
         # Verificar se o usuário tem permissão para editar
         if current_user['role'] != 'admin' and projeto.get('criado_por') != current_user['username']:
             return jsonify({'erro': 'Permissão negada!'}), 403
         
         dados = request.json
-        projeto.update(dados)
+        try:
+            projeto = ordens_servico.atualizar(id, dados)
+        except ValueError as e:
+            return jsonify({'erro': str(e)}), 400
         return jsonify(projeto)
     return jsonify({'erro': 'Projeto não encontrado'}), 404
 
@@ -160,123 +420,275 @@ def atualizar_projeto(current_user, id):
 @app.route('/api/financeiro/contas-a-pagar', methods=['GET'])
 @token_required
 @role_required('admin')
+@condicional(lancamentos_financeiros)
 def listar_contas_a_pagar(current_user):
-    contas_pagar = [l for l in lancamentos_financeiros if l['tipo'] == 'pagar']
-    return jsonify(contas_pagar)
+    return resposta_lista(lancamentos_financeiros, ('status', 'categoria'), tipo='pagar')
 
 @app.route('/api/financeiro/contas-a-receber', methods=['GET'])
 @token_required
+@condicional(lancamentos_financeiros)
 def listar_contas_a_receber(current_user):
-    contas_receber = [l for l in lancamentos_financeiros if l['tipo'] == 'receber']
-    return jsonify(contas_receber)
+    return resposta_lista(lancamentos_financeiros, ('status', 'categoria'), tipo='receber')
 
 @app.route('/api/financeiro/lancamento', methods=['POST'])
 @token_required
 @role_required('admin')
 def criar_lancamento(current_user):
     novo_lancamento = request.json
-    novo_lancamento['id'] = len(lancamentos_financeiros) + 1
     novo_lancamento['criado_por'] = current_user['username']
-    lancamentos_financeiros.append(novo_lancamento)
+    try:
+        novo_lancamento = lancamentos_financeiros.inserir(novo_lancamento)
+    except ValueError as e:
+        return jsonify({'erro': str(e)}), 400
     return jsonify(novo_lancamento), 201
 
+@app.route('/api/financeiro/lancamento/<int:id>', methods=['PUT'])
+@token_required
+@role_required('admin')
+def atualizar_lancamento(current_user, id):
+    dados = request.json
+    # Baixa sem data informada: considera pago hoje
+    if dados.get('status') == 'pago' and not dados.get('data_pagamento'):
+        lancamento = lancamentos_financeiros.obter(id)
+        if lancamento is not None and not lancamento.get('data_pagamento'):
+            dados['data_pagamento'] = datetime.now().strftime('%Y-%m-%d')
+    try:
+        lancamento = lancamentos_financeiros.atualizar(id, dados)
+    except ValueError as e:
+        return jsonify({'erro': str(e)}), 400
+    if lancamento is None:
+        return jsonify({'erro': 'Lançamento não encontrado'}), 404
+    return jsonify(lancamento)
+
+@app.route('/api/financeiro/lancamentos/bulk', methods=['POST'])
+@token_required
+@role_required('admin')
+def importar_lancamentos(current_user):
+    def completar(lancamento):
+        if not lancamento.get('criado_por'):
+            lancamento['criado_por'] = current_user['username']
+    return resposta_lote(lancamentos_financeiros, completar)
+
+@app.route('/api/financeiro/lancamentos/exportar', methods=['GET'])
+@token_required
+@role_required('admin')
+def exportar_lancamentos(current_user):
+    return resposta_exportacao(lancamentos_financeiros, ('tipo', 'status', 'categoria'),
+                               ('id', 'tipo', 'descricao', 'valor', 'data_vencimento', 'data_pagamento',
+                                'status', 'categoria', 'criado_por'))
+
+@app.route('/api/orcamentos/exportar', methods=['GET'])
+@token_required
+@role_required('admin')
+def exportar_orcamentos(current_user):
+    return resposta_exportacao(orcamentos, ('status', 'cliente'),
+                               ('id', 'cliente', 'produto', 'valor', 'data_envio', 'status', 'validade'))
+
+def _granularidade():
+    """Lê ?granularidade= (dia ou mes); levanta ValueError se for outro valor"""
+    granularidade = request.args.get('granularidade')
+    if granularidade is not None and granularidade not in GRANULARIDADES:
+        raise ValueError(f"Granularidade inválida: use {', '.join(GRANULARIDADES)}")
+    return granularidade
+
 @app.route('/api/financeiro/fluxo-caixa', methods=['GET'])
 @token_required
 @role_required('admin')
+@condicional(lancamentos_financeiros)
 def fluxo_caixa(current_user):
-    # Cálculo simples do fluxo de caixa
-    total_receber = sum(l['valor'] for l in lancamentos_financeiros if l['tipo'] == 'receber' and l['status'] == 'pendente')
-    total_pagar = sum(l['valor'] for l in lancamentos_financeiros if l['tipo'] == 'pagar' and l['status'] == 'pendente')
+    # Fluxo de caixa dos pendentes, opcionalmente restrito a um período de vencimento (?de=&ate=);
+    # com ?granularidade=dia|mes inclui a série por período com o saldo projetado
+    try:
+        de, ate = periodo(request.args)
+        granularidade = _granularidade()
+    except ValueError as e:
+        return jsonify({'erro': str(e)}), 400
+    total_receber = rollups.total(de, ate, tipo='receber', status='pendente')
+    total_pagar = rollups.total(de, ate, tipo='pagar', status='pendente')
     saldo = total_receber - total_pagar
-    return jsonify({
-        'total_a_receber': total_receber,
-        'total_a_pagar': total_pagar,
-        'saldo': saldo
-    })
+    resposta = {
+        'total_a_receber': round(total_receber, 2),
+        'total_a_pagar': round(total_pagar, 2),
+        'saldo': round(saldo, 2)
+    }
+    if granularidade:
+        resposta['saldo_inicial'], resposta['serie'] = rollups.fluxo_caixa(granularidade, de, ate)
+    return jsonify(resposta)
 
 @app.route('/api/financeiro/relatorios', methods=['GET'])
 @token_required
 @role_required('admin')
+@condicional(lancamentos_financeiros)
 def relatorios_financeiros(current_user):
-    # Relatório simples de faturamento
-    faturamento = sum(l['valor'] for l in lancamentos_financeiros if l['tipo'] == 'receber' and l['status'] == 'pago')
-    despesas = sum(l['valor'] for l in lancamentos_financeiros if l['tipo'] == 'pagar' and l['status'] == 'pago')
+    # Faturamento e despesas pagos, opcionalmente restritos a um período de pagamento (?de=&ate=);
+    # ?granularidade=dia|mes inclui a série por período e ?por=categoria os totais por categoria
+    try:
+        de, ate = periodo(request.args)
+        granularidade = _granularidade()
+    except ValueError as e:
+        return jsonify({'erro': str(e)}), 400
+    faturamento = rollups.total(de, ate, tipo='receber', status='pago')
+    despesas = rollups.total(de, ate, tipo='pagar', status='pago')
     lucro = faturamento - despesas
-    return jsonify({
-        'faturamento': faturamento,
-        'despesas': despesas,
-        'lucro': lucro
-    })
+    resposta = {
+        'faturamento': round(faturamento, 2),
+        'despesas': round(despesas, 2),
+        'lucro': round(lucro, 2)
+    }
+    if granularidade:
+        receitas = rollups.serie(granularidade, de, ate, tipo='receber', status='pago')
+        gastos = rollups.serie(granularidade, de, ate, tipo='pagar', status='pago')
+        resposta['serie'] = [{'periodo': p, 'faturamento': round(receitas.get(p, 0.0), 2),
+                              'despesas': round(gastos.get(p, 0.0), 2),
+                              'lucro': round(receitas.get(p, 0.0) - gastos.get(p, 0.0), 2)}
+                             for p in sorted(set(receitas) | set(gastos))]
+    if request.args.get('por') == 'categoria':
+        receitas = rollups.por_categoria(de, ate, tipo='receber', status='pago')
+        gastos = rollups.por_categoria(de, ate, tipo='pagar', status='pago')
+        resposta['categorias'] = {str(c): {'faturamento': round(receitas.get(c, 0.0), 2),
+                                           'despesas': round(gastos.get(c, 0.0), 2),
+                                           'lucro': round(receitas.get(c, 0.0) - gastos.get(c, 0.0), 2)}
+                                  for c in set(receitas) | set(gastos)}
+    # Modo de verificação: recalcula os agregados do zero e aponta divergências
+    if request.args.get('verificar') == '1':
+        resposta['divergencias'] = rollups.verificar()
+    return jsonify(resposta)
+
+# Busca
+LIMITE_BUSCA = 100
+
+@app.route('/api/busca', methods=['GET'])
+@token_required
+def buscar(current_user):
+    """Busca em projetos, orçamentos e lançamentos por cliente, produto e descrição (sem acentos).
+
+    ?q= é o texto (o último termo também casa como prefixo), ?modulo= restringe
+    a projetos, orcamentos ou financeiro e ?limit= é o máximo de resultados.
+    Quem não é admin só vê projetos e contas a receber, como nas listagens.
+    """
+    texto = request.args.get('q', '')
+    if not texto.strip():
+        return jsonify({'erro': 'Informe o texto da busca em ?q='}), 400
+    try:
+        limite = int(request.args.get('limit') or 20)
+        if not 1 <= limite <= LIMITE_BUSCA:
+            raise ValueError
+    except ValueError:
+        return jsonify({'erro': f'limit deve estar entre 1 e {LIMITE_BUSCA}'}), 400
+    modulos = [m for m in request.args.get('modulo', '').split(',') if m] or None
+
+    permitido = None
+    if current_user['role'] != 'admin':
+        def permitido(modulo, resumo):
+            return modulo == 'projetos' or (modulo == 'financeiro' and resumo.get('tipo') == 'receber')
+
+    return jsonify(indice_busca.buscar(texto, limite, modulos, permitido))
 
 # Endpoints para o Dashboard
 @app.route('/api/dashboard/kpis', methods=['GET'])
 def kpis_wrapper(*args, **kwargs):
-    print("Requisição recebida para /api/dashboard/kpis")
-    logger.info("Tentando acessar /api/dashboard/kpis")
+    logger.debug("Tentando acessar /api/dashboard/kpis")
     return dashboard_kpis(*args, **kwargs)
 
 @token_required
+@condicional(ordens_servico, orcamentos, lancamentos_financeiros, por_dia=True)
 def dashboard_kpis(current_user):
-    print(f"Autenticação OK para dashboard_kpis. Usuário: {current_user['username']}")
-    logger.info(f"Carregando KPIs para usuário: {current_user['username']}")
-    from datetime import datetime, timedelta
-    
-    # 1. Valor total em orçamentos enviados no mês
-    mes_atual = datetime.now().month
-    orcamentos_mes = [o for o in orcamentos if datetime.strptime(o['data_envio'], '%Y-%m-%d').month == mes_atual and o['status'] == 'enviado']
-    total_orcamentos = sum(o['valor'] for o in orcamentos_mes)
-    
-    # 2. Número de vendas fechadas (orcamentos aprovados)
-    vendas_fechadas = len([o for o in orcamentos if o['status'] == 'aprovado'])
-    
-    # 3. Faturamento do mês (receitas pagas no mês)
-    faturamento_mes = sum(l['valor'] for l in lancamentos_financeiros if l['tipo'] == 'receber' and l['status'] == 'pago' and datetime.strptime(l['data_pagamento'], '%Y-%m-%d').month == mes_atual)
-    
-    # 4. Número de projetos em andamento (ordens de serviço não finalizadas)
-    projetos_andamento = len([p for p in ordens_servico if p['status'] not in ['Finalizado']])
-    
-    # 5. Contas a receber vencendo na semana
-    hoje = datetime.now()
-    fim_semana = hoje + timedelta(days=7)
-    contas_vencendo = [l for l in lancamentos_financeiros if l['tipo'] == 'receber' and l['status'] == 'pendente']
-    contas_vencendo_semana = []
-    
-    for conta in contas_vencendo:
-        data_vencimento = datetime.strptime(conta['data_vencimento'], '%Y-%m-%d')
-        if hoje <= data_vencimento <= fim_semana:
-            contas_vencendo_semana.append(conta)
-    
-    return jsonify({
-        'total_orcamentos_mes': total_orcamentos,
-        'vendas_fechadas': vendas_fechadas,
-        'faturamento_mes': faturamento_mes,
-        'projetos_andamento': projetos_andamento,
-        'contas_vencendo_semana': len(contas_vencendo_semana)
-    })
+    logger.debug("Carregando KPIs para usuário: %s", current_user['username'])
+    kpis = motor_kpis.kpis()
+
+    # Modo de verificação: recalcula tudo do zero e aponta divergências dos totais incrementais
+    if request.args.get('verificar') == '1':
+        kpis['divergencias'] = motor_kpis.verificar()
+
+    return jsonify(kpis)
+
+# Fluxo de eventos para os frontends (substitui o polling)
+@app.route('/api/stream', methods=['GET'])
+@token_required
+def stream_eventos(current_user):
+    """Envia alterações de ordens de serviço e deltas dos KPIs via Server-Sent Events"""
+    ultimo_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+    assinatura = transmissor.assinar(ultimo_id)
+    return Response(transmissor.fluxo(assinatura), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/api/metrics', methods=['GET'])
+def metricas_prometheus():
+    """Métricas no formato texto do Prometheus; exige o JWT de um admin ou o Bearer ERP_METRICAS_TOKEN, se definido"""
+    esperado = os.environ.get('ERP_METRICAS_TOKEN')
+    if not (esperado and hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {esperado}')):
+        current_user = usuario_atual()
+        if current_user is None:
+            return jsonify({'message': 'Token de acesso é obrigatório!'}), 401
+        if current_user['role'] != 'admin':
+            return jsonify({'message': 'Acesso negado! Permissões insuficientes.'}), 403
+    return Response(metricas.exportar(), mimetype='text/plain; version=0.0.4')
 
 # Endpoints para Backup
 @app.route('/api/backup/create', methods=['POST'])
 @token_required
 @role_required('admin')
 def criar_backup_manual(current_user):
-    """Cria um backup manual dos dados"""
+    """Agenda um backup manual dos dados; o progresso é consultado em /api/backup/status/<id>"""
     try:
-        backup_path = backup.criar_backup(ordens_servico, orcamentos, lancamentos_financeiros)
-        return jsonify({'message': 'Backup criado com sucesso!', 'caminho': backup_path}), 200
+        # ?tipo=completo força uma nova base; por padrão só os registros alterados são gravados
+        tarefa = backup_incremental.agendar(completo=request.args.get('tipo') == 'completo')
+        resposta = jsonify({'message': 'Backup agendado!', 'tarefa': tarefa.para_dict()})
+        resposta.headers['Location'] = f'/api/backup/status/{tarefa.id}'
+        return resposta, 202
     except Exception as e:
         return jsonify({'message': f'Erro ao criar backup: {str(e)}'}), 500
 
+@app.route('/api/backup/status/<tarefa_id>', methods=['GET'])
+@token_required
+@role_required('admin')
+def status_backup(current_user, tarefa_id):
+    """Retorna o andamento de um backup agendado"""
+    tarefa = backup_incremental.tarefa(tarefa_id)
+    if tarefa is None:
+        return jsonify({'message': 'Tarefa de backup não encontrada!'}), 404
+    return jsonify(tarefa.para_dict()), 200
+
 @app.route('/api/backup/list', methods=['GET'])
 @token_required
 @role_required('admin')
 def listar_backups(current_user):
-    """Lista todos os backups disponíveis"""
+    """Lista os backups disponíveis, do mais recente para o mais antigo.
+
+    Aceita ?limit=&after=<nome do backup>; o cursor da próxima página vai no
+    header X-Proximo-After.
+    """
+    try:
+        limit = int(request.args['limit']) if request.args.get('limit') else None
+        if limit is not None and not 1 <= limit <= LIMITE_PAGINA:
+            raise ValueError
+    except ValueError:
+        return jsonify({'erro': f'Parâmetros de paginação inválidos (limit deve estar entre 1 e {LIMITE_PAGINA})'}), 400
     try:
-        backups = backup.listar_backups()
-        return jsonify(backups), 200
+        if limit is None and not request.args.get('after'):
+            return jsonify(backup.listar_backups()), 200
+        try:
+            backups, proximo = backup.pagina_backups(limit or LIMITE_PAGINA, request.args.get('after'))
+        except KeyError:
+            return jsonify({'erro': 'Backup informado em after não encontrado'}), 400
+        resposta = jsonify(backups)
+        if proximo is not None:
+            resposta.headers['X-Proximo-After'] = proximo
+        return resposta, 200
     except Exception as e:
         return jsonify({'message': f'Erro ao listar backups: {str(e)}'}), 500
 
+@app.route('/api/backup/catalogo/reconstruir', methods=['POST'])
+@token_required
+@role_required('admin')
+def reconstruir_catalogo_backups(current_user):
+    """Reconstrói o catálogo de backups lendo os diretórios em disco"""
+    try:
+        total = backup.reconstruir_catalogo()
+        return jsonify({'message': f'Catálogo reconstruído com {total} backups!'}), 200
+    except Exception as e:
+        return jsonify({'message': f'Erro ao reconstruir catálogo: {str(e)}'}), 500
+
 @app.route('/api/backup/restore/<backup_name>', methods=['POST'])
 @token_required
 @role_required('admin')
@@ -287,8 +699,13 @@ def restaurar_backup(current_user, backup_name):
         if not os.path.exists(backup_path):
             return jsonify({'message': 'Backup não encontrado!'}), 404
         
-        success = backup.restaurar_backup(backup_path, ordens_servico, orcamentos, lancamentos_financeiros)
+        # Carregar em listas novas e só então substituir o conteúdo das coleções
+        novas_ordens, novos_orcamentos, novos_lancamentos = [], [], []
+        success = backup.restaurar_backup(backup_path, novas_ordens, novos_orcamentos, novos_lancamentos)
         if success:
+            substituir_em_conjunto((ordens_servico, novas_ordens),
+                                   (orcamentos, novos_orcamentos),
+                                   (lancamentos_financeiros, novos_lancamentos))
             return jsonify({'message': 'Backup restaurado com sucesso!'}), 200
         else:
             return jsonify({'message': 'Erro ao restaurar backup!'}), 500
@@ -306,16 +723,37 @@ def limpar_backups_antigos(current_user):
     except Exception as e:
         return jsonify({'message': f'Erro ao limpar backups: {str(e)}'}), 500
 
-if __name__ == '__main__':
+# Só um processo agenda os backups: o que obtiver o lock deste arquivo
+lideranca_agendador = Lideranca(os.path.join(DADOS_DIR, 'agendador.lock'))
+
+def iniciar_agendamento():
     try:
         # Iniciar agendamento automático de backups
         print("Iniciando scheduler de backup...")
-        backup_scheduler = backup.iniciar_agendamento_backup(ordens_servico, orcamentos, lancamentos_financeiros)
+        backup.iniciar_agendamento_backup(ordens_servico, orcamentos, lancamentos_financeiros,
+                                          incremental=backup_incremental)
         print("Scheduler de backup iniciado com sucesso")
         logger.info("Scheduler de backup ativo")
     except Exception as e:
         print(f"Erro ao iniciar scheduler de backup: {e}")
         logger.error(f"Falha no scheduler: {e}")
-    
+
+def iniciar_servicos():
+    """Inicia as tarefas em segundo plano do processo (chamada pelo wsgi.py em cada worker).
+
+    Só o worker líder agenda os backups; se ele terminar, outro assume.
+    """
+    if ARMAZENAMENTO == 'sqlite':
+        # Eventos (SSE) e backups deste worker acompanham as escritas dos outros mesmo sem requisições
+        banco.iniciar_sincronizacao()
+        # /api/metrics em qualquer worker soma as métricas de todos
+        metricas.compartilhar(os.path.join(DADOS_DIR, 'metricas'))
+    lideranca_agendador.quando_lider(iniciar_agendamento)
+
+if __name__ == '__main__':
+    iniciar_servicos()
+
     print("Iniciando servidor Flask na porta 5000...")
-    app.run(debug=True, host='0.0.0.0')
\ No newline at end of file
+    # Sem o reloader do Werkzeug: ele mantém um processo pai que também importaria o app
+    # (diário, agendador de backups e liderança) com um estado em memória que não recebe requisições
+    app.run(debug=True, host='0.0.0.0', use_reloader=False)
\ No newline at end of file
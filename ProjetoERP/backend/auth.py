@@ -1,38 +1,93 @@
 from flask import request, jsonify, current_app
-from werkzeug.security import generate_password_hash, check_password_hash
 import jwt
 import datetime
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
 from functools import wraps
+from senhas import verificador, ServidorOcupado
+from metricas import metricas
 
-# Configurar logging básico
+# Configurar logging básico (nível configurável por ERP_LOG_LEVEL; DEBUG mostra cada verificação de token)
 import logging
-logging.basicConfig(level=logging.DEBUG)
+logging.basicConfig(level=os.environ.get('ERP_LOG_LEVEL', 'INFO').upper())
 logger = logging.getLogger(__name__)
 
 # Simple in-memory user store for demo (use database in production)
+# Os hashes são gerados na primeira autenticação de cada usuário (ou carregados
+# já prontos de ERP_SENHAS_ARQUIVO), evitando o custo de hash na inicialização.
 users = {
     'admin': {
-        'password': generate_password_hash('admin123'),
+        'password': None,
+        'senha_inicial': 'admin123',
         'role': 'admin',
         'name': 'Administrador'
     },
     'vendedor': {
-        'password': generate_password_hash('vendedor123'),
+        'password': None,
+        'senha_inicial': 'vendedor123',
         'role': 'vendedor',
         'name': 'Usuário Vendedor'
     },
     'tecnico': {
-        'password': generate_password_hash('tecnico123'),
+        'password': None,
+        'senha_inicial': 'tecnico123',
         'role': 'tecnico',
         'name': 'Técnico Instalador'
     }
 }
 
+def carregar_hashes(caminho):
+    """Carrega hashes pré-calculados de um arquivo JSON no formato {usuario: hash}"""
+    with open(caminho, 'r', encoding='utf-8') as f:
+        for username, hash_senha in json.load(f).items():
+            if username in users:
+                users[username]['password'] = hash_senha
+                users[username].pop('senha_inicial', None)
+
+if os.environ.get('ERP_SENHAS_ARQUIVO'):
+    carregar_hashes(os.environ['ERP_SENHAS_ARQUIVO'])
+
+# Um lock por usuário: gerar o hash de um não bloqueia o login dos outros
+_locks_hashes = {username: threading.Lock() for username in users}
+
+def _hash_usuario(username):
+    """Retorna o hash da senha do usuário, gerando-o (no pool de senhas) na primeira vez que for necessário"""
+    user = users[username]
+    if user['password'] is None:
+        # Outro login do mesmo usuário pode estar gerando o hash: esperar por ele e reaproveitá-lo
+        lock = _locks_hashes[username]
+        if not lock.acquire(timeout=verificador.espera):
+            raise ServidorOcupado()
+        try:
+            if user['password'] is None:
+                user['password'] = verificador.gerar(user['senha_inicial'])
+                user.pop('senha_inicial')
+        finally:
+            lock.release()
+    return user['password']
+
 def authenticate_user(username, password):
-    """Autentica um usuário com nome de usuário e senha"""
-    if username in users and check_password_hash(users[username]['password'], password):
-        return users[username]
-    return None
+    """Autentica um usuário com nome de usuário e senha.
+
+    A verificação roda no pool de senhas.verificador; levanta ServidorOcupado
+    se houver verificações demais em andamento.
+    """
+    if username not in users:
+        return verificador.verificar_inexistente(password) or None
+    hash_senha = _hash_usuario(username)
+    if not verificador.verificar(hash_senha, password):
+        return None
+    if verificador.precisa_rehash(hash_senha):
+        # Custo ou algoritmo mudou desde que o hash foi gerado: atualizar com a senha já validada
+        try:
+            users[username]['password'] = verificador.gerar(password)
+        except ServidorOcupado:
+            pass  # a senha já foi validada; o rehash fica para o próximo login
+    return users[username]
 
 def generate_token(user_data):
     """Gera um token JWT para o usuário"""
@@ -40,57 +95,178 @@ def generate_token(user_data):
         'username': user_data['username'],
         'role': user_data['role'],
         'name': user_data['name'],
-        'exp': datetime.datetime.utcnow() + datetime.timedelta(hours=8)
+        'exp': datetime.datetime.utcnow() + datetime.timedelta(hours=8),
+        # Identificador único: sem ele, dois logins no mesmo segundo geram o mesmo token,
+        # e um logout revogaria também o token do login seguinte
+        'jti': os.urandom(8).hex()
     }
     return jwt.encode(payload, current_app.config['SECRET_KEY'], algorithm='HS256')
 
+class CacheTokens:
+    """Cache LRU de tokens já verificados, válido até o 'exp' de cada token.
+
+    A chave é o SHA-256 do segredo + token, então uma troca de SECRET_KEY
+    nunca reaproveita entradas antigas (elas saem pelo LRU ou ao expirar), e o
+    valor guardado é só o que o próprio token declara, igual ao que jwt.decode
+    devolveria. Tokens revogados (logout) ficam registrados até expirarem.
+    """
+
+    def __init__(self, tamanho_maximo=10000):
+        self.tamanho_maximo = tamanho_maximo
+        self._lock = threading.Lock()
+        self._entradas = OrderedDict()  # chave -> (current_user, exp)
+        self._revogados = {}            # digest do token -> exp
+
+    @staticmethod
+    def _chave(token, segredo):
+        return hashlib.sha256(f'{segredo}\0{token}'.encode('utf-8')).digest()
+
+    @staticmethod
+    def _digest(token):
+        return hashlib.sha256(token.encode('utf-8')).digest()
+
+    def obter(self, token, segredo):
+        """Retorna o current_user em cache ou None se ausente, expirado ou revogado"""
+        if self.tamanho_maximo <= 0:
+            return None
+        chave = self._chave(token, segredo)
+        with self._lock:
+            entrada = self._entradas.get(chave)
+            if entrada is None:
+                return None
+            current_user, exp = entrada
+            if exp <= time.time():
+                del self._entradas[chave]
+                return None
+            self._entradas.move_to_end(chave)
+            return current_user
+
+    def guardar(self, token, segredo, current_user, exp):
+        if self.tamanho_maximo <= 0:
+            return
+        chave = self._chave(token, segredo)
+        with self._lock:
+            self._entradas[chave] = (current_user, exp)
+            self._entradas.move_to_end(chave)
+            while len(self._entradas) > self.tamanho_maximo:
+                self._entradas.popitem(last=False)
+
+    def revogar(self, token, segredo, exp):
+        """Invalida um token (logout) até a sua expiração"""
+        with self._lock:
+            self._entradas.pop(self._chave(token, segredo), None)
+        self.revogar_digest(self._digest(token), exp)
+
+    def revogar_digest(self, digest, exp):
+        """Registra a revogação pelo digest do token (ex.: logout recebido de outro processo)"""
+        agora = time.time()
+        with self._lock:
+            self._revogados[digest] = exp
+            # Descartar revogações de tokens que já expiraram
+            for digest in [d for d, e in self._revogados.items() if e <= agora]:
+                del self._revogados[digest]
+
+    def revogado(self, token):
+        return bool(self._revogados) and self._digest(token) in self._revogados
+
+    def limpar(self):
+        """Esvazia o cache de tokens verificados (as revogações são mantidas)"""
+        with self._lock:
+            self._entradas.clear()
+
+
+cache_tokens = CacheTokens(int(os.environ.get('ERP_TOKEN_CACHE_TAMANHO', '10000')))
+
+
+def extrair_token():
+    """Extrai o token JWT da requisição; levanta ValueError se o header estiver malformado"""
+    if 'Authorization' in request.headers:
+        try:
+            return request.headers['Authorization'].split(" ")[1]  # Bearer <token>
+        except IndexError:
+            raise ValueError('Formato de token inválido! Use: Bearer <token>')
+    if (request.endpoint == 'stream_eventos' and 'token' in request.args
+            and request.accept_mimetypes.best == 'text/event-stream'):
+        # EventSource (SSE) não permite enviar headers: aceitar o token na query string só em /api/stream
+        return request.args['token']
+    return None
+
+
+def verificar_token(token):
+    """Valida o token e retorna o current_user, usando o cache de tokens já verificados"""
+    segredo = current_app.config['SECRET_KEY']
+    if cache_tokens.revogado(token):
+        raise jwt.InvalidTokenError('Token revogado')
+    current_user = cache_tokens.obter(token, segredo)
+    if current_user is not None:
+        return current_user
+
+    data = jwt.decode(token, segredo, algorithms=['HS256'])
+    current_user = {
+        'username': data['username'],
+        'role': data['role'],
+        'name': data['name']
+    }
+    cache_tokens.guardar(token, segredo, current_user, data['exp'])
+    return current_user
+
+
+# Funções chamadas com (digest hexadecimal, exp) a cada logout, para propagar a revogação a outros processos
+observadores_revogacao = []
+
+
+def revogar_token(token):
+    """Revoga um token válido (logout); ele deixa de ser aceito mesmo antes de expirar"""
+    segredo = current_app.config['SECRET_KEY']
+    data = jwt.decode(token, segredo, algorithms=['HS256'])
+    cache_tokens.revogar(token, segredo, data['exp'])
+    for observador in observadores_revogacao:
+        observador(CacheTokens._digest(token).hex(), data['exp'])
+
+
+def usuario_atual():
+    """Retorna o current_user do token da requisição, ou None se ausente ou inválido"""
+    try:
+        token = extrair_token()
+        return verificar_token(token) if token else None
+    except (ValueError, jwt.InvalidTokenError):
+        return None
+
+
+# Tempo da verificação do token em cada requisição autenticada, por resultado
+tempo_autenticacao = metricas.histograma('erp_autenticacao_segundos', 'Tempo de verificação do token JWT',
+                                         ('resultado',))
+
+
 def token_required(f):
     """Decorator para exigir token JWT válido"""
     @wraps(f)
     def decorated(*args, **kwargs):
-        print("Verificando token de autenticação...")
-        logger.info("Iniciando verificação de token")
-        token = None
-        
-        # Verificar se o token está no header Authorization
-        if 'Authorization' in request.headers:
-            auth_header = request.headers['Authorization']
-            print(f"Header Authorization encontrado: {auth_header}")
-            try:
-                token = auth_header.split(" ")[1]  # Bearer <token>
-                print(f"Token extraído: {token[:20]}...")  # Log parcial por segurança
-            except IndexError:
-                print("Formato de token inválido!")
-                logger.warning("Formato de Authorization inválido")
-                return jsonify({'message': 'Formato de token inválido! Use: Bearer <token>'}), 401
-        else:
-            print("Nenhum header Authorization encontrado")
-            logger.warning("Requisição sem token de autenticação")
-        
+        try:
+            token = extrair_token()
+        except ValueError as e:
+            logger.warning("Formato de Authorization inválido")
+            return jsonify({'message': str(e)}), 401
+
         if not token:
-            print("Token ausente - retornando 401")
             logger.warning("Token de acesso obrigatório não fornecido")
             return jsonify({'message': 'Token de acesso é obrigatório!'}), 401
-        
+
+        inicio = time.perf_counter()
         try:
-            # Decodificar o token
-            data = jwt.decode(token, current_app.config['SECRET_KEY'], algorithms=['HS256'])
-            current_user = {
-                'username': data['username'],
-                'role': data['role'],
-                'name': data['name']
-            }
-            print(f"Token válido! Usuário: {current_user['username']}, Role: {current_user['role']}")
-            logger.info(f"Autenticação bem-sucedida para {current_user['username']}")
+            current_user = verificar_token(token)
+            tempo_autenticacao.observar(time.perf_counter() - inicio, 'ok')
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(f"Autenticação bem-sucedida para {current_user['username']} ({current_user['role']})")
         except jwt.ExpiredSignatureError:
-            print("Token expirado!")
+            tempo_autenticacao.observar(time.perf_counter() - inicio, 'expirado')
             logger.warning("Token JWT expirado")
             return jsonify({'message': 'Token expirado!'}), 401
         except jwt.InvalidTokenError:
-            print("Token inválido!")
-            logger.error("Token JWT inválido")
+            tempo_autenticacao.observar(time.perf_counter() - inicio, 'invalido')
+            logger.warning("Token JWT inválido")
             return jsonify({'message': 'Token inválido!'}), 401
-        
+
         return f(current_user, *args, **kwargs)
     return decorated
 
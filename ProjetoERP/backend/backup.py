@@ -1,80 +1,559 @@
+import gzip
 import json
 import os
 import shutil
+import hashlib
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from datetime import datetime
+
+try:
+    import fcntl
+except ImportError:  # Windows: o catálogo fica protegido só entre threads do mesmo processo
+    fcntl = None
+try:
+    import zstandard
+except ImportError:  # zstd é opcional; sem ele os backups usam gzip
+    zstandard = None
 from apscheduler.schedulers.background import BackgroundScheduler
 from apscheduler.triggers.cron import CronTrigger
 
-# Diretório para armazenar backups
-BACKUP_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'backups')
+from registros import bloquear_em_conjunto, instantaneos_em_conjunto
+from metricas import metricas, LIMITES_BACKUP
+from serializacao import codificar, decodificar
+
+# Diretório para armazenar backups (ERP_BACKUP_DIR)
+BACKUP_DIR = os.environ.get('ERP_BACKUP_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'backups'))
 os.makedirs(BACKUP_DIR, exist_ok=True)
 
-def criar_backup(ordens_servico, orcamentos, lancamentos_financeiros):
-    """Cria um backup dos dados atuais em arquivos JSON"""
+# Nomes das coleções, na ordem em que aparecem nos parâmetros das funções
+COLECOES = ('ordens_servico', 'orcamentos', 'lancamentos_financeiros')
+
+# Um backup incremental a cada N é substituído por um backup completo (nova base)
+BACKUP_BASE_A_CADA = 7
+
+# Formato 2: um registro JSON por linha, compactado, com checksum no metadata.json.
+# Backups completos no formato 1 (JSON indentado) continuam podendo ser restaurados;
+# backups incrementais só existem no formato 2.
+FORMATO_BACKUP = 2
+BACKUP_COMPRESSAO = os.environ.get('ERP_BACKUP_COMPRESSAO', 'zstd' if zstandard else 'gzip')
+EXTENSOES = {'gzip': '.ndjson.gz', 'zstd': '.ndjson.zst'}
+
+ARQUIVO_CATALOGO = 'catalogo.json'
+# Reentrante: também protege _cache_catalogo, lido e limpo dentro de _bloquear_catalogo
+_lock_catalogo = threading.RLock()
+_cache_catalogo = {}
+
+def _novo_diretorio_backup():
+    """Cria um diretório backup_<timestamp> ainda não usado e retorna (timestamp, caminho)"""
     timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
     backup_path = os.path.join(BACKUP_DIR, f'backup_{timestamp}')
-    os.makedirs(backup_path, exist_ok=True)
+    sufixo = 1
+    while os.path.exists(backup_path):
+        backup_path = os.path.join(BACKUP_DIR, f'backup_{timestamp}_{sufixo}')
+        sufixo += 1
+    os.makedirs(backup_path)
+    return timestamp, backup_path
+
+def _gravar_metadata(backup_path, metadata):
+    """Grava o metadata.json do backup e registra o backup no catálogo"""
+    with open(os.path.join(backup_path, 'metadata.json'), 'w', encoding='utf-8') as f:
+        json.dump(metadata, f, ensure_ascii=False, indent=2)
+    nome = os.path.basename(backup_path)
+    _atualizar_catalogo(lambda backups: backups.__setitem__(nome, metadata))
+
+# Catálogo: índice de todos os backups num único arquivo, para listar sem abrir cada metadata.json
+
+def _caminho_catalogo():
+    return os.path.join(BACKUP_DIR, ARQUIVO_CATALOGO)
+
+@contextmanager
+def _bloquear_catalogo():
+    """Exclusão mútua entre threads e, onde houver fcntl, entre processos"""
+    with _lock_catalogo:
+        if fcntl is None:
+            yield
+            return
+        with open(os.path.join(BACKUP_DIR, ARQUIVO_CATALOGO + '.lock'), 'a') as trava:
+            fcntl.flock(trava, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(trava, fcntl.LOCK_UN)
+
+def _ler_catalogo():
+    """Retorna {nome: metadata} do catálogo, ou None se ele não existir ou estiver ilegível"""
+    return _ler_catalogo_versionado()[1]
+
+def _ler_catalogo_versionado():
+    """Retorna (chave, backups): a chave identifica a versão do arquivo lida; (None, None) sem catálogo"""
+    caminho = _caminho_catalogo()
+    try:
+        estado = os.stat(caminho)
+    except FileNotFoundError:
+        return None, None
+    chave = (caminho, estado.st_mtime_ns, estado.st_size)
+    with _lock_catalogo:
+        if _cache_catalogo.get('chave') == chave:
+            return chave, _cache_catalogo['backups']
+    try:
+        with open(caminho, 'r', encoding='utf-8') as f:
+            backups = json.load(f)['backups']
+    except (ValueError, KeyError) as e:
+        print(f"Catálogo de backups ilegível ({e}); será reconstruído")
+        return None, None
+    with _lock_catalogo:
+        _cache_catalogo.update(chave=chave, backups=backups)
+    return chave, backups
+
+def _gravar_catalogo(backups):
+    caminho = _caminho_catalogo()
+    temporario = caminho + '.tmp'
+    with open(temporario, 'w', encoding='utf-8') as f:
+        json.dump({'versao': 1, 'backups': backups}, f, ensure_ascii=False, separators=(',', ':'))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temporario, caminho)
+    with _lock_catalogo:
+        _cache_catalogo.clear()
+
+def _varrer_backups():
+    """Lê o metadata.json de cada diretório de backup em disco"""
+    backups = {}
+    for item in os.listdir(BACKUP_DIR):
+        metadata_path = os.path.join(BACKUP_DIR, item, 'metadata.json')
+        if item.startswith('backup_') and os.path.exists(metadata_path):
+            try:
+                with open(metadata_path, 'r', encoding='utf-8') as f:
+                    backups[item] = json.load(f)
+            except ValueError as e:
+                print(f"Metadata inválido em {item}: {e}")
+    return backups
+
+def reconstruir_catalogo():
+    """Reconstrói o catálogo a partir dos backups em disco; retorna o número de backups"""
+    with _bloquear_catalogo():
+        backups = _varrer_backups()
+        _gravar_catalogo(backups)
+    print(f"Catálogo de backups reconstruído: {len(backups)} backups")
+    return len(backups)
+
+def _atualizar_catalogo(alterar):
+    """Aplica alterar(backups) ao catálogo e o regrava de forma atômica (arquivo temporário + rename)"""
+    with _bloquear_catalogo():
+        backups = _ler_catalogo()
+        backups = _varrer_backups() if backups is None else dict(backups)
+        alterar(backups)
+        _gravar_catalogo(backups)
+
+def _backups_ordenados():
+    """Entradas do catálogo, do backup mais recente para o mais antigo"""
+    chave, backups = _ler_catalogo_versionado()
+    if backups is None:
+        reconstruir_catalogo()
+        chave, backups = _ler_catalogo_versionado()
+        if backups is None:
+            return []
+    with _lock_catalogo:
+        ordenados = _cache_catalogo.get('ordenados')
+        if ordenados is not None and ordenados[0] == chave:
+            return ordenados[1]
+    # Ordenar os backups lidos aqui, e guardar a ordenação junto com a versão do catálogo de origem
+    ordenados = sorted(backups.items(), key=lambda item: (item[1]['data_criacao'], item[0]), reverse=True)
+    with _lock_catalogo:
+        _cache_catalogo['ordenados'] = (chave, ordenados)
+    return ordenados
+
+def _linha(registro):
+    """Serializa um registro numa linha NDJSON canônica (chaves ordenadas)"""
+    return codificar(registro, ordenar=True) + b'\n'
+
+def _hash_registro(registro):
+    return hashlib.blake2b(_linha(registro), digest_size=16).digest()
+
+def _abrir_compactado(caminho, modo):
+    compressao = 'zstd' if caminho.endswith('.zst') else 'gzip'
+    if compressao == 'zstd':
+        if zstandard is None:
+            raise RuntimeError("Backup compactado com zstd, mas o pacote zstandard não está instalado")
+        if modo == 'wb':
+            return zstandard.ZstdCompressor(level=3).stream_writer(open(caminho, 'wb'), closefd=True)
+        return zstandard.ZstdDecompressor().stream_reader(open(caminho, 'rb'), closefd=True)
+    return gzip.open(caminho, modo, compresslevel=6) if modo == 'wb' else gzip.open(caminho, modo)
+
+def _gravar_registros(backup_path, nome_base, registros, hashes=None, progresso=None):
+    """Grava registros em NDJSON compactado, em fluxo; retorna (arquivo, informações para o metadata).
+
+    Se hashes for um dicionário, ele recebe o hash do conteúdo de cada registro
+    gravado; progresso, se informado, é chamado a cada registro gravado.
+    """
+    arquivo = nome_base + EXTENSOES[BACKUP_COMPRESSAO]
+    checksum = hashlib.sha256()
+    quantidade = 0
+    with _abrir_compactado(os.path.join(backup_path, arquivo), 'wb') as f:
+        for registro in registros:
+            linha = _linha(registro)
+            checksum.update(linha)
+            f.write(linha)
+            quantidade += 1
+            if hashes is not None:
+                hashes[registro['id']] = hashlib.blake2b(linha, digest_size=16).digest()
+            if progresso is not None:
+                progresso()
+    return arquivo, {
+        'sha256': checksum.hexdigest(),
+        'registros': quantidade,
+        'bytes': os.path.getsize(os.path.join(backup_path, arquivo))
+    }
+
+def _ler_registros(backup_path, arquivo, informacoes):
+    """Lê um arquivo NDJSON compactado em fluxo, conferindo o checksum ao final"""
+    checksum = hashlib.sha256()
+    with _abrir_compactado(os.path.join(backup_path, arquivo), 'rb') as bruto:
+        for linhas in _blocos_de_linhas(bruto, checksum):
+            # Uma decodificação por bloco de linhas é bem mais rápida que uma por linha
+            yield from decodificar(b'[' + b','.join(linhas) + b']')
+    if checksum.hexdigest() != informacoes['sha256']:
+        raise ValueError(f"Checksum inválido em {arquivo}: o backup está corrompido")
+
+def _blocos_de_linhas(arquivo, checksum, tamanho_bloco=1 << 20):
+    """Lê um fluxo binário em blocos e devolve as linhas completas de cada um, atualizando o checksum"""
+    resto = b''
+    while True:
+        bloco = arquivo.read(tamanho_bloco)
+        if not bloco:
+            break
+        checksum.update(bloco)
+        linhas = (resto + bloco).split(b'\n')
+        resto = linhas.pop()
+        if linhas:
+            yield linhas
+    if resto.strip():
+        yield [resto]
+
+def criar_backup(ordens_servico, orcamentos, lancamentos_financeiros, hashes=None, progresso=None):
+    """Cria um backup completo dos dados atuais em arquivos NDJSON compactados.
+
+    Cada coleção é gravada em fluxo, um registro por linha, e o metadata.json
+    guarda o checksum de cada arquivo. Se hashes for informado, recebe
+    {colecao: {id: hash do conteúdo}} para uso pelos backups incrementais.
+    """
+    timestamp, backup_path = _novo_diretorio_backup()
     
     # Salvar cada conjunto de dados em arquivos separados
-    with open(os.path.join(backup_path, 'ordens_servico.json'), 'w', encoding='utf-8') as f:
-        json.dump(ordens_servico, f, ensure_ascii=False, indent=2)
-    
-    with open(os.path.join(backup_path, 'orcamentos.json'), 'w', encoding='utf-8') as f:
-        json.dump(orcamentos, f, ensure_ascii=False, indent=2)
-    
-    with open(os.path.join(backup_path, 'lancamentos_financeiros.json'), 'w', encoding='utf-8') as f:
-        json.dump(lancamentos_financeiros, f, ensure_ascii=False, indent=2)
+    arquivos = {}
+    for nome, registros in zip(COLECOES, (ordens_servico, orcamentos, lancamentos_financeiros)):
+        hashes_colecao = hashes.setdefault(nome, {}) if hashes is not None else None
+        arquivo, informacoes = _gravar_registros(backup_path, nome, registros, hashes_colecao, progresso)
+        arquivos[arquivo] = dict(informacoes, colecao=nome)
     
     # Criar um arquivo de metadados do backup
+    totais = {informacoes['colecao']: informacoes['registros'] for informacoes in arquivos.values()}
     metadata = {
         'timestamp': timestamp,
         'data_criacao': datetime.now().isoformat(),
-        'total_ordens': len(ordens_servico),
-        'total_orcamentos': len(orcamentos),
-        'total_lancamentos': len(lancamentos_financeiros)
+        'tipo': 'completo',
+        'formato': FORMATO_BACKUP,
+        'compressao': BACKUP_COMPRESSAO,
+        'arquivos': arquivos,
+        'total_ordens': totais['ordens_servico'],
+        'total_orcamentos': totais['orcamentos'],
+        'total_lancamentos': totais['lancamentos_financeiros'],
+        'tamanho_bytes': sum(informacoes['bytes'] for informacoes in arquivos.values())
     }
     
-    with open(os.path.join(backup_path, 'metadata.json'), 'w', encoding='utf-8') as f:
-        json.dump(metadata, f, ensure_ascii=False, indent=2)
+    _gravar_metadata(backup_path, metadata)
     
     print(f"Backup criado em: {backup_path}")
     return backup_path
 
+class TarefaBackup:
+    """Backup pedido e ainda sendo gravado (ou já concluído) pela thread de backups"""
+
+    def __init__(self, completo):
+        self.id = uuid.uuid4().hex
+        self.completo = completo
+        self.status = 'pendente'   # pendente, executando, concluido, erro
+        self.tipo = None           # completo ou incremental, decidido na gravação
+        self.registros_total = 0
+        self.registros_gravados = 0
+        self.caminho = None
+        self.erro = None
+        self.criado_em = datetime.now()
+        self.concluido_em = None
+        self._fim = threading.Event()
+
+    def avancar(self):
+        self.registros_gravados += 1
+
+    def aguardar(self, timeout=None):
+        """Bloqueia até a tarefa terminar; retorna False se o tempo se esgotar"""
+        return self._fim.wait(timeout)
+
+    def para_dict(self):
+        progresso = self.registros_gravados / self.registros_total if self.registros_total else 0
+        return {
+            'id': self.id,
+            'status': self.status,
+            'tipo': self.tipo,
+            'registros_total': self.registros_total,
+            'registros_gravados': self.registros_gravados,
+            'progresso': 1.0 if self.status == 'concluido' else round(min(progresso, 1.0), 4),
+            'nome': os.path.basename(self.caminho) if self.caminho else None,
+            'erro': self.erro,
+            'criado_em': self.criado_em.isoformat(),
+            'concluido_em': self.concluido_em.isoformat() if self.concluido_em else None,
+        }
+
+
+# Duração das tarefas de backup (manuais e agendadas), por tipo e resultado
+tempo_backup = metricas.histograma('erp_backup_segundos', 'Duração das tarefas de backup',
+                                   ('tipo', 'status'), LIMITES_BACKUP)
+
+
+class BackupIncremental:
+    """Gera backups diferenciais: só os registros alterados desde o backup anterior.
+
+    Observa as coleções e guarda os ids alterados desde o último backup; na
+    hora do backup, compara o hash do conteúdo de cada um com o hash gravado
+    no backup anterior e só grava os que realmente mudaram. A cada
+    BACKUP_BASE_A_CADA backups (ou depois de uma restauração, ou quando o
+    processo reinicia) é gravado um backup completo que serve de nova base.
+
+    O pedido de backup só congela as coleções (uma cópia das listas de
+    referências, tirada com os locks das três ao mesmo tempo); a serialização
+    e a escrita em disco rodam numa única thread de fundo, em ordem.
+    """
+
+    def __init__(self, ordens_servico, orcamentos, lancamentos_financeiros, base_a_cada=None,
+                 historico_tarefas=100):
+        self.colecoes = dict(zip(COLECOES, (ordens_servico, orcamentos, lancamentos_financeiros)))
+        self.base_a_cada = base_a_cada or BACKUP_BASE_A_CADA
+        self.historico_tarefas = historico_tarefas
+        self._lock = threading.Lock()
+        self._lock_pedidos = threading.Lock()
+        self._alterados = {nome: set() for nome in COLECOES}
+        self._hashes = {nome: {} for nome in COLECOES}  # hash do conteúdo no último backup
+        self._completo_pendente = True
+        self._falhou = False  # um backup falhou: o próximo precisa ser uma base nova
+        self._ultimo = None   # nome do último backup da cadeia atual
+        self._base = None
+        self._desde_base = 0
+        self._tarefas = OrderedDict()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='backup')
+        for colecao in self.colecoes.values():
+            colecao.observar(self._ao_alterar)
+
+    def _ao_alterar(self, colecao, evento, registros, anteriores):
+        with self._lock:
+            if evento == 'substituir':
+                self._completo_pendente = True
+            else:
+                self._alterados[colecao.nome].update(r['id'] for r in registros)
+
+    def _congelar(self, completo):
+        """Tira o snapshot das coleções e zera os ids alterados no mesmo instante"""
+        colecoes = [self.colecoes[nome] for nome in COLECOES]
+        with bloquear_em_conjunto(*colecoes):
+            congelados = instantaneos_em_conjunto(*colecoes)
+            with self._lock:
+                completo = completo or self._completo_pendente
+                alterados = self._alterados
+                self._alterados = {nome: set() for nome in COLECOES}
+                self._completo_pendente = False
+        return completo, congelados, alterados
+
+    def agendar(self, completo=False):
+        """Congela as coleções e agenda a gravação do backup em segundo plano; retorna a TarefaBackup"""
+        tarefa = TarefaBackup(completo)
+        # A ordem das tarefas na fila precisa ser a ordem dos snapshots
+        with self._lock_pedidos:
+            snapshot = self._congelar(completo)
+            with self._lock:
+                self._tarefas[tarefa.id] = tarefa
+                while len(self._tarefas) > self.historico_tarefas:
+                    self._tarefas.popitem(last=False)
+            self._executor.submit(self._executar, tarefa, *snapshot)
+        return tarefa
+
+    def tarefa(self, tarefa_id):
+        with self._lock:
+            return self._tarefas.get(tarefa_id)
+
+    def criar(self, completo=False, timeout=None):
+        """Cria um backup e aguarda a gravação; retorna o caminho do backup"""
+        tarefa = self.agendar(completo)
+        if not tarefa.aguardar(timeout):
+            raise TimeoutError("Tempo esgotado aguardando a gravação do backup")
+        if tarefa.status == 'erro':
+            raise RuntimeError(tarefa.erro)
+        return tarefa.caminho
+
+    def _executar(self, tarefa, completo, congelados, alterados):
+        tarefa.status = 'executando'
+        inicio = time.perf_counter()
+        try:
+            completo = (completo or self._falhou or self._ultimo is None
+                        or self._desde_base >= self.base_a_cada)
+            self._falhou = False
+            if completo:
+                tarefa.tipo = 'completo'
+                tarefa.registros_total = sum(len(registros) for registros in congelados.values())
+                tarefa.caminho = self._criar_completo(congelados, tarefa.avancar)
+            else:
+                tarefa.tipo = 'incremental'
+                tarefa.registros_total = sum(len(ids) for ids in alterados.values())
+                tarefa.caminho = self._criar_delta(congelados, alterados, tarefa.avancar)
+            tarefa.status = 'concluido'
+        except Exception as e:
+            # Sem backup gravado, a próxima execução precisa partir de uma base nova
+            self._falhou = True
+            tarefa.status = 'erro'
+            tarefa.erro = str(e)
+            print(f"Erro ao criar backup: {e}")
+        finally:
+            for instantaneo in congelados.values():
+                instantaneo.fechar()
+            tempo_backup.observar(time.perf_counter() - inicio, tarefa.tipo or 'desconhecido', tarefa.status)
+            tarefa.concluido_em = datetime.now()
+            tarefa._fim.set()
+
+    def _criar_completo(self, congelados, progresso=None):
+        hashes = {}
+        backup_path = criar_backup(*(congelados[nome] for nome in COLECOES), hashes=hashes, progresso=progresso)
+        self._hashes = hashes
+        self._ultimo = self._base = os.path.basename(backup_path)
+        self._desde_base = 0
+        return backup_path
+
+    def _mudancas(self, nome, ids, congelado, novos_hashes):
+        """Gera as entradas do delta de uma coleção: registros cujo conteúdo mudou"""
+        for id in sorted(ids):
+            registro = congelado.obter(id)
+            if registro is None:
+                continue
+            digest = _hash_registro(registro)
+            if self._hashes[nome].get(id) != digest:
+                novos_hashes[(nome, id)] = digest
+                yield {'op': 'put', 'r': registro}
+
+    def _criar_delta(self, congelados, alterados, progresso=None):
+        timestamp, backup_path = _novo_diretorio_backup()
+        metadata = {
+            'timestamp': timestamp,
+            'data_criacao': datetime.now().isoformat(),
+            'tipo': 'incremental',
+            'formato': FORMATO_BACKUP,
+            'compressao': BACKUP_COMPRESSAO,
+            'base': self._base,
+            'anterior': self._ultimo,
+            'arquivos': {},
+        }
+        novos_hashes = {}
+        for nome in COLECOES:
+            mudancas = self._mudancas(nome, alterados[nome], congelados[nome], novos_hashes)
+            arquivo, informacoes = _gravar_registros(backup_path, f'{nome}.delta', mudancas, progresso=progresso)
+            metadata['arquivos'][arquivo] = dict(informacoes, colecao=nome)
+            metadata[f'alterados_{nome}'] = informacoes['registros']
+
+        metadata['total_ordens'] = len(congelados['ordens_servico'])
+        metadata['total_orcamentos'] = len(congelados['orcamentos'])
+        metadata['total_lancamentos'] = len(congelados['lancamentos_financeiros'])
+        metadata['tamanho_bytes'] = sum(i['bytes'] for i in metadata['arquivos'].values())
+        _gravar_metadata(backup_path, metadata)
+
+        for (nome, id), digest in novos_hashes.items():
+            self._hashes[nome][id] = digest
+        self._ultimo = os.path.basename(backup_path)
+        self._desde_base += 1
+        print(f"Backup incremental criado em: {backup_path}")
+        return backup_path
+
+def _resumo_backup(nome, metadata):
+    return {
+        'nome': nome,
+        'caminho': os.path.join(BACKUP_DIR, nome),
+        'tipo': metadata.get('tipo', 'completo'),
+        'tamanho_bytes': metadata.get('tamanho_bytes'),
+        'metadata': metadata
+    }
+
 def listar_backups():
-    """Lista todos os backups disponíveis"""
-    backups = []
-    if os.path.exists(BACKUP_DIR):
-        for item in os.listdir(BACKUP_DIR):
-            item_path = os.path.join(BACKUP_DIR, item)
-            if os.path.isdir(item_path) and item.startswith('backup_'):
-                metadata_path = os.path.join(item_path, 'metadata.json')
-                if os.path.exists(metadata_path):
-                    with open(metadata_path, 'r', encoding='utf-8') as f:
-                        metadata = json.load(f)
-                    backups.append({
-                        'nome': item,
-                        'caminho': item_path,
-                        'metadata': metadata
-                    })
-    return sorted(backups, key=lambda x: x['metadata']['timestamp'], reverse=True)
+    """Lista todos os backups disponíveis, do mais recente para o mais antigo (consulta o catálogo)"""
+    return [_resumo_backup(nome, metadata) for nome, metadata in _backups_ordenados()]
+
+def pagina_backups(limite, depois_de=None):
+    """Retorna (backups, proximo): até `limite` backups mais antigos que o backup `depois_de`.
+
+    proximo é o nome a passar em depois_de para obter a página seguinte, ou None.
+    """
+    ordenados = _backups_ordenados()
+    inicio = 0
+    if depois_de is not None:
+        inicio = next((i + 1 for i, (nome, _) in enumerate(ordenados) if nome == depois_de), None)
+        if inicio is None:
+            raise KeyError(depois_de)
+    pagina = ordenados[inicio:inicio + limite]
+    proximo = pagina[-1][0] if inicio + limite < len(ordenados) else None
+    return [_resumo_backup(nome, metadata) for nome, metadata in pagina], proximo
+
+def _cadeia_backup(backup_path):
+    """Retorna [(caminho, metadata)] da base completa até o backup informado, em ordem de aplicação"""
+    cadeia = []
+    caminho = backup_path
+    while True:
+        with open(os.path.join(caminho, 'metadata.json'), 'r', encoding='utf-8') as f:
+            metadata = json.load(f)
+        cadeia.append((caminho, metadata))
+        if metadata.get('tipo', 'completo') == 'completo':
+            return list(reversed(cadeia))
+        caminho = os.path.join(os.path.dirname(caminho), metadata['anterior'])
+
+def _arquivos_por_colecao(metadata):
+    return {informacoes['colecao']: (arquivo, informacoes) for arquivo, informacoes in metadata['arquivos'].items()}
+
+def _carregar_base(caminho, metadata):
+    """Carrega um backup completo em dicionários novos {colecao: {id: registro}}"""
+    estado = {}
+    if metadata.get('formato', 1) >= 2:
+        for nome, (arquivo, informacoes) in _arquivos_por_colecao(metadata).items():
+            estado[nome] = {r['id']: r for r in _ler_registros(caminho, arquivo, informacoes)}
+    else:
+        # Formato 1: um arquivo JSON indentado por coleção
+        for nome in COLECOES:
+            with open(os.path.join(caminho, f'{nome}.json'), 'r', encoding='utf-8') as f:
+                estado[nome] = {r['id']: r for r in json.load(f)}
+    return estado
+
+def _aplicar_delta(estado, caminho, metadata):
+    """Aplica um backup incremental (sempre no formato 2) sobre o estado carregado"""
+    for nome, (arquivo, informacoes) in _arquivos_por_colecao(metadata).items():
+        for entrada in _ler_registros(caminho, arquivo, informacoes):
+            estado[nome][entrada['r']['id']] = entrada['r']
 
 def restaurar_backup(backup_path, ordens_servico, orcamentos, lancamentos_financeiros):
-    """Restaura dados de um backup"""
+    """Restaura dados de um backup; backups incrementais são reconstruídos a partir da base.
+
+    Tudo é lido (e os checksums conferidos) em estruturas novas antes de
+    tocar nas listas de destino, de modo que um backup corrompido não deixa
+    os dados pela metade.
+    """
     try:
-        # Carregar ordens de serviço
-        with open(os.path.join(backup_path, 'ordens_servico.json'), 'r', encoding='utf-8') as f:
-            ordens_servico.clear()
-            ordens_servico.extend(json.load(f))
-        
-        # Carregar orçamentos
-        with open(os.path.join(backup_path, 'orcamentos.json'), 'r', encoding='utf-8') as f:
-            orcamentos.clear()
-            orcamentos.extend(json.load(f))
-        
-        # Carregar lançamentos financeiros
-        with open(os.path.join(backup_path, 'lancamentos_financeiros.json'), 'r', encoding='utf-8') as f:
-            lancamentos_financeiros.clear()
-            lancamentos_financeiros.extend(json.load(f))
+        destinos = dict(zip(COLECOES, (ordens_servico, orcamentos, lancamentos_financeiros)))
+        cadeia = _cadeia_backup(backup_path)
+
+        # Carregar a base completa e aplicar os incrementais em ordem até o ponto pedido
+        estado = _carregar_base(*cadeia[0])
+        for caminho, metadata in cadeia[1:]:
+            _aplicar_delta(estado, caminho, metadata)
+
+        for nome, destino in destinos.items():
+            destino.clear()
+            destino.extend(estado[nome].values())
         
         print(f"Dados restaurados do backup: {backup_path}")
         return True
@@ -83,32 +562,62 @@ def restaurar_backup(backup_path, ordens_servico, orcamentos, lancamentos_financ
         return False
 
 def limpar_backups_antigos(dias_retencao=30):
-    """Remove backups mais antigos que o número especificado de dias"""
+    """Remove backups mais antigos que o número especificado de dias.
+
+    Uma base completa (e seus incrementais) só é removida quando todos os
+    backups que dependem dela também passaram do prazo de retenção.
+    """
     agora = datetime.now()
     backups = listar_backups()
-    removidos = 0
-    
+    removidos = []
+
+    # Data do backup mais recente de cada cadeia (base completa + incrementais)
+    mais_recente_da_base = {}
     for backup in backups:
+        base = backup['metadata'].get('base') or backup['nome']
         data_criacao = datetime.fromisoformat(backup['metadata']['data_criacao'])
-        diferenca_dias = (agora - data_criacao).days
+        mais_recente_da_base[base] = max(mais_recente_da_base.get(base, data_criacao), data_criacao)
+    
+    for backup in backups:
+        base = backup['metadata'].get('base') or backup['nome']
+        diferenca_dias = (agora - mais_recente_da_base[base]).days
         
         if diferenca_dias > dias_retencao:
             try:
                 shutil.rmtree(backup['caminho'])
                 print(f"Backup removido: {backup['nome']}")
-                removidos += 1
+                removidos.append(backup['nome'])
+            except FileNotFoundError:
+                removidos.append(backup['nome'])  # já não existia: só tirar do catálogo
             except Exception as e:
                 print(f"Erro ao remover backup {backup['nome']}: {e}")
-    
-    return removidos
 
-def iniciar_agendamento_backup(ordens_servico, orcamentos, lancamentos_financeiros):
-    """Inicia o agendamento automático de backups"""
+    if removidos:
+        _atualizar_catalogo(lambda catalogo: [catalogo.pop(nome, None) for nome in removidos])
+    return len(removidos)
+
+def _backup_instantaneo(*colecoes):
+    """Backup completo de um instantâneo consistente das três coleções"""
+    congelados = instantaneos_em_conjunto(*colecoes)
+    try:
+        return criar_backup(*(congelados[nome] for nome in COLECOES))
+    finally:
+        for instantaneo in congelados.values():
+            instantaneo.fechar()
+
+def iniciar_agendamento_backup(ordens_servico, orcamentos, lancamentos_financeiros, incremental=None):
+    """Inicia o agendamento automático de backups (incrementais, se um BackupIncremental for informado)"""
     scheduler = BackgroundScheduler()
     
+    if incremental is not None:
+        # Só congela as coleções; a gravação roda na thread de backups
+        job_backup = incremental.agendar
+    else:
+        job_backup = lambda: _backup_instantaneo(ordens_servico, orcamentos, lancamentos_financeiros)
+
     # Agendar backup diário às 2h da manhã
     scheduler.add_job(
-        lambda: criar_backup(ordens_servico, orcamentos, lancamentos_financeiros),
+        job_backup,
         trigger=CronTrigger(hour=2, minute=0),
         id='backup_diario'
     )
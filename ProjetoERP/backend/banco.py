@@ -0,0 +1,703 @@
+import json
+import os
+import queue
+import sqlite3
+import threading
+import time
+import uuid
+import logging
+from datetime import date
+from contextlib import contextmanager
+
+from datas import converter_data
+from registros import ColecaoBase, Registro, _atende
+from serializacao import codificar, decodificar
+
+logger = logging.getLogger(__name__)
+
+
+def _identificador(nome):
+    """Nome de tabela/coluna entre aspas; os nomes vêm do código, nunca da requisição"""
+    return '"' + nome.replace('"', '""') + '"'
+
+
+def _data(texto):
+    try:
+        return converter_data(texto)[1]
+    except ValueError:
+        return None
+
+
+def _escalar(valor):
+    """Valores que o SQLite compara como o Python (os demais são filtrados em Python)"""
+    return valor is None or isinstance(valor, (str, int, float))
+
+
+def _caminho_json(campo):
+    return '$.' + json.dumps(campo)
+
+
+# Registro de alterações compartilhado entre processos: entradas sem expiração são
+# descartadas após RETENCAO_ALTERACOES segundos (um worker mais atrasado que isso
+# recarrega tudo); a limpeza roda a cada LIMPAR_ALTERACOES_A_CADA entradas.
+RETENCAO_ALTERACOES = 3600
+LIMPAR_ALTERACOES_A_CADA = 1000
+
+
+class BancoSQLite:
+    """Arquivo SQLite compartilhado pelas coleções, com um pool de conexões.
+
+    O banco fica em modo WAL: leitores não bloqueiam o escritor e cada
+    leitura vê um instante consistente. Cada thread pega uma conexão do
+    pool durante a operação (chamadas aninhadas reutilizam a mesma, o que
+    permite agrupar mutações de várias coleções numa única transação).
+
+    Vários processos (workers do gunicorn) podem abrir o mesmo arquivo: cada
+    mutação grava uma entrada na tabela `alteracoes`, na mesma transação, e
+    sincronizar() repassa aos ouvintes de cada canal as entradas gravadas
+    pelos outros processos desde a última chamada.
+    """
+
+    def __init__(self, caminho, sincrono=None, tamanho_pool=8):
+        self.caminho = caminho
+        self.sincrono = (sincrono or os.environ.get('ERP_SQLITE_SYNCHRONOUS', 'FULL')).upper()
+        self.tamanho_pool = tamanho_pool
+        self._pool = queue.LifoQueue()
+        self._local = threading.local()
+        # Identifica as entradas gravadas por este processo no registro de alterações
+        self.origem = uuid.uuid4().hex
+        self._ouvintes = {}  # canal -> [(funcao, ao_perder)]
+        self._lock_sincronizacao = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(caminho)), exist_ok=True)
+        with self.transacao() as conexao:
+            conexao.execute('CREATE TABLE IF NOT EXISTS alteracoes (seq INTEGER PRIMARY KEY AUTOINCREMENT, '
+                            'canal TEXT NOT NULL, evento TEXT NOT NULL, dados TEXT, origem TEXT NOT NULL, '
+                            'em REAL NOT NULL, expira REAL)')
+            conexao.execute('CREATE TABLE IF NOT EXISTS versoes (colecao TEXT PRIMARY KEY, seq INTEGER, em REAL)')
+            self._visto = self._ultima_alteracao(conexao)
+
+    def _conectar(self):
+        # isolation_level=None: as transações são abertas explicitamente em transacao()
+        conexao = sqlite3.connect(self.caminho, timeout=30, isolation_level=None,
+                                  check_same_thread=False, cached_statements=256)
+        conexao.execute('PRAGMA journal_mode=WAL')
+        conexao.execute(f'PRAGMA synchronous={self.sincrono}')
+        return conexao
+
+    @contextmanager
+    def conexao(self):
+        """Conexão do pool reservada para a thread atual durante o bloco"""
+        conexao = getattr(self._local, 'conexao', None)
+        if conexao is not None:
+            yield conexao
+            return
+        try:
+            conexao = self._pool.get_nowait()
+        except queue.Empty:
+            conexao = self._conectar()
+        self._local.conexao = conexao
+        try:
+            yield conexao
+        finally:
+            self._local.conexao = None
+            if conexao.in_transaction:
+                conexao.rollback()
+            if self._pool.qsize() < self.tamanho_pool:
+                self._pool.put(conexao)
+            else:
+                conexao.close()
+
+    @contextmanager
+    def transacao(self):
+        """Transação de escrita; dentro de outra transação, apenas participa dela"""
+        with self.conexao() as conexao:
+            if conexao.in_transaction:
+                yield conexao
+                return
+            # IMMEDIATE: pega o lock de escrita já no início, evitando deadlock entre processos
+            conexao.execute('BEGIN IMMEDIATE')
+            try:
+                yield conexao
+            except BaseException:
+                conexao.execute('ROLLBACK')
+                raise
+            conexao.execute('COMMIT')
+
+    @contextmanager
+    def leitura(self):
+        """Transação de leitura: as consultas do bloco veem o mesmo instante do banco"""
+        with self.conexao() as conexao:
+            if conexao.in_transaction:
+                yield conexao
+                return
+            conexao.execute('BEGIN')
+            try:
+                yield conexao
+            finally:
+                conexao.execute('COMMIT')
+
+    # Registro de alterações entre processos
+
+    @staticmethod
+    def _ultima_alteracao(conexao):
+        linha = conexao.execute("SELECT seq FROM sqlite_sequence WHERE name = 'alteracoes'").fetchone()
+        return linha[0] if linha else 0
+
+    def registrar(self, conexao, canal, evento, dados=None, expira=None):
+        """Grava uma entrada no registro de alterações, dentro da transação em andamento.
+
+        Retorna (seq, em). Entradas com expira (timestamp) são mantidas até lá,
+        mesmo além da retenção normal.
+        """
+        em = time.time()
+        seq = conexao.execute('INSERT INTO alteracoes (canal, evento, dados, origem, em, expira) '
+                              'VALUES (?, ?, ?, ?, ?, ?)',
+                              (canal, evento, json.dumps(dados, default=str), self.origem, em, expira)).lastrowid
+        if seq % LIMPAR_ALTERACOES_A_CADA == 0:
+            conexao.execute('DELETE FROM alteracoes WHERE (expira IS NULL AND em < ?) OR expira < ?',
+                            (em - RETENCAO_ALTERACOES, em))
+        return seq, em
+
+    def publicar(self, canal, evento, dados=None, expira=None):
+        """Grava uma entrada avulsa (fora de uma mutação) para os outros processos"""
+        with self.transacao() as conexao:
+            return self.registrar(conexao, canal, evento, dados, expira)
+
+    def ouvir(self, canal, funcao, ao_perder=None, existentes=False):
+        """Registra funcao(evento, dados, seq, em), chamada para cada entrada do canal gravada por outro processo.
+
+        ao_perder(seq, em) é chamada quando entradas não vistas já foram
+        descartadas (processo atrasado além da retenção). Com existentes=True,
+        as entradas ainda guardadas do canal são repassadas já no registro.
+        """
+        with self._lock_sincronizacao:
+            self._ouvintes.setdefault(canal, []).append((funcao, ao_perder))
+            if existentes:
+                with self.conexao() as conexao:
+                    linhas = conexao.execute('SELECT seq, evento, dados, em FROM alteracoes '
+                                             'WHERE canal = ? AND seq <= ? AND (expira IS NULL OR expira > ?) '
+                                             'ORDER BY seq', (canal, self._visto, time.time())).fetchall()
+                for seq, evento, dados, em in linhas:
+                    funcao(evento, json.loads(dados), seq, em)
+
+    def sincronizar(self):
+        """Aplica as alterações gravadas pelos outros processos desde a última chamada.
+
+        Barato quando não há novidades (uma leitura de sqlite_sequence); é
+        chamado no início de cada requisição e periodicamente por
+        iniciar_sincronizacao().
+        """
+        with self._lock_sincronizacao:
+            with self.leitura() as conexao:
+                ultima = self._ultima_alteracao(conexao)
+                if ultima <= self._visto:
+                    return 0
+                linhas = conexao.execute('SELECT seq, canal, evento, dados, origem, em FROM alteracoes '
+                                         'WHERE seq > ? ORDER BY seq', (self._visto,)).fetchall()
+            if not linhas or linhas[0][0] > self._visto + 1:
+                logger.warning(f"Alterações {self._visto + 1}..{ultima} já descartadas; recarregando tudo")
+                for ouvintes in self._ouvintes.values():
+                    for _, ao_perder in ouvintes:
+                        if ao_perder:
+                            ao_perder(ultima, time.time())
+            aplicadas = 0
+            for seq, canal, evento, dados, origem, em in linhas:
+                if origem != self.origem:
+                    for funcao, _ in self._ouvintes.get(canal, ()):
+                        try:
+                            funcao(evento, json.loads(dados), seq, em)
+                        except Exception as e:
+                            logger.error(f"Falha ao aplicar alteração {seq} ({canal}): {e}")
+                    aplicadas += 1
+            self._visto = ultima
+            return aplicadas
+
+    def iniciar_sincronizacao(self, intervalo=0.5):
+        """Sincroniza periodicamente numa thread, para que eventos (SSE) e backups vejam as escritas dos outros processos"""
+        def executar():
+            while True:
+                time.sleep(intervalo)
+                try:
+                    self.sincronizar()
+                except sqlite3.Error as e:
+                    logger.error(f"Falha ao sincronizar alterações: {e}")
+        threading.Thread(target=executar, name='sqlite-sincronizacao', daemon=True).start()
+
+    def instantaneos(self, *colecoes):
+        """Retorna {nome: InstantaneoSQLite} lidos de uma única transação de leitura"""
+        leitura = _LeituraSQLite(self._conectar())
+        for colecao in colecoes:
+            # A primeira leitura fixa o instante visto por toda a transação
+            leitura.conexao.execute(f'SELECT 1 FROM {colecao._tabela} LIMIT 1').fetchall()
+        return {colecao.nome: InstantaneoSQLite(leitura, colecao) for colecao in colecoes}
+
+
+class _LeituraSQLite:
+    """Conexão dedicada com uma transação de leitura aberta até fechar()"""
+
+    def __init__(self, conexao):
+        self.conexao = conexao
+        self.conexao.execute('BEGIN')
+        self._lock = threading.Lock()
+
+    def fechar(self):
+        with self._lock:
+            if self.conexao is not None:
+                self.conexao.rollback()
+                self.conexao.close()
+                self.conexao = None
+
+
+class InstantaneoSQLite:
+    """Registros de uma coleção SQLite num instante; mesma interface de registros.Instantaneo.
+
+    Os instantâneos criados juntos compartilham a transação: fechar() qualquer
+    um deles encerra a leitura de todos.
+    """
+
+    def __init__(self, leitura, colecao):
+        self._leitura = leitura
+        self._colecao = colecao
+
+    def __len__(self):
+        return self._leitura.conexao.execute(f'SELECT COUNT(*) FROM {self._colecao._tabela}').fetchone()[0]
+
+    def __iter__(self):
+        cursor = self._leitura.conexao.execute(f'SELECT dados FROM {self._colecao._tabela} ORDER BY id')
+        return (self._colecao._registro(dados) for dados, in cursor)
+
+    def percorrer(self, intervalo=None, **criterios):
+        """Itera os registros em ordem de id que atendem aos critérios, lendo do cursor em fluxo"""
+        where, parametros, restantes = self._colecao._onde(criterios, intervalo)
+        cursor = self._leitura.conexao.execute(f'SELECT dados FROM {self._colecao._tabela}{where} ORDER BY id',
+                                               parametros)
+        registros = (self._colecao._registro(dados) for dados, in cursor)
+        if restantes:
+            registros = (r for r in registros if _atende(r, restantes))
+        return registros
+
+    def obter(self, id):
+        linha = self._leitura.conexao.execute(
+            f'SELECT dados FROM {self._colecao._tabela} WHERE id = ?', (id,)).fetchone()
+        return self._colecao._registro(linha[0]) if linha else None
+
+    def fechar(self):
+        self._leitura.fechar()
+
+
+class ColecaoSQLite(ColecaoBase):
+    """Coleção guardada numa tabela SQLite, com a mesma interface de registros.Colecao.
+
+    Cada registro fica inteiro em JSON na coluna `dados`; os campos indexados
+    e os campos de data (só a parte da data, em ISO) ganham colunas próprias
+    com índices, usadas nos filtros, na paginação e nas somas por período.
+    Os campos em `somados` também viram colunas e entram no fim dos índices
+    compostos, de modo que somar() é respondido só pelo índice. Filtros por
+    campos sem coluna usam json_extract. Os ids vêm de AUTOINCREMENT e nunca
+    são reutilizados.
+
+    As mutações feitas por outros processos chegam pelo registro de
+    alterações do banco e são repassadas aos observadores daqui; a versão da
+    coleção é a sequência global da última alteração, igual em todos os
+    processos (ETags válidos em qualquer worker).
+    """
+
+    def __init__(self, banco, nome, registros=None, indices=(), datas=(), compostos=(), somados=(), numericos=()):
+        super().__init__(nome, indices, datas, numericos)
+        self.banco = banco
+        self.compostos = tuple(tuple(c) for c in compostos)
+        self.campos_somados = tuple(somados)
+        self._tabela = _identificador(nome)
+        self._colunas = self.campos_indexados + self.campos_data + self.campos_somados
+        self._gravadores = []
+        nova = self._criar_tabela()
+        if nova and registros:
+            # Tabela criada agora: gravar o conteúdo inicial
+            self.substituir(registros)
+        with self.banco.conexao() as conexao:
+            linha = conexao.execute('SELECT seq, em FROM versoes WHERE colecao = ?', (nome,)).fetchone()
+        if linha:
+            self.versao, self.modificado_em = linha
+        self.banco.ouvir(nome, self._ao_alterar_remoto, self._ao_perder_alteracoes)
+
+    def _criar_tabela(self):
+        with self.banco.transacao() as conexao:
+            existe = conexao.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?",
+                                     (self.nome,)).fetchone()
+            colunas = ''.join(f', {_identificador(c)}' for c in self.campos_indexados)
+            colunas += ''.join(f', {_identificador(c)} TEXT' for c in self.campos_data)
+            colunas += ''.join(f', {_identificador(c)}' for c in self.campos_somados)
+            conexao.execute(f'CREATE TABLE IF NOT EXISTS {self._tabela} '
+                            f'(id INTEGER PRIMARY KEY AUTOINCREMENT{colunas}, dados TEXT NOT NULL)')
+
+            # Campos indexados incluídos depois da criação da tabela: criar a coluna e preenchê-la
+            existentes = {linha[1] for linha in conexao.execute(f'PRAGMA table_info({self._tabela})')}
+            for campo in self._colunas:
+                if campo not in existentes:
+                    logger.info(f"{self.nome}: adicionando coluna '{campo}'")
+                    conexao.execute(f'ALTER TABLE {self._tabela} ADD COLUMN {_identificador(campo)}')
+                    valor = 'json_extract(dados, ?)'
+                    if campo in self.campos_data:
+                        valor = f'substr({valor}, 1, 10)'
+                    conexao.execute(f'UPDATE {self._tabela} SET {_identificador(campo)} = {valor}',
+                                    (_caminho_json(campo),))
+
+            indices = [(c,) for c in self.campos_indexados + self.campos_data]
+            indices += [composto + self.campos_somados for composto in self.compostos]
+            for campos in indices:
+                nome_indice = _identificador(f"ix_{self.nome}_{'_'.join(campos)}")
+                conexao.execute(f'CREATE INDEX IF NOT EXISTS {nome_indice} ON {self._tabela} '
+                                f"({', '.join(_identificador(c) for c in campos)}, id)")
+            return existe is None
+
+    # Conversão entre registros e linhas
+
+    def _registro(self, dados):
+        registro = Registro(decodificar(dados))
+        for campo in self.campos_data:
+            try:
+                registro.datas[campo] = converter_data(registro.get(campo))[1]
+            except ValueError:
+                registro.datas[campo] = None
+        return registro
+
+    def _linha(self, registro):
+        valores = [registro['id']]
+        for campo in self.campos_indexados:
+            valor = registro.get(campo)
+            valores.append(valor if _escalar(valor) else None)
+        for campo in self.campos_data:
+            data = registro.datas.get(campo)
+            valores.append(data.isoformat() if data else None)
+        for campo in self.campos_somados:
+            valor = registro.get(campo)
+            valores.append(valor if _escalar(valor) else None)
+        valores.append(codificar(registro).decode('utf-8'))
+        return valores
+
+    def _sql_inserir(self, substituir=True):
+        # Sem substituir o INSERT é mais barato, mas só serve para ids que ainda não existem
+        colunas = ', '.join(['id'] + [_identificador(c) for c in self._colunas] + ['dados'])
+        marcadores = ', '.join('?' * (len(self._colunas) + 2))
+        comando = 'INSERT OR REPLACE' if substituir else 'INSERT'
+        return f'{comando} INTO {self._tabela} ({colunas}) VALUES ({marcadores})'
+
+    def _onde(self, criterios, intervalo=None):
+        """Monta (cláusula WHERE, parâmetros, critérios a conferir em Python)"""
+        condicoes, parametros, restantes = [], [], {}
+        for campo, valor in criterios.items():
+            if not _escalar(valor):
+                restantes[campo] = valor
+                continue
+            coluna = _identificador(campo) if campo in self.campos_indexados else 'json_extract(dados, ?)'
+            if campo not in self.campos_indexados:
+                parametros.append(_caminho_json(campo))
+            if valor is None:
+                condicoes.append(f'{coluna} IS NULL')
+            else:
+                condicoes.append(f'{coluna} = ?')
+                parametros.append(valor)
+        if intervalo:
+            campo, de, ate = intervalo
+            if de:
+                condicoes.append(f'{_identificador(campo)} >= ?')
+                parametros.append(de.isoformat())
+            if ate:
+                condicoes.append(f'{_identificador(campo)} <= ?')
+                parametros.append(ate.isoformat())
+            if not (de or ate):
+                condicoes.append(f'{_identificador(campo)} IS NOT NULL')
+        where = ' WHERE ' + ' AND '.join(condicoes) if condicoes else ''
+        return where, parametros, restantes
+
+    def _consultar(self, sql, parametros, restantes=None):
+        with self.banco.conexao() as conexao:
+            registros = [self._registro(dados) for dados, in conexao.execute(sql, parametros)]
+        if restantes:
+            registros = [r for r in registros if _atende(r, restantes)]
+        return registros
+
+    # Consultas
+
+    def __len__(self):
+        with self.banco.conexao() as conexao:
+            return conexao.execute(f'SELECT COUNT(*) FROM {self._tabela}').fetchone()[0]
+
+    def __contains__(self, id):
+        with self.banco.conexao() as conexao:
+            return conexao.execute(f'SELECT 1 FROM {self._tabela} WHERE id = ?', (id,)).fetchone() is not None
+
+    def obter(self, id):
+        """Retorna o registro com o id informado ou None"""
+        registros = self._consultar(f'SELECT dados FROM {self._tabela} WHERE id = ?', (id,))
+        return registros[0] if registros else None
+
+    def _obter_varios(self, ids):
+        # Ids de um lote são consecutivos: uma consulta por faixa em vez de uma por id
+        if len(ids) == 1:
+            registro = self.obter(ids[0])
+            return [registro] if registro is not None else []
+        procurados = set(ids)
+        registros = self._consultar(f'SELECT dados FROM {self._tabela} WHERE id BETWEEN ? AND ? ORDER BY id',
+                                    (min(ids), max(ids)))
+        return [r for r in registros if r['id'] in procurados]
+
+    def todos(self):
+        """Retorna todos os registros, ordenados por id"""
+        return self._consultar(f'SELECT dados FROM {self._tabela} ORDER BY id', ())
+
+    def congelar(self):
+        """Retorna (registros, proximo_id) lidos numa mesma transação"""
+        with self.banco.leitura():
+            return self.todos(), self._proximo_id()
+
+    def instantaneo(self):
+        return self.banco.instantaneos(self)[self.nome]
+
+    def filtrar(self, **criterios):
+        """Retorna os registros que atendem a todos os critérios (campo=valor), ordenados por id"""
+        where, parametros, restantes = self._onde(criterios)
+        return self._consultar(f'SELECT dados FROM {self._tabela}{where} ORDER BY id', parametros, restantes)
+
+    def contar(self, **criterios):
+        """Conta os registros que atendem aos critérios"""
+        where, parametros, restantes = self._onde(criterios)
+        if restantes:
+            return len(self.filtrar(**criterios))
+        with self.banco.conexao() as conexao:
+            return conexao.execute(f'SELECT COUNT(*) FROM {self._tabela}{where}', parametros).fetchone()[0]
+
+    def pagina(self, after_id=None, limit=None, **criterios):
+        """Retorna uma página de registros ordenados por id, a partir do cursor after_id.
+
+        Retorna (registros, proximo_after_id); proximo_after_id é None na última página.
+        """
+        where, parametros, restantes = self._onde(criterios)
+        if restantes:
+            registros = [r for r in self.filtrar(**criterios) if after_id is None or r['id'] > after_id]
+        else:
+            if after_id is not None:
+                where += (' AND' if where else ' WHERE') + ' id > ?'
+                parametros.append(after_id)
+            sql = f'SELECT dados FROM {self._tabela}{where} ORDER BY id'
+            if limit is not None:
+                # Um registro a mais indica se existe próxima página
+                sql += ' LIMIT ?'
+                parametros.append(limit + 1)
+            registros = self._consultar(sql, parametros)
+        if limit is not None and len(registros) > limit:
+            registros = registros[:limit]
+            return registros, registros[-1]['id']
+        return registros, None
+
+    def intervalo(self, campo, de=None, ate=None, **criterios):
+        """Retorna os registros com campo de data entre de e ate (inclusive), ordenados pela data"""
+        where, parametros, restantes = self._onde(criterios, (campo, de, ate))
+        sql = f'SELECT dados FROM {self._tabela}{where} ORDER BY {_identificador(campo)}, id'
+        return self._consultar(sql, parametros, restantes)
+
+    def valores(self, campo):
+        """Retorna os valores distintos de um campo indexado"""
+        with self.banco.conexao() as conexao:
+            return [v for v, in conexao.execute(f'SELECT DISTINCT {_identificador(campo)} FROM {self._tabela}')]
+
+    def somar(self, campo, intervalo=None, **criterios):
+        """Retorna (quantidade, soma do campo) dos registros que atendem aos critérios, agregados no SQLite.
+
+        intervalo=(campo_data, de, ate) restringe a um período, como em intervalo().
+        """
+        where, parametros, restantes = self._onde(criterios, intervalo)
+        if restantes:
+            registros = self.intervalo(*intervalo, **criterios) if intervalo else self.filtrar(**criterios)
+            return len(registros), sum(r.get(campo) or 0 for r in registros)
+        if campo in self.campos_somados:
+            expressao = f'TOTAL({_identificador(campo)})'
+        else:
+            expressao = 'TOTAL(json_extract(dados, ?))'
+            parametros.insert(0, _caminho_json(campo))
+        with self.banco.conexao() as conexao:
+            return tuple(conexao.execute(f'SELECT COUNT(*), {expressao} FROM {self._tabela}{where}',
+                                         parametros).fetchone())
+
+    def agrupar(self, campo, campo_data, por=(), **criterios):
+        """Retorna {(data, *valores dos campos em por): (quantidade, soma do campo)}, agrupados no SQLite"""
+        self._exigir_numerico(campo)
+        where, parametros, restantes = self._onde(criterios)
+        if restantes:
+            return super().agrupar(campo, campo_data, por, **criterios)
+        expressoes, extras = [], []
+        for c in (campo_data,) + tuple(por) + (campo,):
+            if c in self._colunas:
+                expressoes.append(_identificador(c))
+            else:
+                expressoes.append('json_extract(dados, ?)')
+                extras.append(_caminho_json(c))
+        posicoes = ', '.join(str(i) for i in range(1, len(expressoes)))
+        sql = (f"SELECT {', '.join(expressoes[:-1])}, COUNT(*), TOTAL({expressoes[-1]}) "
+               f'FROM {self._tabela}{where} GROUP BY {posicoes}')
+        with self.banco.conexao() as conexao:
+            linhas = conexao.execute(sql, extras + parametros).fetchall()
+        return {(_data(linha[0]),) + tuple(linha[1:-2]): (linha[-2], linha[-1]) for linha in linhas}
+
+    # Mutações
+
+    def _proximo_id(self):
+        with self.banco.conexao() as conexao:
+            linha = conexao.execute('SELECT seq FROM sqlite_sequence WHERE name = ?', (self.nome,)).fetchone()
+        return (linha[0] if linha else 0) + 1
+
+    def ao_gravar(self, funcao):
+        """Registra uma função chamada dentro da transação de cada mutação desta coleção.
+
+        Recebe (conexao, evento, registros, anteriores), como os observadores;
+        em 'substituir' os anteriores vêm vazios. O que ela gravar entra (ou
+        não) junto com a mutação, qualquer que seja o processo que a fez.
+        """
+        self._gravadores.append(funcao)
+
+    def agregados(self, nome, classificar):
+        """Retorna um AgregadosSQLite desta coleção"""
+        return AgregadosSQLite(self, nome, classificar)
+
+    def _gravar(self, conexao, evento, registros, anteriores):
+        for funcao in self._gravadores:
+            funcao(conexao, evento, registros, anteriores)
+
+    def _registrar(self, conexao, evento, ids=None):
+        seq, em = self.banco.registrar(conexao, self.nome, evento, {'ids': ids} if ids else None)
+        conexao.execute('INSERT OR REPLACE INTO versoes (colecao, seq, em) VALUES (?, ?, ?)', (self.nome, seq, em))
+        return seq, em
+
+    def _ao_alterar_remoto(self, evento, dados, seq, em):
+        # Mutação de outro processo: notificar com o estado atual dos registros (sem os anteriores)
+        with self._lock:
+            if evento == 'substituir':
+                self._notificar('substituir', self.todos() if self._observadores else [], [], seq, em)
+            else:
+                self._notificar(evento, self._obter_varios(dados['ids']), [], seq, em)
+
+    def _ao_perder_alteracoes(self, seq, em):
+        self._ao_alterar_remoto('substituir', None, seq, em)
+
+    def inserir(self, registro):
+        """Insere um novo registro, alocando um id único.
+
+        Levanta ValueError se algum campo de data ou numérico for inválido.
+        """
+        registro = self.preparar(registro)
+        with self._lock:
+            with self.banco.transacao() as conexao:
+                registro['id'] = self._proximo_id()
+                conexao.execute(self._sql_inserir(), self._linha(registro))
+                self._gravar(conexao, 'inserir', [registro], [])
+                seq, em = self._registrar(conexao, 'inserir', [registro['id']])
+            self._notificar('inserir', [registro], [], seq, em)
+            return registro
+
+    def inserir_lote(self, registros, preparados=False):
+        """Insere vários registros numa única transação, com um bloco de ids consecutivos.
+
+        Os observadores recebem um único evento 'inserir' com todos os registros.
+        Sem preparados=True, uma data ou um número inválido levanta ValueError
+        antes de qualquer inserção.
+        """
+        if not preparados:
+            registros = [self.preparar(r) for r in registros]
+        if not registros:
+            return []
+        with self._lock:
+            with self.banco.transacao() as conexao:
+                for id, registro in enumerate(registros, self._proximo_id()):
+                    registro['id'] = id
+                conexao.executemany(self._sql_inserir(substituir=False), (self._linha(r) for r in registros))
+                self._gravar(conexao, 'inserir', registros, [])
+                seq, em = self._registrar(conexao, 'inserir', [r['id'] for r in registros])
+            self._notificar('inserir', registros, [], seq, em)
+            return registros
+
+    def atualizar(self, id, dados):
+        """Atualiza um registro existente; o registro antigo não é alterado (cópia na escrita)"""
+        with self._lock:
+            with self.banco.transacao() as conexao:
+                antigo = self.obter(id)
+                if antigo is None:
+                    return None
+                novo = Registro(antigo)
+                novo.update(dados)
+                novo['id'] = id  # o id não pode ser alterado por atualização
+                novo.datas = dict(antigo.datas)
+                self.preparar(novo, campos=dados)
+                conexao.execute(self._sql_inserir(), self._linha(novo))
+                self._gravar(conexao, 'atualizar', [novo], [antigo])
+                seq, em = self._registrar(conexao, 'atualizar', [id])
+            self._notificar('atualizar', [novo], [antigo], seq, em)
+            return novo
+
+    def _transacao(self):
+        return self.banco.transacao()
+
+    def _trocar(self, registros, proximo_id=None):
+        with self._lock:
+            with self.banco.transacao() as conexao:
+                conexao.execute(f'DELETE FROM {self._tabela}')
+                conexao.executemany(self._sql_inserir(), (self._linha(r) for r in registros))
+                # Nunca reutilizar ids já entregues, mesmo após restaurar um backup antigo
+                maior_id = registros[-1]['id'] if registros else 0
+                sequencia = max(self._proximo_id(), maior_id + 1, proximo_id or 0) - 1
+                if conexao.execute('UPDATE sqlite_sequence SET seq = ? WHERE name = ?',
+                                   (sequencia, self.nome)).rowcount == 0:
+                    conexao.execute('INSERT INTO sqlite_sequence (name, seq) VALUES (?, ?)', (self.nome, sequencia))
+                self._gravar(conexao, 'substituir', registros, [])
+                seq, em = self._registrar(conexao, 'substituir')
+            # Os observadores descartam o conteúdo anterior numa substituição; não carregá-lo do banco
+            self._notificar('substituir', registros, [], seq, em)
+
+
+class AgregadosSQLite:
+    """Quantidade e soma por (chave, dia) dos registros de uma coleção, numa tabela do banco.
+
+    classificar(registro) retorna (chave, dia, valor): chave é uma tupla de
+    valores JSON e dia uma date ou None. A tabela é atualizada na mesma
+    transação de cada mutação (ColecaoSQLite.ao_gravar), portanto vale para
+    todos os processos sem depender da propagação das alterações; ler() custa
+    o número de agregados, não o de registros.
+    """
+
+    def __init__(self, colecao, nome, classificar):
+        self.colecao = colecao
+        self.classificar = classificar
+        self._tabela = _identificador(f'agregados_{nome}')
+        with colecao._lock, colecao.banco.transacao() as conexao:
+            existe = conexao.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?",
+                                     (f'agregados_{nome}',)).fetchone()
+            conexao.execute(f'CREATE TABLE IF NOT EXISTS {self._tabela} (chave TEXT NOT NULL, dia TEXT NOT NULL, '
+                            'quantidade INTEGER NOT NULL, soma REAL NOT NULL, PRIMARY KEY (chave, dia))')
+            if existe is None:
+                # Tabela criada agora: agregar o conteúdo atual da coleção
+                self._ao_gravar(conexao, 'substituir', colecao.todos(), [])
+        colecao.ao_gravar(self._ao_gravar)
+
+    def _ao_gravar(self, conexao, evento, registros, anteriores):
+        if evento == 'substituir':
+            conexao.execute(f'DELETE FROM {self._tabela}')
+        deltas = {}
+        for lista, sinal in ((anteriores, -1), (registros, 1)):
+            for registro in lista:
+                chave, dia, valor = self.classificar(registro)
+                delta = deltas.setdefault((codificar(list(chave)).decode('utf-8'), dia.isoformat() if dia else ''),
+                                          [0, 0.0])
+                delta[0] += sinal
+                delta[1] += sinal * valor
+        alterados = [chave for chave, delta in deltas.items() if delta[0] or delta[1]]
+        conexao.executemany(f'INSERT INTO {self._tabela} (chave, dia, quantidade, soma) VALUES (?, ?, ?, ?) '
+                            'ON CONFLICT (chave, dia) DO UPDATE SET quantidade = quantidade + excluded.quantidade, '
+                            'soma = soma + excluded.soma',
+                            [chave + tuple(deltas[chave]) for chave in alterados])
+        conexao.executemany(f'DELETE FROM {self._tabela} WHERE chave = ? AND dia = ? AND quantidade <= 0', alterados)
+
+    def ler(self):
+        """Retorna {(chave, dia): (quantidade, soma)} com todos os agregados"""
+        with self.colecao.banco.conexao() as conexao:
+            linhas = conexao.execute(f'SELECT chave, dia, quantidade, soma FROM {self._tabela}').fetchall()
+        return {(tuple(decodificar(chave)), date.fromisoformat(dia) if dia else None): (quantidade, soma)
+                for chave, dia, quantidade, soma in linhas}
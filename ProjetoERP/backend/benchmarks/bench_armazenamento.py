@@ -0,0 +1,106 @@
+"""Benchmark dos armazenamentos: coleções em memória contra SQLite (banco.py).
+
+Uso: python benchmarks/bench_armazenamento.py [--registros 200000] [--escritores 8]
+
+Para cada armazenamento mede a carga inicial, inserções concorrentes, uma
+página filtrada, as somas do fluxo de caixa, os KPIs e a memória usada.
+"""
+import argparse
+import gc
+import os
+import sys
+import tempfile
+import threading
+import time
+from datetime import date
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from registros import Colecao
+from banco import BancoSQLite, ColecaoSQLite
+from kpis import MotorKPI
+from bench_diario import lancamento, percentil
+
+INDICES = dict(indices=('tipo', 'status', 'categoria'), datas=('data_vencimento', 'data_pagamento'))
+
+
+def cronometrar(funcao, repeticoes=20):
+    """Retorna a mediana em ms de várias execuções"""
+    tempos = []
+    for _ in range(repeticoes):
+        inicio = time.perf_counter()
+        funcao()
+        tempos.append(time.perf_counter() - inicio)
+    return percentil(tempos, 50) * 1000
+
+
+def rss_atual():
+    """RSS atual do processo em MB (Linux)"""
+    with open('/proc/self/statm') as f:
+        return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 1e6
+
+
+def medir(nome, fabrica, registros, escritores):
+    dados = [lancamento(i) for i in range(1, registros + 1)]
+    gc.collect()
+    antes = rss_atual()
+    inicio = time.perf_counter()
+    lancamentos = fabrica(dados)
+    carga = time.perf_counter() - inicio
+    del dados
+    gc.collect()
+    memoria = rss_atual() - antes
+    # KPIs sem acumuladores: só as contagens e somas do armazenamento (ordens e orçamentos vazios)
+    motor = MotorKPI(Colecao('ordens_servico'), Colecao('orcamentos', datas=('data_envio',)),
+                     lancamentos, incremental=False)
+
+    latencias = []
+    lock = threading.Lock()
+
+    def escritor():
+        minhas = []
+        for _ in range(200):
+            t = time.perf_counter()
+            lancamentos.inserir(lancamento(0))
+            minhas.append(time.perf_counter() - t)
+        with lock:
+            latencias.extend(minhas)
+
+    inicio = time.perf_counter()
+    threads = [threading.Thread(target=escritor) for _ in range(escritores)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    insercoes = len(latencias) / (time.perf_counter() - inicio)
+
+    pagina = cronometrar(lambda: lancamentos.pagina(registros // 2, 100, tipo='receber', status='pendente'))
+    fluxo = cronometrar(lambda: lancamentos.somar('valor', ('data_vencimento', date(2024, 4, 1), date(2024, 4, 30)),
+                                                  tipo='receber', status='pendente'))
+    kpis = cronometrar(lambda: motor.kpis(date(2024, 4, 10)))
+    print(f"{nome}: carga {carga:.2f}s, {memoria:+.0f} MB de RSS, "
+          f"{insercoes:,.0f} inserções/s (p99 {percentil(latencias, 99) * 1000:.2f} ms), "
+          f"página filtrada {pagina:.2f} ms, soma do fluxo de caixa {fluxo:.2f} ms, KPIs {kpis:.2f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--registros', type=int, default=200000)
+    parser.add_argument('--escritores', type=int, default=8)
+    args = parser.parse_args()
+
+    medir('Memória', lambda registros: Colecao('lancamentos_financeiros', registros, **INDICES),
+          args.registros, args.escritores)
+
+    with tempfile.TemporaryDirectory() as diretorio:
+        banco = BancoSQLite(os.path.join(diretorio, 'erp.sqlite3'))
+
+        medir('SQLite', lambda registros: ColecaoSQLite(banco, 'lancamentos_financeiros', registros, **INDICES,
+                                                         compostos=[('tipo', 'status', 'data_vencimento')],
+                                                         somados=('valor',)),
+              args.registros, args.escritores)
+        print(f"Arquivo SQLite: {os.path.getsize(banco.caminho) / 1e6:.0f} MB")
+
+
+if __name__ == '__main__':
+    main()
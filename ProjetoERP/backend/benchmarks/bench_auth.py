@@ -0,0 +1,60 @@
+"""Micro-benchmark da verificação de token: requisições/s com e sem o cache de tokens.
+
+Uso: python benchmarks/bench_auth.py [--requisicoes 5000]
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import auth
+from app import app
+
+
+def medir(cliente, headers, requisicoes):
+    inicio = time.perf_counter()
+    for _ in range(requisicoes):
+        resposta = cliente.get('/api/financeiro/contas-a-receber', headers=headers)
+        assert resposta.status_code == 200, resposta.status_code
+    return requisicoes / (time.perf_counter() - inicio)
+
+
+def medir_verificacao(token, repeticoes):
+    """Mede apenas auth.verificar_token, sem o custo do roteamento do Flask"""
+    with app.test_request_context():
+        inicio = time.perf_counter()
+        for _ in range(repeticoes):
+            auth.verificar_token(token)
+        return repeticoes / (time.perf_counter() - inicio)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--requisicoes', type=int, default=5000)
+    args = parser.parse_args()
+
+    cliente = app.test_client()
+    token = cliente.post('/api/login', json={'username': 'admin', 'password': 'admin123'}).json['token']
+    headers = {'Authorization': f'Bearer {token}'}
+
+    tamanho_original = auth.cache_tokens.tamanho_maximo
+    auth.cache_tokens.tamanho_maximo = 0
+    sem_cache = medir(cliente, headers, args.requisicoes)
+    verificacao_sem_cache = medir_verificacao(token, args.requisicoes * 10)
+
+    auth.cache_tokens.tamanho_maximo = tamanho_original or 10000
+    auth.cache_tokens.limpar()
+    com_cache = medir(cliente, headers, args.requisicoes)
+    verificacao_com_cache = medir_verificacao(token, args.requisicoes * 10)
+
+    print(f"Requisições sem cache de tokens: {sem_cache:,.0f} req/s")
+    print(f"Requisições com cache de tokens: {com_cache:,.0f} req/s ({com_cache / sem_cache:.2f}x)")
+    print(f"verificar_token sem cache: {verificacao_sem_cache:,.0f} verificações/s")
+    print(f"verificar_token com cache: {verificacao_com_cache:,.0f} verificações/s "
+          f"({verificacao_com_cache / verificacao_sem_cache:.2f}x)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,114 @@
+"""Benchmark do formato de backup: JSON indentado (formato 1) contra NDJSON compactado (formato 2).
+
+Uso: python benchmarks/bench_backup.py [--registros 500000]
+
+Para cada formato mede o tamanho em disco, o tempo de gravação e de restauração
+e o pico de memória alocada (tracemalloc) durante cada etapa.
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import backup
+
+
+def lancamento(i):
+    return {
+        'id': i,
+        'tipo': 'receber' if i % 2 else 'pagar',
+        'descricao': f'Lançamento {i}',
+        'valor': float(i % 5000),
+        'data_vencimento': f'2024-{i % 12 + 1:02d}-{i % 28 + 1:02d}',
+        'data_pagamento': None,
+        'status': 'pendente',
+        'categoria': 'venda',
+    }
+
+
+def medir(funcao):
+    """Executa a função duas vezes: uma para medir o tempo e outra, com tracemalloc, para o pico de memória.
+
+    Retorna (resultado, segundos, pico em MB); o tracemalloc fica de fora da
+    medição de tempo porque deixa a execução várias vezes mais lenta.
+    """
+    inicio = time.perf_counter()
+    resultado = funcao()
+    duracao = time.perf_counter() - inicio
+    tracemalloc.start()
+    funcao()
+    _, pico = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return resultado, duracao, pico / 1e6
+
+
+def tamanho_diretorio(caminho):
+    return sum(os.path.getsize(os.path.join(caminho, n)) for n in os.listdir(caminho))
+
+
+def formato_antigo(diretorio, lancamentos):
+    """Gravação e leitura como eram feitas antes: json.dump com indent=2 de cada coleção inteira"""
+    caminho = os.path.join(diretorio, 'formato1')
+    os.makedirs(caminho)
+
+    def gravar():
+        for nome, dados in zip(backup.COLECOES, ([], [], lancamentos)):
+            with open(os.path.join(caminho, f'{nome}.json'), 'w', encoding='utf-8') as f:
+                json.dump(dados, f, ensure_ascii=False, indent=2, default=str)
+
+    def restaurar():
+        destino = []
+        with open(os.path.join(caminho, 'lancamentos_financeiros.json'), 'r', encoding='utf-8') as f:
+            destino.extend(json.load(f))
+        return destino
+
+    return caminho, gravar, restaurar
+
+
+def formato_novo(diretorio, lancamentos):
+    backup.BACKUP_DIR = diretorio
+    estado = {}
+
+    def gravar():
+        estado['caminho'] = backup.criar_backup([], [], lancamentos)
+
+    def restaurar():
+        destino = []
+        assert backup.restaurar_backup(estado['caminho'], [], [], destino)
+        return destino
+
+    return estado, gravar, restaurar
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--registros', type=int, default=500000)
+    args = parser.parse_args()
+    lancamentos = [lancamento(i) for i in range(1, args.registros + 1)]
+
+    with tempfile.TemporaryDirectory() as diretorio:
+        caminho, gravar, restaurar = formato_antigo(diretorio, lancamentos)
+        _, t_gravar, m_gravar = medir(gravar)
+        restaurados, t_restaurar, m_restaurar = medir(restaurar)
+        assert len(restaurados) == args.registros
+        print(f"Formato 1 (JSON indentado): {tamanho_diretorio(caminho) / 1e6:.1f} MB, "
+              f"gravação {t_gravar:.2f}s / pico {m_gravar:.0f} MB, "
+              f"restauração {t_restaurar:.2f}s / pico {m_restaurar:.0f} MB")
+
+    with tempfile.TemporaryDirectory() as diretorio:
+        estado, gravar, restaurar = formato_novo(diretorio, lancamentos)
+        _, t_gravar, m_gravar = medir(gravar)
+        restaurados, t_restaurar, m_restaurar = medir(restaurar)
+        assert len(restaurados) == args.registros
+        print(f"Formato 2 (NDJSON {backup.BACKUP_COMPRESSAO}): {tamanho_diretorio(estado['caminho']) / 1e6:.1f} MB, "
+              f"gravação {t_gravar:.2f}s / pico {m_gravar:.0f} MB, "
+              f"restauração {t_restaurar:.2f}s / pico {m_restaurar:.0f} MB")
+
+
+if __name__ == '__main__':
+    main()
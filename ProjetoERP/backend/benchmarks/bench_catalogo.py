@@ -0,0 +1,71 @@
+"""Benchmark da listagem de backups: varredura de todos os metadata.json contra o catálogo.
+
+Uso: python benchmarks/bench_catalogo.py [--backups 4000]
+
+Cria --backups diretórios de backup falsos (só o metadata.json, como ~6 meses
+de backups de hora em hora) e mede a listagem completa e a primeira página.
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import backup
+
+
+def criar_backups_falsos(quantidade):
+    inicio = datetime(2024, 1, 1)
+    for i in range(quantidade):
+        data = inicio + timedelta(hours=i)
+        nome = f"backup_{data.strftime('%Y%m%d_%H%M%S')}"
+        os.makedirs(os.path.join(backup.BACKUP_DIR, nome))
+        metadata = {
+            'timestamp': data.strftime('%Y%m%d_%H%M%S'),
+            'data_criacao': data.isoformat(),
+            'tipo': 'completo' if i % backup.BACKUP_BASE_A_CADA == 0 else 'incremental',
+            'formato': backup.FORMATO_BACKUP,
+            'arquivos': {f'{n}.ndjson.zst': {'sha256': '0' * 64, 'registros': 10, 'bytes': 100, 'colecao': n}
+                         for n in backup.COLECOES},
+            'tamanho_bytes': 300,
+        }
+        with open(os.path.join(backup.BACKUP_DIR, nome, 'metadata.json'), 'w', encoding='utf-8') as f:
+            json.dump(metadata, f, ensure_ascii=False, indent=2)
+
+
+def cronometrar(funcao, repeticoes=5):
+    inicio = time.perf_counter()
+    for _ in range(repeticoes):
+        funcao()
+    return (time.perf_counter() - inicio) / repeticoes * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--backups', type=int, default=4000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as diretorio:
+        backup.BACKUP_DIR = diretorio
+        criar_backups_falsos(args.backups)
+
+        varredura = cronometrar(backup._varrer_backups)
+        reconstrucao = cronometrar(backup.reconstruir_catalogo, repeticoes=1)
+        backup._cache_catalogo.clear()
+        primeira_leitura = cronometrar(backup.listar_backups, repeticoes=1)
+        completa = cronometrar(backup.listar_backups)
+        pagina = cronometrar(lambda: backup.pagina_backups(50))
+
+        print(f"{args.backups} backups")
+        print(f"Varredura dos metadata.json (como antes): {varredura:.1f} ms")
+        print(f"Reconstrução do catálogo: {reconstrucao:.1f} ms")
+        print(f"Listagem pelo catálogo: {primeira_leitura:.1f} ms (leitura do arquivo), {completa:.1f} ms (em cache)")
+        print(f"Primeira página (50) pelo catálogo: {pagina:.2f} ms")
+
+
+if __name__ == '__main__':
+    main()
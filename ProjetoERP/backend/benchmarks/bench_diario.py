@@ -0,0 +1,110 @@
+"""Benchmark do diário (write-ahead log): tempo de recuperação e latência de escrita com group commit.
+
+Uso: python benchmarks/bench_diario.py [--registros 1000000] [--cauda 100000] [--escritores 16]
+
+1. Grava um snapshot com --registros lançamentos e um diário com --cauda
+   atualizações, e mede o tempo para recuperar tudo numa coleção vazia.
+2. Mede a latência de inserções concorrentes aguardando o fsync (group commit).
+"""
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from registros import Colecao
+from diario import Diario
+
+
+def nova_colecao(registros=None):
+    return Colecao('lancamentos_financeiros', registros, indices=('tipo', 'status', 'categoria'),
+                   datas=('data_vencimento', 'data_pagamento'))
+
+
+def lancamento(i):
+    return {
+        'id': i,
+        'tipo': 'receber' if i % 2 else 'pagar',
+        'descricao': f'Lançamento {i}',
+        'valor': float(i % 5000),
+        'data_vencimento': f'2024-{i % 12 + 1:02d}-{i % 28 + 1:02d}',
+        'data_pagamento': None,
+        'status': 'pendente',
+        'categoria': 'venda',
+    }
+
+
+def percentil(valores, p):
+    ordenados = sorted(valores)
+    return ordenados[min(len(ordenados) - 1, int(len(ordenados) * p / 100))]
+
+
+def medir_recuperacao(diretorio, registros, cauda):
+    colecao = nova_colecao([lancamento(i) for i in range(1, registros + 1)])
+    diario = Diario(diretorio, intervalo_snapshot=3600, limite_entradas=10 ** 9)
+    diario.recuperar(colecao)
+    diario.iniciar()  # diretório vazio: grava o snapshot inicial
+
+    for i in range(1, cauda + 1):
+        colecao.atualizar(i, {'status': 'pago', 'data_pagamento': '2024-06-01'})
+    diario.aguardar(diario._lsn)
+
+    tamanho = sum(os.path.getsize(os.path.join(diretorio, n)) for n in os.listdir(diretorio))
+    inicio = time.perf_counter()
+    recuperada = nova_colecao()
+    reaplicadas = Diario(diretorio).recuperar(recuperada)
+    duracao = time.perf_counter() - inicio
+    assert len(recuperada) == registros and reaplicadas == cauda
+    print(f"Recuperação: {registros:,} registros + {cauda:,} entradas do diário "
+          f"({tamanho / 1e6:.0f} MB) em {duracao:.2f}s")
+
+
+def medir_escrita(diretorio, escritores, por_escritor):
+    colecao = nova_colecao()
+    diario = Diario(diretorio)
+    diario.recuperar(colecao)
+    diario.iniciar()
+    latencias = []
+    lock = threading.Lock()
+
+    def escritor():
+        minhas = []
+        for i in range(por_escritor):
+            inicio = time.perf_counter()
+            colecao.inserir(lancamento(0))
+            diario.aguardar_pendente()
+            minhas.append(time.perf_counter() - inicio)
+        with lock:
+            latencias.extend(minhas)
+
+    inicio = time.perf_counter()
+    threads = [threading.Thread(target=escritor) for _ in range(escritores)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    duracao = time.perf_counter() - inicio
+    print(f"Escrita: {len(latencias):,} inserções com {escritores} escritores em {duracao:.2f}s "
+          f"({len(latencias) / duracao:,.0f}/s), p50 {percentil(latencias, 50) * 1000:.2f} ms, "
+          f"p99 {percentil(latencias, 99) * 1000:.2f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--registros', type=int, default=1000000)
+    parser.add_argument('--cauda', type=int, default=100000)
+    parser.add_argument('--escritores', type=int, default=16)
+    parser.add_argument('--insercoes', type=int, default=500, help='inserções por escritor')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as diretorio:
+        medir_recuperacao(diretorio, args.registros, args.cauda)
+    with tempfile.TemporaryDirectory() as diretorio:
+        medir_escrita(diretorio, args.escritores, args.insercoes)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,57 @@
+"""Benchmark de login sob carga concorrente: latência p50/p99 e logins/s.
+
+Uso: python benchmarks/bench_login.py [--clientes 16] [--logins 200]
+
+O algoritmo e o custo do hash seguem ERP_SENHA_ALGORITMO / ERP_SENHA_CUSTO, e o
+tamanho do pool segue ERP_SENHA_WORKERS / ERP_SENHA_FILA.
+"""
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from app import app
+from senhas import verificador
+
+
+def percentil(valores, p):
+    ordenados = sorted(valores)
+    return ordenados[min(len(ordenados) - 1, int(len(ordenados) * p / 100))]
+
+
+def login(_):
+    cliente = app.test_client()
+    inicio = time.perf_counter()
+    resposta = cliente.post('/api/login', json={'username': 'admin', 'password': 'admin123'})
+    return time.perf_counter() - inicio, resposta.status_code
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--clientes', type=int, default=16)
+    parser.add_argument('--logins', type=int, default=200)
+    args = parser.parse_args()
+
+    login(None)  # gera o hash do usuário (preguiçoso) fora da medição
+
+    inicio = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.clientes) as executor:
+        resultados = list(executor.map(login, range(args.logins)))
+    duracao = time.perf_counter() - inicio
+
+    latencias = [t for t, status in resultados if status == 200]
+    recusados = sum(1 for _, status in resultados if status == 503)
+    print(f"Algoritmo: {verificador.hasher.nome} (custo {verificador.hasher.custo}), "
+          f"workers: {verificador.workers}, clientes: {args.clientes}")
+    print(f"Logins: {len(latencias)} ok, {recusados} recusados (503) em {duracao:.2f}s "
+          f"({len(resultados) / duracao:.1f}/s)")
+    if latencias:
+        print(f"Latência p50: {percentil(latencias, 50) * 1000:.0f} ms, "
+              f"p99: {percentil(latencias, 99) * 1000:.0f} ms")
+
+
+if __name__ == '__main__':
+    main()
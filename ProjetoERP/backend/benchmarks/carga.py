@@ -0,0 +1,431 @@
+"""Teste de carga da API: semeia dados sintéticos e mede os endpoints reais com clientes concorrentes.
+
+Uso: python benchmarks/carga.py [--tamanhos 10000,100000,1000000] [--clientes 16] [--requisicoes 2000]
+                                [--armazenamento memoria|sqlite] [--servidor] [--workers 4]
+                                [--saida resultado.json] [--comparar anterior.json]
+
+Cada tamanho roda num subprocesso novo, com diretórios de dados e de backups
+temporários, semeado com o mesmo número de ordens, orçamentos e lançamentos.
+Por padrão as requisições passam pelo Flask test client dentro do processo;
+com --servidor o app sobe no gunicorn (SQLite, --workers processos) e os
+clientes usam HTTP com keep-alive.
+
+O resultado em JSON traz, por tamanho e cenário, requisições, erros, vazão
+(req/s) e latências p50/p95/p99 em ms, além do pico de RSS durante a carga
+(somando os workers no modo --servidor). --comparar mostra a variação em
+relação a um resultado anterior, por exemplo gravado em outro commit.
+"""
+import argparse
+import http.client
+import json
+import os
+import platform
+import random
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+from urllib.parse import quote
+
+BACKEND = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, BACKEND)
+
+from bench_diario import percentil
+
+STATUS_ORDENS = ('Aguardando Medição', 'Em Fabricação', 'Instalação Agendada', 'Finalizado')
+STATUS_ORCAMENTOS = ('enviado', 'aprovado', 'recusado')
+CATEGORIAS = ('venda', 'fornecedor', 'servico', 'imposto')
+
+
+# Dados sintéticos (determinísticos: o mesmo tamanho gera sempre os mesmos registros)
+
+def _data(i, ano=2024):
+    return (date(ano, 1, 1) + timedelta(days=i % 365)).isoformat()
+
+
+def ordem(i):
+    return {'id': i, 'cliente': f'Cliente {i % 5000}', 'produto': 'Toldo em Lona',
+            'status': STATUS_ORDENS[i % len(STATUS_ORDENS)], 'data_criacao': _data(i),
+            'agendamento': f'{_data(i + 7)} 10:00'}
+
+
+def orcamento(i):
+    return {'id': i, 'cliente': f'Cliente {i % 5000}', 'produto': 'Cobertura em Policarbonato Fixa',
+            'valor': float(500 + i % 4500), 'data_envio': _data(i),
+            'status': STATUS_ORCAMENTOS[i % len(STATUS_ORCAMENTOS)], 'validade': _data(i + 30)}
+
+
+def lancamento(i):
+    pago = i % 3 == 0
+    return {'id': i, 'tipo': 'receber' if i % 2 else 'pagar', 'descricao': f'Lançamento {i}',
+            'valor': float(i % 5000), 'data_vencimento': _data(i),
+            'data_pagamento': _data(i - 2) if pago else None, 'status': 'pago' if pago else 'pendente',
+            'categoria': CATEGORIAS[i % len(CATEGORIAS)]}
+
+
+# Clientes
+
+class ClienteTeste:
+    """Requisições pelo Flask test client, um por thread"""
+
+    def __init__(self, app):
+        self.app = app
+        self.token = None
+        self._local = threading.local()
+
+    def requisitar(self, metodo, caminho, corpo=None):
+        cliente = getattr(self._local, 'cliente', None)
+        if cliente is None:
+            cliente = self._local.cliente = self.app.test_client()
+        headers = {'Authorization': f'Bearer {self.token}'} if self.token else {}
+        resposta = cliente.open(caminho, method=metodo, json=corpo, headers=headers)
+        return resposta.status_code, resposta.get_data()
+
+
+class ClienteHTTP:
+    """Requisições HTTP a um servidor local, com uma conexão keep-alive por thread"""
+
+    def __init__(self, host, porta):
+        self.host, self.porta = host, porta
+        self.token = None
+        self._local = threading.local()
+
+    def requisitar(self, metodo, caminho, corpo=None):
+        headers = {'Content-Type': 'application/json'}
+        if self.token:
+            headers['Authorization'] = f'Bearer {self.token}'
+        dados = json.dumps(corpo).encode('utf-8') if corpo is not None else None
+        for tentativa in range(2):
+            conexao = getattr(self._local, 'conexao', None)
+            if conexao is None:
+                conexao = self._local.conexao = http.client.HTTPConnection(self.host, self.porta, timeout=300)
+            try:
+                conexao.request(metodo, caminho, body=dados, headers=headers)
+                resposta = conexao.getresponse()
+                return resposta.status, resposta.read()
+            except (http.client.HTTPException, OSError):
+                # Conexão encerrada pelo servidor (keep-alive expirado): reconectar uma vez
+                conexao.close()
+                self._local.conexao = None
+                if tentativa:
+                    raise
+
+
+# Memória
+
+def _rss_mb(pid):
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for linha in f:
+                if linha.startswith('VmRSS:'):
+                    return int(linha.split()[1]) / 1024
+    except OSError:
+        pass
+    return 0.0
+
+
+def _filhos(pid):
+    try:
+        with open(f'/proc/{pid}/task/{pid}/children') as f:
+            return [int(p) for p in f.read().split()]
+    except OSError:
+        return []
+
+
+class MedidorRSS:
+    """Amostra periodicamente o RSS somado de um processo e de seus filhos (Linux) e guarda o pico"""
+
+    def __init__(self, pid, intervalo=0.05):
+        self.pid = pid
+        self.intervalo = intervalo
+        self.pico = 0.0
+        self._parar = threading.Event()
+        self._thread = threading.Thread(target=self._amostrar, daemon=True)
+
+    def atual(self):
+        return _rss_mb(self.pid) + sum(_rss_mb(p) for p in _filhos(self.pid))
+
+    def _amostrar(self):
+        while not self._parar.is_set():
+            self.pico = max(self.pico, self.atual())
+            self._parar.wait(self.intervalo)
+
+    def __enter__(self):
+        self.pico = self.atual()
+        self._thread.start()
+        return self
+
+    def __exit__(self, *excecao):
+        self._parar.set()
+        self._thread.join()
+
+
+# Cenários
+
+def resumir(latencias, erros, duracao):
+    return {
+        'requisicoes': len(latencias),
+        'erros': erros,
+        'duracao_s': round(duracao, 3),
+        'throughput_rps': round(len(latencias) / duracao, 1) if duracao else None,
+        'p50_ms': round(percentil(latencias, 50) * 1000, 2),
+        'p95_ms': round(percentil(latencias, 95) * 1000, 2),
+        'p99_ms': round(percentil(latencias, 99) * 1000, 2),
+    }
+
+
+def executar_cenario(cliente, gerar, requisicoes, clientes):
+    """Dispara `requisicoes` chamadas de gerar(i) -> (metodo, caminho, corpo) com `clientes` threads"""
+    def uma(i):
+        metodo, caminho, corpo = gerar(i)
+        inicio = time.perf_counter()
+        status, _ = cliente.requisitar(metodo, caminho, corpo)
+        return time.perf_counter() - inicio, status
+
+    inicio = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=clientes) as executor:
+        resultados = list(executor.map(uma, range(requisicoes)))
+    duracao = time.perf_counter() - inicio
+    return resumir([t for t, _ in resultados], sum(1 for _, s in resultados if s >= 400), duracao)
+
+
+def executar_backup(cliente, caminho, repeticoes):
+    """Agenda backups um de cada vez e mede até a tarefa terminar (consultando o status)"""
+    latencias, erros, ultimo = [], 0, None
+    inicio = time.perf_counter()
+    for _ in range(repeticoes):
+        t = time.perf_counter()
+        status, corpo = cliente.requisitar('POST', caminho)
+        if status != 202:
+            erros += 1
+            continue
+        tarefa = json.loads(corpo)['tarefa']
+        while tarefa['status'] in ('pendente', 'executando'):
+            time.sleep(0.02)
+            _, corpo = cliente.requisitar('GET', f"/api/backup/status/{tarefa['id']}")
+            tarefa = json.loads(corpo)
+        latencias.append(time.perf_counter() - t)
+        if tarefa['status'] != 'concluido':
+            erros += 1
+        else:
+            ultimo = tarefa['nome']
+    return resumir(latencias, erros, time.perf_counter() - inicio), ultimo
+
+
+def executar_restauracao(cliente, nome, repeticoes):
+    latencias, erros = [], 0
+    inicio = time.perf_counter()
+    for _ in range(repeticoes):
+        t = time.perf_counter()
+        status, _ = cliente.requisitar('POST', f'/api/backup/restore/{nome}')
+        latencias.append(time.perf_counter() - t)
+        erros += status >= 400
+    return resumir(latencias, erros, time.perf_counter() - inicio)
+
+
+def cenarios(cliente, tamanho, args):
+    """Executa os cenários na ordem e retorna {nome: resumo}"""
+    aleatorio = random.Random(tamanho)
+    resultados = {}
+    n, c = args.requisicoes, args.clientes
+
+    def pagina(caminho):
+        return lambda i: ('GET', f'{caminho}?limit=100&after_id={aleatorio.randrange(tamanho)}', None)
+
+    def mes(caminho):
+        def gerar(i):
+            inicio = date(2024, aleatorio.randrange(1, 13), 1)
+            fim = (inicio + timedelta(days=31)).replace(day=1) - timedelta(days=1)
+            return 'GET', f'{caminho}?de={inicio.isoformat()}&ate={fim.isoformat()}', None
+        return gerar
+
+    login = {'username': 'admin', 'password': 'admin123'}
+    resultados['login'] = executar_cenario(cliente, lambda i: ('POST', '/api/login', login), args.logins, c)
+    resultados['projetos'] = executar_cenario(cliente, pagina('/api/projetos'), n, c)
+    resultados['projetos_por_status'] = executar_cenario(
+        cliente, lambda i: ('GET', f'/api/projetos?limit=100&status={quote(STATUS_ORDENS[i % 4])}', None), n, c)
+    resultados['contas_a_receber'] = executar_cenario(cliente, pagina('/api/financeiro/contas-a-receber'), n, c)
+    resultados['contas_a_pagar'] = executar_cenario(cliente, pagina('/api/financeiro/contas-a-pagar'), n, c)
+    resultados['fluxo_caixa'] = executar_cenario(cliente, mes('/api/financeiro/fluxo-caixa'), n, c)
+    resultados['relatorios'] = executar_cenario(cliente, mes('/api/financeiro/relatorios'), n, c)
+    resultados['kpis'] = executar_cenario(cliente, lambda i: ('GET', '/api/dashboard/kpis', None), n, c)
+    novo = {'tipo': 'receber', 'descricao': 'Carga', 'valor': 10.0, 'data_vencimento': date.today().isoformat(),
+            'status': 'pendente', 'categoria': 'venda'}
+    resultados['criar_lancamento'] = executar_cenario(
+        cliente, lambda i: ('POST', '/api/financeiro/lancamento', novo), n // 4, c)
+
+    if args.backups:
+        resultados['backup_completo'], base = executar_backup(
+            cliente, '/api/backup/create?tipo=completo', args.backups)
+        executar_cenario(cliente, lambda i: ('POST', '/api/financeiro/lancamento', novo), 100, c)
+        resultados['backup_incremental'], _ = executar_backup(cliente, '/api/backup/create', args.backups)
+        if base:
+            resultados['restauracao'] = executar_restauracao(cliente, base, args.backups)
+    return resultados
+
+
+# Execução de um tamanho (subprocesso)
+
+def _porta_livre():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def _aguardar_servidor(porta, processo, timeout=120):
+    limite = time.time() + timeout
+    while time.time() < limite:
+        if processo.poll() is not None:
+            raise RuntimeError(f'gunicorn terminou com código {processo.returncode}')
+        try:
+            with socket.create_connection(('127.0.0.1', porta), timeout=1):
+                return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError('gunicorn não respondeu a tempo')
+
+
+def executar_tamanho(tamanho, diretorio, args):
+    os.environ['ERP_DADOS_DIR'] = os.path.join(diretorio, 'dados')
+    os.environ['ERP_BACKUP_DIR'] = os.path.join(diretorio, 'backups')
+    os.environ['ERP_ARMAZENAMENTO'] = 'sqlite' if args.servidor else args.armazenamento
+    os.environ.setdefault('ERP_LOG_LEVEL', 'WARNING')
+
+    import app as modulo
+    from registros import substituir_em_conjunto
+
+    inicio = time.perf_counter()
+    substituir_em_conjunto((modulo.ordens_servico, [ordem(i) for i in range(1, tamanho + 1)]),
+                           (modulo.orcamentos, [orcamento(i) for i in range(1, tamanho + 1)]),
+                           (modulo.lancamentos_financeiros, [lancamento(i) for i in range(1, tamanho + 1)]))
+    semeadura = time.perf_counter() - inicio
+
+    servidor = None
+    if args.servidor:
+        porta = _porta_livre()
+        ambiente = dict(os.environ, ERP_BIND=f'127.0.0.1:{porta}', ERP_WORKERS=str(args.workers))
+        servidor = subprocess.Popen([sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', 'wsgi:app'],
+                                    cwd=BACKEND, env=ambiente, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        _aguardar_servidor(porta, servidor)
+        cliente = ClienteHTTP('127.0.0.1', porta)
+        medidor = MedidorRSS(servidor.pid)
+    else:
+        cliente = ClienteTeste(modulo.app)
+        medidor = MedidorRSS(os.getpid())
+
+    try:
+        status, corpo = cliente.requisitar('POST', '/api/login', {'username': 'admin', 'password': 'admin123'})
+        cliente.token = json.loads(corpo)['token']
+        rss_inicial = medidor.atual()
+        with medidor:
+            resultados = cenarios(cliente, tamanho, args)
+    finally:
+        if servidor:
+            # SIGINT: encerramento imediato (SIGTERM esperaria as conexões keep-alive dos clientes)
+            servidor.send_signal(signal.SIGINT)
+            servidor.wait()
+
+    return {
+        'tamanho': tamanho,
+        'semeadura_s': round(semeadura, 2),
+        'rss_inicial_mb': round(rss_inicial, 1),
+        'rss_pico_mb': round(medidor.pico, 1),
+        'cenarios': resultados,
+    }
+
+
+# Comparação entre resultados
+
+def comparar(atual, anterior):
+    """Imprime a variação de vazão e de p99 por tamanho e cenário em relação a um resultado anterior"""
+    anteriores = {r['tamanho']: r for r in anterior['resultados']}
+    print(f"Comparação com {anterior['meta'].get('commit') or 'resultado anterior'}:")
+    for resultado in atual['resultados']:
+        base = anteriores.get(resultado['tamanho'])
+        if base is None:
+            continue
+        print(f"  {resultado['tamanho']} registros: RSS {base['rss_pico_mb']:.0f} -> {resultado['rss_pico_mb']:.0f} MB")
+        for nome, cenario in resultado['cenarios'].items():
+            antes = base['cenarios'].get(nome)
+            if not antes or not antes['throughput_rps'] or not antes['p99_ms']:
+                continue
+            vazao = (cenario['throughput_rps'] / antes['throughput_rps'] - 1) * 100
+            p99 = (cenario['p99_ms'] / antes['p99_ms'] - 1) * 100
+            print(f"    {nome:22} vazão {vazao:+6.1f}%  p99 {p99:+6.1f}%")
+
+
+def _commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=BACKEND, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--tamanhos', default='10000,100000',
+                        help='registros por coleção, separados por vírgula (ex.: 10000,100000,1000000)')
+    parser.add_argument('--clientes', type=int, default=16)
+    parser.add_argument('--requisicoes', type=int, default=2000, help='requisições por cenário de leitura')
+    parser.add_argument('--logins', type=int, default=200)
+    parser.add_argument('--backups', type=int, default=2, help='repetições de backup e restauração (0 desliga)')
+    parser.add_argument('--armazenamento', choices=('memoria', 'sqlite'), default='memoria')
+    parser.add_argument('--servidor', action='store_true', help='servir pelo gunicorn (SQLite) em vez do test client')
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--saida', help='arquivo JSON do resultado (padrão: saída padrão)')
+    parser.add_argument('--comparar', help='resultado JSON anterior para comparação')
+    parser.add_argument('--executar', type=int, help=argparse.SUPPRESS)
+    parser.add_argument('--diretorio', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.executar:
+        resultado = executar_tamanho(args.executar, args.diretorio, args)
+        with open(os.path.join(args.diretorio, 'resultado.json'), 'w', encoding='utf-8') as f:
+            json.dump(resultado, f)
+        return
+
+    meta = {
+        'commit': _commit(),
+        'data': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'plataforma': platform.platform(),
+        'cpus': os.cpu_count(),
+        'armazenamento': 'sqlite' if args.servidor else args.armazenamento,
+        'modo': f'gunicorn ({args.workers} workers)' if args.servidor else 'test client',
+        'clientes': args.clientes,
+        'requisicoes': args.requisicoes,
+    }
+    resultados = []
+    for tamanho in (int(t) for t in args.tamanhos.split(',')):
+        # Um processo por tamanho: memória e caches de um não afetam a medição do outro
+        with tempfile.TemporaryDirectory(prefix='erp-carga-') as diretorio:
+            comando = [sys.executable, os.path.abspath(__file__), '--executar', str(tamanho), '--diretorio', diretorio]
+            for opcao in ('clientes', 'requisicoes', 'logins', 'backups', 'armazenamento', 'workers'):
+                comando += [f'--{opcao}', str(getattr(args, opcao))]
+            if args.servidor:
+                comando.append('--servidor')
+            print(f"Executando {tamanho} registros por coleção...", file=sys.stderr)
+            subprocess.run(comando, check=True, stdout=sys.stderr)
+            with open(os.path.join(diretorio, 'resultado.json'), encoding='utf-8') as f:
+                resultados.append(json.load(f))
+
+    saida = {'meta': meta, 'resultados': resultados}
+    texto = json.dumps(saida, ensure_ascii=False, indent=2)
+    if args.saida:
+        with open(args.saida, 'w', encoding='utf-8') as f:
+            f.write(texto + '\n')
+    else:
+        print(texto)
+    if args.comparar:
+        with open(args.comparar, encoding='utf-8') as f:
+            comparar(saida, json.load(f))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,324 @@
+import re
+import sys
+import heapq
+import threading
+import unicodedata
+from bisect import bisect_left, insort
+from functools import lru_cache
+from itertools import product
+from operator import attrgetter
+
+# Campos indexados e o peso de cada um na relevância
+CAMPOS = {'cliente': 3.0, 'produto': 2.0, 'descricao': 1.0}
+
+# Campos copiados para o resumo de cada resultado (além dos indexados)
+CAMPOS_RESUMO = ('status', 'tipo')
+
+# Palavras frequentes demais para ajudar numa busca; não entram no índice
+PALAVRAS_VAZIAS = frozenset((
+    'a', 'ao', 'aos', 'as', 'com', 'da', 'das', 'de', 'do', 'dos', 'e', 'em', 'na', 'nas', 'no', 'nos',
+    'o', 'os', 'ou', 'para', 'pela', 'pelo', 'por', 'um', 'uma',
+))
+
+# Peso de um termo casado só pelo prefixo, relativo a um termo completo
+PESO_PREFIXO = 0.5
+
+# Máximo de palavras do vocabulário em que o último termo (prefixo) é expandido
+LIMITE_EXPANSOES = 64
+
+# Termos considerados por busca (os demais são ignorados)
+LIMITE_TERMOS = 6
+
+# Abaixo de um acerto a cada tantos documentos do guia, a interseção é calculada inteira
+DENSIDADE_MINIMA = 8
+
+# Alterações com mais palavras novas (ou removidas) que isto reordenam o vocabulário inteiro
+LIMITE_VOCABULARIO_INCREMENTAL = 1000
+
+_PALAVRA = re.compile(r'\w+')
+
+
+def normalizar(texto):
+    """Minúsculas e sem acentos: 'João' -> 'joao'"""
+    decomposto = unicodedata.normalize('NFKD', texto)
+    return ''.join(c for c in decomposto if not unicodedata.combining(c)).casefold()
+
+
+@lru_cache(maxsize=65536)
+def palavras(texto):
+    """Palavras normalizadas de um texto, sem as palavras vazias (os textos se repetem muito: cache)"""
+    return tuple(p for p in _PALAVRA.findall(normalizar(texto)) if p not in PALAVRAS_VAZIAS)
+
+
+_SEQ = attrgetter('seq')
+
+
+class _Documento:
+    # Chave dos postings: hash por identidade, mais barato que o da tupla (módulo, id)
+    __slots__ = ('chave', 'seq', 'campos', 'resumo')
+
+    def __init__(self, chave, seq, campos, resumo):
+        self.chave = chave        # (módulo, id)
+        self.seq = seq            # ordem de indexação: maior é mais recente
+        self.campos = campos      # campo -> frozenset das palavras do campo
+        self.resumo = resumo
+
+
+class _Termo:
+    """Documentos com uma palavra num campo, do mais recente ao mais antigo"""
+
+    def __init__(self, posting):
+        self.posting = posting
+
+    def __len__(self):
+        return len(self.posting)
+
+    def recentes(self):
+        return reversed(self.posting)
+
+    def contem(self, documento):
+        return documento in self.posting
+
+
+class _Prefixo:
+    """Documentos com alguma palavra começando com prefixo num campo, do mais recente ao mais antigo"""
+
+    def __init__(self, prefixo, campo, postings, completo):
+        self.prefixo = prefixo
+        self.campo = campo
+        self.postings = postings
+        self.completo = completo  # False se as expansões foram truncadas
+
+    def __len__(self):
+        # Com as expansões truncadas só serve de guia se for a única fonte
+        if not self.completo:
+            return sys.maxsize
+        return sum(len(posting) for posting in self.postings)
+
+    def recentes(self):
+        if len(self.postings) == 1:
+            return reversed(self.postings[0])
+        return heapq.merge(*(reversed(posting) for posting in self.postings), key=_SEQ, reverse=True)
+
+    def contem(self, documento):
+        return any(p.startswith(self.prefixo) for p in documento.campos.get(self.campo, ()))
+
+
+class IndiceBusca:
+    """Índice invertido dos campos cliente, produto e descricao de várias coleções.
+
+    Cada palavra (sem acentos e em minúsculas) aponta, por campo, para os
+    documentos que a contêm, num dict usado como conjunto
+    ordenado: a ordem de inserção é a de indexação, de modo que percorrê-lo de
+    trás para frente dá os documentos mais recentes primeiro. O vocabulário
+    fica numa lista ordenada para expandir o último termo da busca como
+    prefixo (autocompletar).
+
+    A relevância de um documento é a soma, por termo, do peso do melhor campo
+    em que ele aparece. As combinações (termo -> campo) são visitadas da maior
+    para a menor pontuação e, em cada uma, os documentos do menor conjunto do
+    mais recente para o mais antigo; a busca para assim que tem resultados
+    suficientes, com custo proporcional ao limite e não ao total de acertos.
+
+    O índice é atualizado pelos observadores das coleções a cada inserção,
+    atualização ou restauração; no SQLite também pelas alterações de outros
+    processos. Um documento alterado é reindexado por inteiro.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._documentos = {}     # (módulo, id) -> _Documento
+        self._postings = {}       # palavra -> {campo: {_Documento: None}}
+        self._vocabulario = []    # palavras do índice, ordenadas
+        self._seq = 0
+
+    def __len__(self):
+        return len(self._documentos)
+
+    def incluir(self, modulo, colecao):
+        """Indexa a coleção como o módulo informado e acompanha as mutações dela"""
+        def ao_alterar(colecao, evento, registros, anteriores):
+            self._ao_alterar(modulo, evento, registros)
+        colecao.observar(ao_alterar)
+
+    # Manutenção
+
+    def _ao_alterar(self, modulo, evento, registros):
+        with self._lock:
+            novas, vazias = set(), set()
+            if evento == 'substituir':
+                for chave in [c for c in self._documentos if c[0] == modulo]:
+                    self._remover(chave, vazias)
+            for registro in registros:
+                chave = (modulo, registro['id'])
+                if chave in self._documentos:
+                    self._remover(chave, vazias)
+                self._adicionar(chave, registro, novas)
+            self._atualizar_vocabulario(novas, vazias)
+
+    def _adicionar(self, chave, registro, novas):
+        campos = {}
+        for campo in CAMPOS:
+            valor = registro.get(campo)
+            if isinstance(valor, str) and valor:
+                contidas = frozenset(palavras(valor))
+                if contidas:
+                    campos[campo] = contidas
+        resumo = {'id': registro['id']}
+        for campo in (*CAMPOS, *CAMPOS_RESUMO):
+            if registro.get(campo) is not None:
+                resumo[campo] = registro[campo]
+        self._seq += 1
+        documento = self._documentos[chave] = _Documento(chave, self._seq, campos, resumo)
+        for campo, contidas in campos.items():
+            for palavra in contidas:
+                por_campo = self._postings.get(palavra)
+                if por_campo is None:
+                    por_campo = self._postings[palavra] = {}
+                    novas.add(palavra)
+                posting = por_campo.get(campo)
+                if posting is None:
+                    posting = por_campo[campo] = {}
+                posting[documento] = None
+
+    def _remover(self, chave, vazias):
+        documento = self._documentos.pop(chave)
+        for campo, contidas in documento.campos.items():
+            for palavra in contidas:
+                por_campo = self._postings[palavra]
+                posting = por_campo[campo]
+                del posting[documento]
+                if not posting:
+                    del por_campo[campo]
+                    if not por_campo:
+                        del self._postings[palavra]
+                        vazias.add(palavra)
+
+    def _atualizar_vocabulario(self, novas, vazias):
+        # Uma palavra removida e reinserida na mesma alteração continua no vocabulário
+        comuns = novas & vazias
+        novas, vazias = novas - comuns, vazias - comuns
+        if len(novas) + len(vazias) > LIMITE_VOCABULARIO_INCREMENTAL:
+            self._vocabulario = sorted(self._postings)
+            return
+        for palavra in vazias:
+            del self._vocabulario[bisect_left(self._vocabulario, palavra)]
+        for palavra in novas:
+            insort(self._vocabulario, palavra)
+
+    # Consulta
+
+    def _expandir(self, prefixo):
+        """Palavras do vocabulário que começam com prefixo (as primeiras em ordem alfabética) e se são todas"""
+        inicio = bisect_left(self._vocabulario, prefixo)
+        expansoes = []
+        for palavra in self._vocabulario[inicio:inicio + LIMITE_EXPANSOES + 1]:
+            if not palavra.startswith(prefixo):
+                return expansoes, True
+            expansoes.append(palavra)
+        if len(expansoes) > LIMITE_EXPANSOES:
+            return expansoes[:LIMITE_EXPANSOES], False
+        return expansoes, True
+
+    def _opcoes(self, termo, prefixo):
+        """(peso, campo, fonte) de cada campo em que o termo pode casar"""
+        por_campo = self._postings.get(termo, {})
+        opcoes = [(CAMPOS[campo], campo, _Termo(posting)) for campo, posting in por_campo.items()]
+        if prefixo:
+            expansoes, completo = self._expandir(termo)
+            expansoes = [self._postings[palavra] for palavra in expansoes]
+            for campo, peso in CAMPOS.items():
+                postings = [p[campo] for p in expansoes if campo in p]
+                if postings:
+                    opcoes.append((peso * PESO_PREFIXO, campo, _Prefixo(termo, campo, postings, completo)))
+        return opcoes
+
+    def _comuns(self, exatas, intersecoes):
+        """Documentos em todos os postings, mais recentes primeiro (memorizado em intersecoes durante a busca)"""
+        memoria = tuple(id(posting) for posting in exatas)
+        if memoria not in intersecoes:
+            comuns = exatas[0].keys() & exatas[1].keys()
+            for posting in exatas[2:]:
+                comuns = posting.keys() & comuns
+            intersecoes[memoria] = comuns
+        return intersecoes[memoria]
+
+    def _coletar(self, fontes, quantidade, vistos, permitido, intersecoes):
+        """Até quantidade documentos (mais recentes primeiro) presentes em todas as fontes"""
+        fontes = sorted(fontes, key=len)
+        recentes, outras = fontes[0].recentes(), fontes[1:]
+        exatas = [fonte.posting for fonte in fontes if isinstance(fonte, _Termo)]
+        if len(exatas) > 1:
+            comuns = self._comuns(exatas, intersecoes)
+            # Interseção esparsa: ordenar os poucos documentos comuns sai mais barato que percorrer o guia
+            if len(comuns) * DENSIDADE_MINIMA < len(fontes[0]):
+                recentes = sorted(comuns, key=_SEQ, reverse=True)
+                outras = [fonte for fonte in fontes if not isinstance(fonte, _Termo)]
+        encontrados = []
+        for documento in recentes:
+            if documento in vistos:
+                continue
+            if not all(fonte.contem(documento) for fonte in outras):
+                continue
+            vistos.add(documento)
+            if permitido is not None and not permitido(documento.chave[0], documento.resumo):
+                continue
+            encontrados.append(documento)
+            if len(encontrados) >= quantidade:
+                break
+        return encontrados
+
+    def buscar(self, texto, limite=20, modulos=None, permitido=None):
+        """Busca os documentos que contêm todos os termos do texto, do mais relevante ao menos.
+
+        O último termo também casa como prefixo (autocompletar), salvo se o
+        texto terminar em espaço. Cada termo pontua o peso do campo em que
+        aparece (cliente > produto > descricao), pela metade se casar só pelo
+        prefixo; empates ficam com o documento indexado mais recentemente.
+        modulos restringe os módulos e permitido(módulo, resumo) filtra cada
+        documento. Retorna dicts com modulo, score, campos casados e o resumo.
+        """
+        # O prefixo é a última palavra digitada mesmo que seja vazia ('de' -> 'desconto')
+        digitadas = _PALAVRA.findall(normalizar(texto))
+        prefixo = None
+        if digitadas and not texto[-1].isspace():
+            prefixo = digitadas.pop()
+        termos = list(dict.fromkeys(p for p in digitadas if p not in PALAVRAS_VAZIAS))
+        termos = termos[:LIMITE_TERMOS - 1] if prefixo else termos[:LIMITE_TERMOS]
+        if prefixo and prefixo not in termos:
+            termos.append(prefixo)
+        if not termos:
+            return []
+        if modulos is not None:
+            filtro = permitido
+            modulos = set(modulos)
+
+            def permitido(modulo, resumo):
+                return modulo in modulos and (filtro is None or filtro(modulo, resumo))
+
+        resultados = []
+        with self._lock:
+            opcoes = [self._opcoes(termo, termo == prefixo) for termo in termos]
+            # Combinações termo -> campo agrupadas por pontuação, da maior para a menor
+            niveis = {}
+            for combinacao in product(*opcoes):
+                score = sum(opcao[0] for opcao in combinacao)
+                niveis.setdefault(score, []).append(combinacao)
+            vistos, intersecoes = set(), {}
+            for score in sorted(niveis, reverse=True):
+                faltam = limite - len(resultados)
+                nivel = []
+                for combinacao in niveis[score]:
+                    campos = sorted({opcao[1] for opcao in combinacao})
+                    for documento in self._coletar([opcao[2] for opcao in combinacao], faltam,
+                                                   vistos, permitido, intersecoes):
+                        nivel.append((documento.seq, documento, campos))
+                # No mesmo nível, os mais recentes primeiro
+                nivel.sort(key=lambda acerto: acerto[0], reverse=True)
+                for _, documento, campos in nivel[:faltam]:
+                    resultado = {'modulo': documento.chave[0], 'score': score, 'campos': campos}
+                    resultado.update(documento.resumo)
+                    resultados.append(resultado)
+                if len(resultados) >= limite:
+                    break
+        return resultados
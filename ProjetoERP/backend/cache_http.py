@@ -0,0 +1,123 @@
+import hashlib
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, date, timezone
+from functools import wraps
+from flask import request, make_response, Response
+
+# Memória máxima das respostas já serializadas guardadas para reuso (ERP_CACHE_RESPOSTAS_MB, 0 desliga)
+CACHE_RESPOSTAS_BYTES = int(float(os.environ.get('ERP_CACHE_RESPOSTAS_MB', '64')) * 1024 * 1024)
+
+
+class CacheRespostas:
+    """Corpos e headers de respostas 200 por ETag, descartando as menos usadas acima do limite.
+
+    Como o ETag muda a cada alteração das coleções, uma entrada nunca fica
+    desatualizada: versões antigas só deixam de ser pedidas e saem pelo LRU.
+    """
+
+    def __init__(self, limite_bytes):
+        self.limite_bytes = limite_bytes
+        self._entradas = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def obter(self, etag):
+        with self._lock:
+            entrada = self._entradas.get(etag)
+            if entrada is not None:
+                self._entradas.move_to_end(etag)
+            return entrada
+
+    def guardar(self, etag, resposta):
+        if resposta.direct_passthrough or not resposta.is_sequence:
+            return  # streaming: não há corpo pronto para guardar
+        corpo = resposta.get_data()
+        if len(corpo) > self.limite_bytes // 4:
+            return
+        headers = [(nome, valor) for nome, valor in resposta.headers if nome.lower() != 'content-length']
+        with self._lock:
+            anterior = self._entradas.pop(etag, None)
+            if anterior is not None:
+                self._bytes -= len(anterior[0])
+            self._entradas[etag] = (corpo, headers)
+            self._bytes += len(corpo)
+            while self._bytes > self.limite_bytes:
+                _, (removido, _) = self._entradas.popitem(last=False)
+                self._bytes -= len(removido)
+
+    def limpar(self):
+        with self._lock:
+            self._entradas.clear()
+            self._bytes = 0
+
+
+cache_respostas = CacheRespostas(CACHE_RESPOSTAS_BYTES)
+
+
+def _etag(colecoes, por_dia):
+    """Calcula o ETag a partir da rota, da query string e das versões (com a época) das coleções"""
+    partes = [request.path, request.query_string.decode('utf-8', 'replace')]
+    partes.extend(f'{c.nome}:{c.epoca}:{c.versao}' for c in colecoes)
+    if por_dia:
+        partes.append(date.today().isoformat())
+    return hashlib.sha1('|'.join(partes).encode('utf-8')).hexdigest()
+
+
+def _ultima_modificacao(colecoes, por_dia):
+    """Instante da última alteração, arredondado para cima ao segundo inteiro do HTTP"""
+    modificado_em = max(c.modificado_em for c in colecoes)
+    if por_dia:
+        # KPIs mudam na virada do dia mesmo sem alterações nos dados
+        meia_noite = datetime.combine(date.today(), datetime.min.time()).timestamp()
+        modificado_em = max(modificado_em, meia_noite)
+    return datetime.fromtimestamp(math.ceil(modificado_em), tz=timezone.utc)
+
+
+def condicional(*colecoes, por_dia=False):
+    """Decorator para GET condicional com ETag/Last-Modified baseados na versão das coleções.
+
+    Se o cliente enviar If-None-Match (ou, sem ele, If-Modified-Since) ainda
+    válido, a resposta 304 é devolvida sem chamar o handler, portanto sem
+    consultar nem serializar os dados. Last-Modified só é enviado depois que o
+    seu segundo terminou: antes disso, outra escrita no mesmo segundo teria a
+    mesma data e o cliente receberia 304 com dados antigos.
+
+    Respostas 200 ficam em cache_respostas: enquanto as coleções não mudam,
+    outros clientes recebem os mesmos bytes sem nova consulta nem serialização
+    (o corpo não pode depender do usuário). Deve ficar abaixo de
+    token_required/role_required.
+    """
+    def decorator(f):
+        @wraps(f)
+        def decorated(*args, **kwargs):
+            etag = _etag(colecoes, por_dia)
+            ultima_modificacao = _ultima_modificacao(colecoes, por_dia)
+
+            if request.if_none_match:
+                nao_modificado = request.if_none_match.contains_weak(etag)
+            else:
+                nao_modificado = (request.if_modified_since is not None
+                                  and ultima_modificacao <= request.if_modified_since)
+            guardada = None if nao_modificado or not cache_respostas.limite_bytes else cache_respostas.obter(etag)
+            if nao_modificado:
+                resposta = Response(status=304)
+            elif guardada is not None:
+                resposta = Response(guardada[0], status=200, headers=guardada[1])
+            else:
+                resposta = make_response(f(*args, **kwargs))
+                if resposta.status_code != 200:
+                    return resposta
+                if cache_respostas.limite_bytes:
+                    cache_respostas.guardar(etag, resposta)
+
+            resposta.set_etag(etag)
+            if ultima_modificacao.timestamp() <= time.time():
+                resposta.last_modified = ultima_modificacao
+            resposta.headers['Cache-Control'] = 'private, no-cache'
+            return resposta
+        return decorated
+    return decorator
@@ -0,0 +1,80 @@
+import math
+from datetime import datetime, date
+
+# Formatos aceitos na entrada; as datas são gravadas sempre em ISO ('AAAA-MM-DD' ou 'AAAA-MM-DD HH:MM')
+FORMATOS_DATA = ('%Y-%m-%d', '%d/%m/%Y')
+FORMATOS_DATA_HORA = ('%Y-%m-%d %H:%M', '%Y-%m-%dT%H:%M', '%Y-%m-%d %H:%M:%S', '%Y-%m-%dT%H:%M:%S', '%d/%m/%Y %H:%M')
+
+
+def converter_data(valor):
+    """Converte um valor de data para (texto ISO normalizado, date).
+
+    Retorna (None, None) para valores vazios e levanta ValueError se o
+    formato não for reconhecido.
+    """
+    if valor is None or valor == '':
+        return None, None
+    if isinstance(valor, datetime):
+        return valor.strftime('%Y-%m-%d %H:%M'), valor.date()
+    if isinstance(valor, date):
+        return valor.isoformat(), valor
+    if not isinstance(valor, str):
+        raise ValueError(f"Data inválida: {valor!r}")
+
+    texto = valor.strip()
+    # Caminho rápido para o formato usado em todo o sistema
+    if len(texto) == 10 and texto[4] == '-':
+        try:
+            return texto, date.fromisoformat(texto)
+        except ValueError:
+            pass
+    for formato in FORMATOS_DATA:
+        try:
+            d = datetime.strptime(texto, formato).date()
+            return d.isoformat(), d
+        except ValueError:
+            continue
+    for formato in FORMATOS_DATA_HORA:
+        try:
+            dt = datetime.strptime(texto, formato)
+            return dt.strftime('%Y-%m-%d %H:%M'), dt.date()
+        except ValueError:
+            continue
+    raise ValueError(f"Data inválida: {valor!r}. Use o formato AAAA-MM-DD")
+
+
+def converter_numero(valor):
+    """Converte um valor numérico (número ou texto) para int ou float.
+
+    Aceita texto no formato brasileiro ('1.234,56'). Retorna None para
+    valores vazios e levanta ValueError se o valor não for um número finito.
+    """
+    if valor is None or valor == '':
+        return None
+    if isinstance(valor, str):
+        texto = valor.strip()
+        if ',' in texto:
+            # Formato brasileiro: ponto separa milhares e vírgula separa decimais
+            texto = texto.replace('.', '').replace(',', '.')
+        try:
+            return int(texto)
+        except ValueError:
+            pass
+        try:
+            valor = float(texto)
+        except ValueError:
+            raise ValueError(f"Número inválido: {valor!r}")
+    elif isinstance(valor, bool) or not isinstance(valor, (int, float)):
+        raise ValueError(f"Número inválido: {valor!r}")
+    if isinstance(valor, float) and not math.isfinite(valor):
+        raise ValueError(f"Número inválido: {valor!r}")
+    return valor
+
+
+def periodo(args):
+    """Lê os parâmetros ?de=&ate= de uma requisição e retorna (de, ate) como date ou None"""
+    _, de = converter_data(args.get('de'))
+    _, ate = converter_data(args.get('ate'))
+    if de and ate and de > ate:
+        raise ValueError("Período inválido: 'de' deve ser anterior ou igual a 'ate'")
+    return de, ate
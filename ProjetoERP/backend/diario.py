@@ -0,0 +1,330 @@
+import json
+import os
+import re
+import threading
+import time
+import logging
+
+from lideranca import Lideranca
+
+logger = logging.getLogger(__name__)
+
+ARQUIVO_SNAPSHOT = 'snapshot.jsonl'
+ARQUIVO_LOCK = 'diario.lock'
+PADRAO_SEGMENTO = re.compile(r'^diario-(\d+)\.log$')
+
+# Códigos das operações gravadas no diário
+OPERACOES = {'inserir': 'i', 'atualizar': 'a', 'substituir': 's'}
+OPERACAO_LOTE = 'l'  # inserção de vários registros de uma vez (inserir_lote)
+
+# Tentativas de gravar um lote antes de dar as mutações dele como não gravadas
+TENTATIVAS_GRAVACAO = 3
+
+
+def _nome_segmento(inicio):
+    return f'diario-{inicio:012d}.log'
+
+
+def _fsync_diretorio(diretorio):
+    if hasattr(os, 'O_DIRECTORY'):
+        fd = os.open(diretorio, os.O_RDONLY | os.O_DIRECTORY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+
+class Diario:
+    """Write-ahead log das mutações das coleções, com snapshots periódicos.
+
+    Cada mutação recebe um número de sequência (LSN) dentro do lock da coleção
+    e entra numa fila em memória; uma thread escritora grava a fila em lote
+    com um único fsync (group commit) e acorda quem estiver aguardando. As
+    entradas gravam o registro completo, de modo que reaplicá-las é idempotente:
+    o snapshot pode ser tirado sem parar as escritas, e a recuperação carrega
+    o snapshot e reaplica o diário a partir do LSN dele.
+    """
+
+    def __init__(self, diretorio, intervalo_snapshot=300, limite_entradas=100000):
+        self.diretorio = diretorio
+        self.intervalo_snapshot = intervalo_snapshot
+        self.limite_entradas = limite_entradas
+        os.makedirs(diretorio, exist_ok=True)
+
+        self._colecoes = {}
+        self._cond = threading.Condition()
+        self._pendentes = []
+        self._lsn = 0
+        self._lsn_duravel = 0
+        # Faixas (primeiro, último LSN) de lotes que não puderam ser gravados; saem quando um
+        # snapshot as cobre. _lotes_falhos conta as falhas (o snapshot espera a rotação ou uma falha)
+        self._falhas = []
+        self._lotes_falhos = 0
+        self._arquivo = None
+        self._inicio_segmento = 0
+        self._desde_snapshot = 0
+        self._snapshot_inicial = False
+        self._lock_snapshot = threading.Lock()
+        self._pedido_snapshot = threading.Event()
+        self._local = threading.local()
+        # Um único processo escreve no diário de um diretório (lock exclusivo, liberado se ele morrer)
+        self._dono = Lideranca(os.path.join(diretorio, ARQUIVO_LOCK))
+
+    # Recuperação
+
+    def recuperar(self, *colecoes):
+        """Carrega o snapshot e reaplica o diário nas coleções; retorna o número de entradas reaplicadas"""
+        self._colecoes = {c.nome: c for c in colecoes}
+        estado = {c.nome: {} for c in colecoes}
+        proximos = {c.nome: 0 for c in colecoes}
+        lsn_snapshot = 0
+        encontrou_dados = False
+
+        caminho_snapshot = os.path.join(self.diretorio, ARQUIVO_SNAPSHOT)
+        if os.path.exists(caminho_snapshot):
+            encontrou_dados = True
+            with open(caminho_snapshot, 'r', encoding='utf-8') as f:
+                cabecalho = json.loads(f.readline())
+                lsn_snapshot = cabecalho['lsn']
+                proximos.update(cabecalho.get('proximos_ids', {}))
+                for linha in f:
+                    entrada = json.loads(linha)
+                    estado[entrada['c']][entrada['r']['id']] = entrada['r']
+
+        ultimo_lsn = lsn_snapshot
+        reaplicadas = 0
+        for inicio, caminho in self._segmentos():
+            encontrou_dados = True
+            with open(caminho, 'rb') as f:
+                valido_ate = 0
+                for linha in f:
+                    try:
+                        entrada = json.loads(linha)
+                    except ValueError:
+                        # Última escrita interrompida por uma queda: descartar o final do arquivo
+                        logger.warning(f"Entrada incompleta no diário {caminho}; descartando o final do arquivo")
+                        break
+                    valido_ate += len(linha)
+                    if entrada['l'] <= lsn_snapshot:
+                        continue
+                    self._reaplicar(entrada, estado, proximos)
+                    ultimo_lsn = max(ultimo_lsn, entrada['l'])
+                    reaplicadas += 1
+            if valido_ate < os.path.getsize(caminho):
+                with open(caminho, 'r+b') as f:
+                    f.truncate(valido_ate)
+
+        if encontrou_dados:
+            for nome, colecao in self._colecoes.items():
+                colecao.substituir(estado[nome].values(), proximo_id=proximos[nome])
+        self._lsn = self._lsn_duravel = ultimo_lsn
+        self._desde_snapshot = reaplicadas
+        self._snapshot_inicial = not encontrou_dados
+        return reaplicadas
+
+    @staticmethod
+    def _reaplicar(entrada, estado, proximos):
+        nome = entrada['c']
+        if entrada['o'] == 's':
+            estado[nome] = {r['id']: r for r in entrada['r']}
+            maior = max(estado[nome], default=0)
+        elif entrada['o'] == OPERACAO_LOTE:
+            estado[nome].update((r['id'], r) for r in entrada['r'])
+            maior = max((r['id'] for r in entrada['r']), default=0)
+        else:
+            registro = entrada['r']
+            estado[nome][registro['id']] = registro
+            maior = registro['id']
+        proximos[nome] = max(proximos[nome], maior + 1)
+
+    def _segmentos(self):
+        segmentos = []
+        for nome in os.listdir(self.diretorio):
+            encontrado = PADRAO_SEGMENTO.match(nome)
+            if encontrado:
+                segmentos.append((int(encontrado.group(1)), os.path.join(self.diretorio, nome)))
+        return sorted(segmentos)
+
+    # Escrita
+
+    def iniciar(self):
+        """Passa a registrar as mutações das coleções e inicia as threads de escrita e snapshot.
+
+        Levanta RuntimeError se outro processo já estiver escrevendo no mesmo diretório.
+        """
+        if not self._dono.tentar():
+            with open(self._dono.caminho, 'r') as f:
+                pid = f.read().strip() or '?'
+            raise RuntimeError(f"O diretório de dados {self.diretorio} já está em uso pelo processo {pid}")
+        self._abrir_segmento(self._lsn + 1)
+        for colecao in self._colecoes.values():
+            colecao.observar(self._ao_alterar, notificar_existentes=False)
+        threading.Thread(target=self._escritor, name='diario-escritor', daemon=True).start()
+        threading.Thread(target=self._agendador, name='diario-snapshot', daemon=True).start()
+        if self._snapshot_inicial:
+            # Diretório vazio: gravar o conteúdo inicial das coleções antes de qualquer mutação
+            self.snapshot()
+        elif self._desde_snapshot:
+            # Compactar o que acabou de ser reaplicado para acelerar a próxima inicialização
+            self._pedido_snapshot.set()
+
+    def _abrir_segmento(self, inicio):
+        if self._arquivo:
+            self._arquivo.close()
+        self._arquivo = open(os.path.join(self.diretorio, _nome_segmento(inicio)), 'ab')
+        _fsync_diretorio(self.diretorio)
+        self._inicio_segmento = inicio
+
+    def _ao_alterar(self, colecao, evento, registros, anteriores):
+        # Chamado dentro do lock da coleção: a ordem dos LSNs segue a ordem das mutações
+        with self._cond:
+            self._lsn += 1
+            if evento == 'inserir' and len(registros) > 1:
+                operacao, dados = OPERACAO_LOTE, registros
+            else:
+                operacao, dados = OPERACOES[evento], registros if evento == 'substituir' else registros[0]
+            self._pendentes.append((self._lsn, colecao.nome, operacao, dados))
+            # Todos os LSNs da thread ainda não confirmados: qualquer um pode cair num lote que falhou
+            lsns = [l for l in getattr(self._local, 'lsns', ()) if l > self._lsn_duravel or self._falhou(l)]
+            lsns.append(self._lsn)
+            self._local.lsns = lsns
+            self._cond.notify_all()
+
+    def _gravar_lote(self, lote):
+        for item in lote:
+            if item[1] is None:
+                # Marcador de rotação: entradas seguintes vão para um novo segmento
+                self._arquivo.flush()
+                os.fsync(self._arquivo.fileno())
+                self._abrir_segmento(item[0] + 1)
+                continue
+            lsn, nome, operacao, dados = item
+            linha = json.dumps({'l': lsn, 'c': nome, 'o': operacao, 'r': dados},
+                               ensure_ascii=False, separators=(',', ':'), default=str)
+            self._arquivo.write(linha.encode('utf-8') + b'\n')
+        self._arquivo.flush()
+        os.fsync(self._arquivo.fileno())
+
+    def _desfazer_lote(self, inicio, posicao):
+        """Volta o diário ao ponto anterior ao lote: segmento inicio truncado em posicao"""
+        try:
+            self._arquivo.close()
+        except OSError:
+            pass
+        if self._inicio_segmento != inicio:
+            # O lote chegou a rotacionar: o segmento novo é refeito na próxima tentativa
+            os.remove(os.path.join(self.diretorio, _nome_segmento(self._inicio_segmento)))
+        self._arquivo = open(os.path.join(self.diretorio, _nome_segmento(inicio)), 'ab')
+        self._arquivo.truncate(posicao)
+        self._inicio_segmento = inicio
+
+    def _escritor(self):
+        while True:
+            with self._cond:
+                while not self._pendentes:
+                    self._cond.wait()
+                lote, self._pendentes = self._pendentes, []
+            inicio, posicao = self._inicio_segmento, self._arquivo.tell()
+            for tentativa in range(1, TENTATIVAS_GRAVACAO + 1):
+                try:
+                    self._gravar_lote(lote)
+                    erro = None
+                    break
+                except OSError as e:
+                    erro = e
+                    logger.error(f"Falha ao gravar o diário (tentativa {tentativa}): {e}")
+                # Depois de um fsync com erro o kernel pode ter descartado as páginas: o lote é
+                # regravado por inteiro a partir do ponto anterior a ele, não só sincronizado de novo
+                try:
+                    self._desfazer_lote(inicio, posicao)
+                except OSError as e:
+                    logger.error(f"Falha ao desfazer o lote no diário: {e}")
+                time.sleep(0.05 * tentativa)
+            lsns = [item[0] for item in lote if item[1] is not None]
+            with self._cond:
+                if erro is None:
+                    self._lsn_duravel = max(self._lsn_duravel, lote[-1][0])
+                    self._desde_snapshot += len(lote)
+                else:
+                    # Só as mutações deste lote falham; as seguintes continuam sendo gravadas
+                    if lsns:
+                        self._falhas.append((lsns[0], lsns[-1]))
+                    self._lotes_falhos += 1
+                self._cond.notify_all()
+            if erro is not None:
+                # Elas já estão em memória: um snapshot as torna duráveis
+                self._pedido_snapshot.set()
+            elif self._desde_snapshot >= self.limite_entradas:
+                self._pedido_snapshot.set()
+
+    def _falhou(self, lsn):
+        return any(primeiro <= lsn <= ultimo for primeiro, ultimo in self._falhas)
+
+    def aguardar(self, lsn, timeout=10):
+        """Bloqueia até que o LSN esteja gravado em disco"""
+        with self._cond:
+            if not self._cond.wait_for(lambda: self._lsn_duravel >= lsn or self._falhou(lsn), timeout):
+                raise IOError("Tempo esgotado aguardando gravação do diário")
+            if self._falhou(lsn):
+                raise IOError(f"Falha ao gravar o diário (LSN {lsn}); a alteração será gravada no próximo snapshot")
+
+    def aguardar_pendente(self):
+        """Aguarda a gravação de todas as mutações feitas pela thread atual; IOError se alguma falhou"""
+        lsns = getattr(self._local, 'lsns', None)
+        if lsns:
+            self._local.lsns = []
+            for lsn in lsns:
+                self.aguardar(lsn)
+
+    # Snapshots
+
+    def _agendador(self):
+        while True:
+            self._pedido_snapshot.wait(self.intervalo_snapshot)
+            self._pedido_snapshot.clear()
+            if self._desde_snapshot:
+                try:
+                    self.snapshot()
+                except Exception as e:
+                    logger.error(f"Falha ao gravar snapshot: {e}")
+
+    def snapshot(self):
+        """Grava um snapshot compacto das coleções e remove os segmentos do diário já cobertos"""
+        with self._lock_snapshot:
+            inicio = time.perf_counter()
+            with self._cond:
+                # Tudo até este LSN fica nos segmentos antigos; o que vier depois vai para um novo
+                lsn = self._lsn
+                falhos = self._lotes_falhos
+                self._pendentes.append((lsn, None, None, None))
+                self._desde_snapshot = 0
+                self._cond.notify_all()
+            congelados = {nome: c.congelar() for nome, c in self._colecoes.items()}
+
+            caminho = os.path.join(self.diretorio, ARQUIVO_SNAPSHOT)
+            temporario = caminho + '.tmp'
+            with open(temporario, 'w', encoding='utf-8') as f:
+                cabecalho = {'lsn': lsn, 'proximos_ids': {n: p for n, (_, p) in congelados.items()}}
+                f.write(json.dumps(cabecalho) + '\n')
+                for nome, (registros, _) in congelados.items():
+                    for registro in registros:
+                        f.write(json.dumps({'c': nome, 'r': registro}, ensure_ascii=False,
+                                           separators=(',', ':'), default=str) + '\n')
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temporario, caminho)
+            _fsync_diretorio(self.diretorio)
+
+            # A rotação precisa ter acontecido antes de apagar segmentos antigos; se o lote dela
+            # falhou, o segmento atual continua em uso e fica (reaplicá-lo é idempotente)
+            with self._cond:
+                self._cond.wait_for(lambda: self._inicio_segmento > lsn or self._lotes_falhos > falhos)
+                atual = self._inicio_segmento
+                # Tudo até lsn está no snapshot, inclusive as mutações de lotes que falharam
+                self._lsn_duravel = max(self._lsn_duravel, lsn)
+                self._falhas = [(primeiro, ultimo) for primeiro, ultimo in self._falhas if ultimo > lsn]
+            for inicio_segmento, caminho_segmento in self._segmentos():
+                if inicio_segmento <= lsn and inicio_segmento != atual:
+                    os.remove(caminho_segmento)
+            logger.info(f"Snapshot do diário gravado (LSN {lsn}) em {time.perf_counter() - inicio:.2f}s")
+            return lsn
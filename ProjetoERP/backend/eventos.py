@@ -0,0 +1,139 @@
+import json
+import os
+import queue
+import threading
+import logging
+from collections import deque
+
+from serializacao import codificar
+
+logger = logging.getLogger(__name__)
+
+LIMITE_EVENTOS_POR_ALTERACAO = 100
+
+
+class Assinatura:
+    """Conexão de um cliente ao fluxo de eventos, com fila limitada"""
+
+    def __init__(self, tamanho_fila, pendentes):
+        self.fila = queue.Queue(maxsize=tamanho_fila)
+        self.pendentes = deque(pendentes)  # eventos do histórico a reenviar após Last-Event-ID
+        self.atrasada = False
+
+
+class Transmissor:
+    """Distribui eventos para os clientes conectados em /api/stream (Server-Sent Events).
+
+    Cada cliente tem uma fila limitada: se ele não consome rápido o bastante,
+    a assinatura é encerrada em vez de acumular memória, e o cliente retoma
+    pelo Last-Event-ID a partir do histórico recente mantido aqui.
+
+    Os ids levam a época do processo ("<época>-<n>"): um Last-Event-ID de outro
+    processo (reinício ou outro worker), ilegível ou à frente do último evento
+    publicado não pode ser retomado, e o cliente recebe um pedido de recarga.
+    """
+
+    def __init__(self, tamanho_historico=1000, tamanho_fila=256):
+        self.tamanho_fila = tamanho_fila
+        self._lock = threading.Lock()
+        self._historico = deque(maxlen=tamanho_historico)
+        self._assinaturas = set()
+        self._ultimo_id = 0
+        self.epoca = os.urandom(4).hex()
+
+    def _id(self, numero):
+        return f'{self.epoca}-{numero}'
+
+    def _numero(self, ultimo_id):
+        """Número do evento de um Last-Event-ID desta época, ou None se não for retomável"""
+        epoca, _, numero = (ultimo_id or '').partition('-')
+        if epoca != self.epoca or not numero.isdigit():
+            return None
+        numero = int(numero)
+        return numero if numero <= self._ultimo_id else None
+
+    def publicar(self, tipo, dados):
+        """Publica um evento para todos os clientes conectados"""
+        with self._lock:
+            self._ultimo_id += 1
+            evento = (self._id(self._ultimo_id), tipo, codificar(dados).decode('utf-8'))
+            self._historico.append(evento)
+            for assinatura in self._assinaturas:
+                if assinatura.atrasada:
+                    continue
+                try:
+                    assinatura.fila.put_nowait(evento)
+                except queue.Full:
+                    # Cliente lento: encerrar a conexão; ele retoma via Last-Event-ID
+                    assinatura.atrasada = True
+                    logger.warning("Cliente SSE atrasado desconectado")
+            return evento[0]
+
+    def assinar(self, ultimo_id=None):
+        """Registra um cliente; com ultimo_id (Last-Event-ID), reenvia os eventos perdidos desde então"""
+        with self._lock:
+            pendentes = []
+            if ultimo_id:
+                numero = self._numero(ultimo_id)
+                mais_antigo = self._ultimo_id - len(self._historico) + 1
+                if numero is None or numero + 1 < mais_antigo:
+                    # Id de outro processo, desconhecido ou fora do histórico: o cliente precisa recarregar tudo
+                    pendentes.append((self._id(self._ultimo_id), 'recarregar', json.dumps({'colecao': '*'})))
+                elif numero < self._ultimo_id:
+                    # O histórico é contíguo e termina no último id: os perdidos são os últimos da fila
+                    pendentes.extend(list(self._historico)[numero - self._ultimo_id:])
+            assinatura = Assinatura(self.tamanho_fila, pendentes)
+            self._assinaturas.add(assinatura)
+            return assinatura
+
+    def cancelar(self, assinatura):
+        with self._lock:
+            self._assinaturas.discard(assinatura)
+
+    def fluxo(self, assinatura, intervalo_keepalive=15):
+        """Gerador com as mensagens SSE de uma assinatura; encerra se o cliente ficar atrasado"""
+        try:
+            yield 'retry: 3000\n\n'
+            while not assinatura.atrasada:
+                if assinatura.pendentes:
+                    evento = assinatura.pendentes.popleft()
+                else:
+                    try:
+                        evento = assinatura.fila.get(timeout=intervalo_keepalive)
+                    except queue.Empty:
+                        yield ': keepalive\n\n'
+                        continue
+                id, tipo, dados = evento
+                yield f'id: {id}\nevent: {tipo}\ndata: {dados}\n\n'
+        finally:
+            self.cancelar(assinatura)
+
+
+def publicar_alteracoes(transmissor, motor_kpis, ordens_servico, orcamentos, lancamentos_financeiros):
+    """Registra observadores que publicam mudanças de ordens de serviço e deltas dos KPIs.
+
+    Deve ser chamado depois de criar o MotorKPI, para que os totais já estejam
+    atualizados quando os observadores daqui forem chamados.
+    """
+    estado = {'kpis': motor_kpis.kpis()}
+    lock = threading.Lock()
+
+    def publicar_kpis():
+        with lock:
+            atuais = motor_kpis.kpis()
+            delta = {k: v for k, v in atuais.items() if estado['kpis'].get(k) != v}
+            estado['kpis'] = atuais
+        if delta:
+            transmissor.publicar('kpis', delta)
+
+    def ao_alterar(colecao, evento, registros, anteriores):
+        if evento == 'substituir' or len(registros) > LIMITE_EVENTOS_POR_ALTERACAO:
+            # Lotes grandes (importações) viram um único pedido de recarga em vez de um evento por registro
+            transmissor.publicar('recarregar', {'colecao': colecao.nome})
+        elif colecao is ordens_servico:
+            for registro in registros:
+                transmissor.publicar('projeto', {'evento': evento, 'registro': registro})
+        publicar_kpis()
+
+    for colecao in (ordens_servico, orcamentos, lancamentos_financeiros):
+        colecao.observar(ao_alterar, notificar_existentes=False)
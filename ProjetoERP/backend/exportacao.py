@@ -0,0 +1,58 @@
+import csv
+import io
+
+from serializacao import codificar
+
+# Formatos de exportação e seus Content-Types
+FORMATOS = {'csv': 'text/csv', 'ndjson': 'application/x-ndjson'}
+
+# Os dados são enviados em blocos de aproximadamente este tamanho
+TAMANHO_BLOCO = 64 * 1024
+
+
+def _celula(valor):
+    if valor is None:
+        return ''
+    if isinstance(valor, (dict, list)):
+        return codificar(valor).decode('utf-8')
+    return valor
+
+
+def _csv(registros, campos):
+    buffer = io.StringIO()
+    escritor = csv.writer(buffer)
+    # BOM: o Excel só reconhece um CSV como UTF-8 (acentos) com ele
+    buffer.write('\ufeff')
+    escritor.writerow(campos)
+    for registro in registros:
+        escritor.writerow([_celula(registro.get(campo)) for campo in campos])
+        if buffer.tell() >= TAMANHO_BLOCO:
+            yield buffer.getvalue().encode('utf-8')
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue().encode('utf-8')
+
+
+def _ndjson(registros, campos):
+    bloco, tamanho = [], 0
+    for registro in registros:
+        if campos:
+            registro = {campo: registro.get(campo) for campo in campos}
+        linha = codificar(registro) + b'\n'
+        bloco.append(linha)
+        tamanho += len(linha)
+        if tamanho >= TAMANHO_BLOCO:
+            yield b''.join(bloco)
+            bloco, tamanho = [], 0
+    yield b''.join(bloco)
+
+
+def gerar(registros, formato, campos=None):
+    """Gera o conteúdo da exportação em blocos de bytes, consumindo os registros em fluxo.
+
+    No CSV as colunas são os campos informados (na ordem); no NDJSON cada
+    linha é o registro inteiro, ou só os campos informados.
+    """
+    if formato == 'csv':
+        return _csv(registros, campos)
+    return _ndjson(registros, campos)
@@ -0,0 +1,22 @@
+"""Configuração do gunicorn: gunicorn -c gunicorn.conf.py wsgi:app
+
+ERP_WORKERS (padrão: número de núcleos) processos, cada um com ERP_THREADS
+threads (as conexões SSE de /api/stream ocupam uma thread cada). Os workers
+compartilham o estado pelo banco SQLite em ERP_DADOS_DIR.
+"""
+import multiprocessing
+import os
+
+# O armazenamento em memória fica dentro de cada processo: com vários workers, só SQLite
+os.environ.setdefault('ERP_ARMAZENAMENTO', 'sqlite')
+
+bind = os.environ.get('ERP_BIND', '0.0.0.0:5000')
+workers = int(os.environ.get('ERP_WORKERS', multiprocessing.cpu_count()))
+worker_class = 'gthread'
+threads = int(os.environ.get('ERP_THREADS', '16'))
+# Importar o app depois do fork: conexões SQLite e threads não sobrevivem ao fork
+preload_app = False
+
+if workers > 1 and os.environ['ERP_ARMAZENAMENTO'] != 'sqlite':
+    raise RuntimeError(f"ERP_ARMAZENAMENTO={os.environ['ERP_ARMAZENAMENTO']!r} não suporta {workers} workers: "
+                       "use ERP_ARMAZENAMENTO=sqlite ou ERP_WORKERS=1")
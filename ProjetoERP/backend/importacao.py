@@ -0,0 +1,84 @@
+import csv
+import io
+
+from serializacao import decodificar
+
+# Content-Types aceitos nas importações em lote
+FORMATOS = {
+    'application/json': 'json',
+    'application/x-ndjson': 'ndjson',
+    'application/jsonl': 'ndjson',
+    'application/jsonlines': 'ndjson',
+    'text/csv': 'csv',
+}
+
+
+class ErroImportacao(ValueError):
+    """Corpo da requisição inaceitável como um todo (e não apenas uma linha inválida)"""
+
+    def __init__(self, mensagem, status=400):
+        super().__init__(mensagem)
+        self.status = status
+
+
+def _linhas_json(requisicao):
+    try:
+        dados = decodificar(requisicao.get_data())
+    except ValueError:
+        raise ErroImportacao('JSON inválido no corpo da requisição')
+    if not isinstance(dados, list):
+        raise ErroImportacao('O corpo deve ser um array JSON de registros')
+    for numero, dados_linha in enumerate(dados, 1):
+        yield numero, dados_linha, None
+
+
+def _linhas_ndjson(requisicao):
+    for numero, linha in enumerate(io.BufferedReader(requisicao.stream), 1):
+        if not linha.strip():
+            continue
+        try:
+            yield numero, decodificar(linha), None
+        except ValueError:
+            yield numero, None, 'JSON inválido'
+
+
+def _linhas_csv(requisicao):
+    texto = io.TextIOWrapper(io.BufferedReader(requisicao.stream), encoding='utf-8-sig', newline='')
+    leitor = csv.DictReader(texto)
+    try:
+        for celulas in leitor:
+            numero = leitor.line_num
+            if None in celulas:
+                yield numero, None, 'Mais colunas que o cabeçalho'
+                continue
+            yield numero, {campo: valor if valor != '' else None for campo, valor in celulas.items()}, None
+    except (UnicodeDecodeError, csv.Error) as e:
+        raise ErroImportacao(f'CSV ilegível: {e}')
+
+
+def ler_linhas(requisicao, limite=None):
+    """Lê os registros do corpo de uma importação em lote, conforme o Content-Type.
+
+    Aceita array JSON, NDJSON (um objeto por linha) e CSV com cabeçalho; NDJSON
+    e CSV são lidos em fluxo. Gera (linha, dados, erro): linha é a posição no
+    array ou a linha do arquivo, e erro (com dados None) descreve uma linha
+    ilegível. Células CSV vazias viram None; as demais chegam como texto e,
+    como os campos JSON, são convertidas e validadas por Colecao.preparar().
+    Levanta ErroImportacao se o corpo todo for inaceitável ou passar de
+    limite registros.
+    """
+    formato = FORMATOS.get(requisicao.mimetype)
+    if formato is None:
+        raise ErroImportacao(f"Content-Type não suportado: use {', '.join(FORMATOS)}", 415)
+    if formato == 'json':
+        linhas = _linhas_json(requisicao)
+    elif formato == 'ndjson':
+        linhas = _linhas_ndjson(requisicao)
+    else:
+        linhas = _linhas_csv(requisicao)
+    for quantidade, (numero, dados, erro) in enumerate(linhas, 1):
+        if limite is not None and quantidade > limite:
+            raise ErroImportacao(f'Lote com mais de {limite} registros', 413)
+        if erro is None and not isinstance(dados, dict):
+            dados, erro = None, 'O registro deve ser um objeto JSON'
+        yield numero, dados, erro
@@ -0,0 +1,172 @@
+import threading
+import logging
+from collections import defaultdict
+from datetime import date, timedelta
+
+logger = logging.getLogger(__name__)
+
+# Tolerância para comparar somas incrementais de ponto flutuante com o recálculo
+TOLERANCIA = 0.005
+
+
+def _mes(d):
+    return (d.year, d.month) if d else None
+
+
+def _limites_mes(d):
+    """Primeiro e último dia do mês de d"""
+    inicio = d.replace(day=1)
+    proximo = (inicio + timedelta(days=32)).replace(day=1)
+    return inicio, proximo - timedelta(days=1)
+
+
+class _Acumulador:
+    """Soma e contagem por chave; a chave é removida quando a contagem zera"""
+
+    def __init__(self):
+        self.soma = defaultdict(float)
+        self.quantidade = defaultdict(int)
+
+    def aplicar(self, chave, valor, sinal):
+        self.soma[chave] += sinal * valor
+        self.quantidade[chave] += sinal
+        if self.quantidade[chave] <= 0:
+            del self.soma[chave]
+            del self.quantidade[chave]
+
+    def limpar(self):
+        self.soma.clear()
+        self.quantidade.clear()
+
+
+class MotorKPI:
+    """Mantém os totais do dashboard atualizados a cada mutação das coleções.
+
+    Os acumuladores são alimentados pelos observadores das coleções, de modo
+    que a leitura dos KPIs não percorre nenhum registro. O método verificar()
+    recalcula tudo do zero para conferir que os totais não divergiram.
+
+    Com incremental=False (armazenamento SQLite, em que outros processos
+    também gravam) não há acumuladores: cada leitura usa as contagens e
+    somas agregadas pelo próprio armazenamento.
+    """
+
+    def __init__(self, ordens_servico, orcamentos, lancamentos_financeiros, incremental=True):
+        self._lock = threading.Lock()
+        self._colecoes = {
+            'ordens_servico': ordens_servico,
+            'orcamentos': orcamentos,
+            'lancamentos_financeiros': lancamentos_financeiros,
+        }
+        self._orcamentos_enviados = _Acumulador()   # (ano, mês) de data_envio
+        self._vendas_fechadas = 0
+        self._faturamento = _Acumulador()           # (ano, mês) de data_pagamento
+        self._projetos_andamento = 0
+        self._receber_pendente = _Acumulador()      # data_vencimento
+        self.incremental = incremental
+
+        if incremental:
+            for colecao in self._colecoes.values():
+                colecao.observar(self._ao_alterar)
+
+    # Observador das coleções
+
+    def _ao_alterar(self, colecao, evento, registros, anteriores):
+        with self._lock:
+            if evento == 'substituir':
+                self._zerar(colecao.nome)
+                anteriores = []
+            for registro in anteriores:
+                self._aplicar(colecao.nome, registro, -1)
+            for registro in registros:
+                self._aplicar(colecao.nome, registro, 1)
+
+    def _zerar(self, nome):
+        if nome == 'ordens_servico':
+            self._projetos_andamento = 0
+        elif nome == 'orcamentos':
+            self._orcamentos_enviados.limpar()
+            self._vendas_fechadas = 0
+        elif nome == 'lancamentos_financeiros':
+            self._faturamento.limpar()
+            self._receber_pendente.limpar()
+
+    def _aplicar(self, nome, registro, sinal):
+        """Soma (sinal=1) ou subtrai (sinal=-1) a contribuição de um registro"""
+        status = registro.get('status')
+        if nome == 'ordens_servico':
+            if status != 'Finalizado':
+                self._projetos_andamento += sinal
+        elif nome == 'orcamentos':
+            if status == 'enviado':
+                mes = _mes(registro.datas['data_envio'])
+                if mes:
+                    self._orcamentos_enviados.aplicar(mes, registro.get('valor') or 0, sinal)
+            elif status == 'aprovado':
+                self._vendas_fechadas += sinal
+        elif nome == 'lancamentos_financeiros':
+            if registro.get('tipo') != 'receber':
+                return
+            if status == 'pago':
+                mes = _mes(registro.datas['data_pagamento'])
+                if mes:
+                    self._faturamento.aplicar(mes, registro.get('valor') or 0, sinal)
+            elif status == 'pendente':
+                vencimento = registro.datas['data_vencimento']
+                if vencimento:
+                    self._receber_pendente.aplicar(vencimento, registro.get('valor') or 0, sinal)
+
+    # Leitura
+
+    def kpis(self, hoje=None):
+        """Retorna os KPIs do dashboard a partir dos acumuladores"""
+        if not self.incremental:
+            return self.recalcular(hoje)
+        hoje = hoje or date.today()
+        mes = (hoje.year, hoje.month)
+        with self._lock:
+            # Vencimentos de amanhã até daqui a 7 dias: no máximo 7 consultas de dicionário
+            vencendo = sum(self._receber_pendente.quantidade.get(hoje + timedelta(days=d), 0) for d in range(1, 8))
+            return {
+                'total_orcamentos_mes': round(self._orcamentos_enviados.soma.get(mes, 0), 2),
+                'vendas_fechadas': self._vendas_fechadas,
+                'faturamento_mes': round(self._faturamento.soma.get(mes, 0), 2),
+                'projetos_andamento': self._projetos_andamento,
+                'contas_vencendo_semana': vencendo,
+            }
+
+    def recalcular(self, hoje=None):
+        """Calcula os KPIs do zero com contagens e somas do armazenamento (modo de verificação)"""
+        hoje = hoje or date.today()
+        mes = _limites_mes(hoje)
+        ordens = self._colecoes['ordens_servico']
+        orcamentos = self._colecoes['orcamentos']
+        lancamentos = self._colecoes['lancamentos_financeiros']
+
+        _, total_orcamentos = orcamentos.somar('valor', ('data_envio',) + mes, status='enviado')
+        _, faturamento_mes = lancamentos.somar('valor', ('data_pagamento',) + mes, tipo='receber', status='pago')
+        # Vencimentos de amanhã até daqui a 7 dias
+        contas_vencendo_semana, _ = lancamentos.somar(
+            'valor', ('data_vencimento', hoje + timedelta(days=1), hoje + timedelta(days=7)),
+            tipo='receber', status='pendente')
+
+        return {
+            'total_orcamentos_mes': round(total_orcamentos, 2),
+            'vendas_fechadas': orcamentos.contar(status='aprovado'),
+            'faturamento_mes': round(faturamento_mes, 2),
+            'projetos_andamento': len(ordens) - ordens.contar(status='Finalizado'),
+            'contas_vencendo_semana': contas_vencendo_semana,
+        }
+
+    def verificar(self, hoje=None):
+        """Compara os totais incrementais com um recálculo completo e retorna as divergências"""
+        incremental = self.kpis(hoje)
+        recalculado = self.recalcular(hoje)
+        divergencias = {
+            chave: {'incremental': incremental[chave], 'recalculado': recalculado[chave]}
+            for chave in incremental
+            if abs(incremental[chave] - recalculado[chave]) > TOLERANCIA
+        }
+        if divergencias:
+            logger.warning(f"KPIs divergentes do recálculo completo: {divergencias}")
+        return divergencias
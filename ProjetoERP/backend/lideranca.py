@@ -0,0 +1,68 @@
+import os
+import threading
+import time
+import logging
+
+try:
+    import fcntl
+except ImportError:  # Windows: sem flock, servidor de desenvolvimento com um único processo
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+
+class Lideranca:
+    """Eleição de líder entre processos por um lock exclusivo (flock) num arquivo.
+
+    Só o processo que obtém o lock é líder; ele o mantém enquanto viver e o
+    sistema operacional o libera se o processo morrer, quando outro worker
+    assume na próxima tentativa. Sem fcntl o processo se considera líder.
+    """
+
+    def __init__(self, caminho):
+        self.caminho = caminho
+        self.lider = False
+        self._arquivo = None
+        self._lock = threading.Lock()
+
+    def tentar(self):
+        """Tenta obter o lock sem bloquear; retorna True se este processo é (ou passou a ser) o líder"""
+        with self._lock:
+            if self.lider:
+                return True
+            if fcntl is None:
+                self.lider = True
+                return True
+            os.makedirs(os.path.dirname(os.path.abspath(self.caminho)), exist_ok=True)
+            arquivo = open(self.caminho, 'a+')
+            try:
+                fcntl.flock(arquivo.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                arquivo.close()
+                return False
+            arquivo.seek(0)
+            arquivo.truncate()
+            arquivo.write(f'{os.getpid()}\n')
+            arquivo.flush()
+            self._arquivo = arquivo
+            self.lider = True
+            return True
+
+    def quando_lider(self, funcao, intervalo=30):
+        """Executa funcao() uma vez, assim que este processo se tornar líder.
+
+        Se outro processo já for líder, tenta de novo a cada intervalo segundos
+        numa thread, para assumir caso ele termine.
+        """
+        if self.tentar():
+            funcao()
+            return
+
+        def aguardar():
+            while True:
+                time.sleep(intervalo)
+                if self.tentar():
+                    logger.info(f"Processo {os.getpid()} assumiu a liderança ({self.caminho})")
+                    funcao()
+                    return
+        threading.Thread(target=aguardar, name='lideranca', daemon=True).start()
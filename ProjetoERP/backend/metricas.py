@@ -0,0 +1,269 @@
+import bisect
+import json
+import os
+import random
+import sys
+import threading
+import time
+import logging
+from collections import Counter
+from datetime import datetime
+
+from flask import g, request, has_request_context
+from flask.json.provider import JSONProvider
+
+logger = logging.getLogger(__name__)
+
+# Limites dos buckets dos histogramas (em segundos e em bytes)
+LIMITES_SEGUNDOS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+LIMITES_BYTES = (100, 1000, 10000, 100000, 1000000, 10000000)
+LIMITES_BACKUP = (0.1, 0.5, 1, 5, 10, 30, 60, 300, 600, 1800)
+
+
+def _escapar(valor):
+    return str(valor).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _formatar(valor):
+    return repr(float(valor)) if valor != int(valor) else str(int(valor))
+
+
+class Histograma:
+    """Histograma com rótulos no modelo do Prometheus (buckets cumulativos, _sum e _count)"""
+
+    def __init__(self, nome, ajuda, rotulos=(), limites=LIMITES_SEGUNDOS):
+        self.nome = nome
+        self.ajuda = ajuda
+        self.rotulos = tuple(rotulos)
+        self.limites = tuple(limites)
+        self._lock = threading.Lock()
+        self._series = {}  # valores dos rótulos -> [contagens por bucket (não cumulativas), soma]
+
+    def observar(self, valor, *rotulos):
+        indice = bisect.bisect_left(self.limites, valor)
+        with self._lock:
+            serie = self._series.get(rotulos)
+            if serie is None:
+                serie = self._series[rotulos] = [[0] * (len(self.limites) + 1), 0.0]
+            serie[0][indice] += 1
+            serie[1] += valor
+
+    def estado(self):
+        with self._lock:
+            return [[list(rotulos), list(contagens), soma] for rotulos, (contagens, soma) in self._series.items()]
+
+    def exportar(self, estados):
+        """Linhas no formato texto do Prometheus, somando os estados de vários processos"""
+        series = {}
+        for estado in estados:
+            for rotulos, contagens, soma in estado:
+                serie = series.setdefault(tuple(rotulos), [[0] * len(contagens), 0.0])
+                serie[0] = [a + b for a, b in zip(serie[0], contagens)]
+                serie[1] += soma
+        linhas = [f'# HELP {self.nome} {self.ajuda}', f'# TYPE {self.nome} histogram']
+        for rotulos, (contagens, soma) in sorted(series.items()):
+            pares = [f'{n}="{_escapar(v)}"' for n, v in zip(self.rotulos, rotulos)]
+            acumulado = 0
+            for limite, contagem in zip(self.limites + ('+Inf',), contagens):
+                acumulado += contagem
+                le = 'le="%s"' % (limite if limite == '+Inf' else _formatar(limite))
+                linhas.append(f"{self.nome}_bucket{{{','.join(pares + [le])}}} {acumulado}")
+            sufixo = '{' + ','.join(pares) + '}' if pares else ''
+            linhas.append(f'{self.nome}_sum{sufixo} {soma!r}')
+            linhas.append(f'{self.nome}_count{sufixo} {acumulado}')
+        return linhas
+
+
+class Metricas:
+    """Registro das métricas do processo, exportadas no formato texto do Prometheus.
+
+    Com vários workers (gunicorn), compartilhar() faz cada processo gravar o
+    seu estado num diretório comum, e exportar() soma os estados de todos os
+    processos vivos: qualquer worker responde pelo conjunto.
+    """
+
+    def __init__(self):
+        self._histogramas = {}
+        self._lock = threading.Lock()
+        self.diretorio = None
+
+    def histograma(self, nome, ajuda, rotulos=(), limites=LIMITES_SEGUNDOS):
+        """Retorna o histograma com esse nome, criando-o na primeira chamada"""
+        with self._lock:
+            if nome not in self._histogramas:
+                self._histogramas[nome] = Histograma(nome, ajuda, rotulos, limites)
+            return self._histogramas[nome]
+
+    def estado(self):
+        return {nome: h.estado() for nome, h in self._histogramas.items()}
+
+    def compartilhar(self, diretorio, intervalo=5):
+        """Grava o estado deste processo em diretorio/<pid>.json a cada intervalo segundos"""
+        self.diretorio = diretorio
+        os.makedirs(diretorio, exist_ok=True)
+
+        def executar():
+            while True:
+                time.sleep(intervalo)
+                try:
+                    self._gravar()
+                except OSError as e:
+                    logger.error(f"Falha ao gravar métricas: {e}")
+        threading.Thread(target=executar, name='metricas', daemon=True).start()
+
+    def _gravar(self):
+        caminho = os.path.join(self.diretorio, f'{os.getpid()}.json')
+        with open(caminho + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump(self.estado(), f)
+        os.replace(caminho + '.tmp', caminho)
+
+    def _estados_de_outros_processos(self):
+        estados = []
+        for nome in os.listdir(self.diretorio):
+            if not nome.endswith('.json') or nome == f'{os.getpid()}.json':
+                continue
+            caminho = os.path.join(self.diretorio, nome)
+            try:
+                os.kill(int(nome[:-5]), 0)
+            except ProcessLookupError:
+                # Worker encerrado: suas métricas saem do total (o Prometheus trata como reinício)
+                os.remove(caminho)
+                continue
+            except (ValueError, PermissionError):
+                pass
+            try:
+                with open(caminho, encoding='utf-8') as f:
+                    estados.append(json.load(f))
+            except (OSError, ValueError):
+                continue
+        return estados
+
+    def exportar(self):
+        estados = [self.estado()]
+        if self.diretorio:
+            estados.extend(self._estados_de_outros_processos())
+        linhas = []
+        for nome, histograma in self._histogramas.items():
+            linhas.extend(histograma.exportar([e.get(nome, []) for e in estados]))
+        return '\n'.join(linhas) + '\n'
+
+
+metricas = Metricas()
+
+
+class AmostradorPerfil:
+    """Profiler por amostragem de uma thread: a cada intervalo guarda a pilha atual dela.
+
+    As pilhas são acumuladas no formato 'folded' (uma linha 'a;b;c contagem'),
+    aceito por flamegraph.pl, speedscope e similares.
+    """
+
+    def __init__(self, thread_id, intervalo=0.001):
+        self.thread_id = thread_id
+        self.intervalo = intervalo
+        self.pilhas = Counter()
+        self._parar = threading.Event()
+        self._thread = threading.Thread(target=self._executar, name='perfil', daemon=True)
+        self._thread.start()
+
+    def _executar(self):
+        while not self._parar.wait(self.intervalo):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is not None and frame.f_code.co_filename == __file__:
+                continue  # a thread já está encerrando o perfil em parar()
+            pilha = []
+            while frame is not None:
+                codigo = frame.f_code
+                pilha.append(f'{codigo.co_name} ({os.path.basename(codigo.co_filename)}:{codigo.co_firstlineno})')
+                frame = frame.f_back
+            if pilha:
+                self.pilhas[';'.join(reversed(pilha))] += 1
+
+    def parar(self):
+        self._parar.set()
+        self._thread.join()
+
+    def gravar(self, caminho):
+        with open(caminho, 'w', encoding='utf-8') as f:
+            for pilha, contagem in self.pilhas.most_common():
+                f.write(f'{pilha} {contagem}\n')
+
+
+class JSONMedido(JSONProvider):
+    """Provedor JSON que delega a outro e soma em g o tempo gasto serializando respostas"""
+
+    def __init__(self, app, base):
+        super().__init__(app)
+        self.base = base
+
+    def dumps(self, obj, **kwargs):
+        return self.base.dumps(obj, **kwargs)
+
+    def loads(self, s, **kwargs):
+        return self.base.loads(s, **kwargs)
+
+    def response(self, *args, **kwargs):
+        inicio = time.perf_counter()
+        resposta = self.base.response(*args, **kwargs)
+        if has_request_context():
+            g.metricas_serializacao = g.get('metricas_serializacao', 0.0) + time.perf_counter() - inicio
+        return resposta
+
+
+def instrumentar(app, diretorio_perfis, pode_perfilar=None, amostra=0.0, lento=0.5):
+    """Registra no app a coleta de métricas por rota e o modo de perfil.
+
+    O perfil é gravado em diretorio_perfis (formato folded) para requisições
+    com ?profile=1 quando pode_perfilar() permitir, e para uma fração
+    `amostra` (0 a 1) das demais que levarem mais de `lento` segundos. O nome
+    do arquivo vai no header X-Perfil.
+    """
+    duracao = metricas.histograma('erp_requisicao_segundos', 'Duração das requisições por rota',
+                                  ('rota', 'metodo', 'status'))
+    tamanho = metricas.histograma('erp_resposta_bytes', 'Tamanho das respostas por rota',
+                                  ('rota', 'metodo'), LIMITES_BYTES)
+    serializacao = metricas.histograma('erp_serializacao_segundos', 'Tempo de serialização JSON das respostas',
+                                       ('rota',))
+    app.json = JSONMedido(app, app.json)
+
+    @app.before_request
+    def iniciar_medicao():
+        g.metricas_inicio = time.perf_counter()
+        explicito = request.args.get('profile') == '1' and pode_perfilar is not None and pode_perfilar()
+        if explicito or (amostra and random.random() < amostra):
+            g.metricas_perfil = (AmostradorPerfil(threading.get_ident()), explicito)
+
+    @app.after_request
+    def registrar_resposta(resposta):
+        g.metricas_status = resposta.status_code
+        # Respostas em streaming (SSE, exportações) só têm tamanho se o header Content-Length vier pronto
+        g.metricas_tamanho = resposta.calculate_content_length() if resposta.is_sequence else resposta.content_length
+        perfil = g.get('metricas_perfil')
+        if perfil:
+            perfil[0].parar()
+            if perfil[1] or time.perf_counter() - g.metricas_inicio >= lento:
+                resposta.headers['X-Perfil'] = _gravar_perfil(perfil[0], diretorio_perfis)
+        return resposta
+
+    @app.teardown_request
+    def finalizar_medicao(erro):
+        inicio = g.get('metricas_inicio')
+        if inicio is None:
+            return
+        rota = request.url_rule.rule if request.url_rule else 'nao_encontrada'
+        duracao.observar(time.perf_counter() - inicio, rota, request.method, g.get('metricas_status', 500))
+        if g.get('metricas_tamanho') is not None:
+            tamanho.observar(g.metricas_tamanho, rota, request.method)
+        if 'metricas_serializacao' in g:
+            serializacao.observar(g.metricas_serializacao, rota)
+
+
+def _gravar_perfil(amostrador, diretorio):
+    os.makedirs(diretorio, exist_ok=True)
+    rota = (request.url_rule.rule if request.url_rule else request.path).strip('/').replace('/', '_') or 'raiz'
+    nome = f"{datetime.now().strftime('%Y%m%d_%H%M%S_%f')}_{request.method}_{rota}.folded"
+    for caractere in '<>:':
+        nome = nome.replace(caractere, '')
+    amostrador.gravar(os.path.join(diretorio, nome))
+    logger.info(f"Perfil de {request.method} {request.path} gravado em {nome}")
+    return nome
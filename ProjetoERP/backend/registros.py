@@ -0,0 +1,532 @@
+import os
+import threading
+import logging
+import time
+from contextlib import ExitStack, contextmanager, nullcontext
+from bisect import bisect_left, bisect_right, insort
+
+from datas import converter_data, converter_numero
+
+logger = logging.getLogger(__name__)
+
+
+class Registro(dict):
+    """Registro de uma coleção; guarda as datas já convertidas fora do conteúdo serializado"""
+
+    __slots__ = ('datas',)
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.datas = {}
+
+
+def _indexavel(valor):
+    """Indica se o valor pode ser usado como chave de índice"""
+    try:
+        hash(valor)
+    except TypeError:
+        return False
+    return True
+
+
+def _atende(registro, criterios):
+    return all(registro.get(campo) == valor for campo, valor in criterios.items())
+
+
+class Instantaneo:
+    """Registros de uma coleção congelados num instante, em ordem de id.
+
+    Permite iterar, contar (len) e buscar por id sem tocar na coleção, que
+    pode continuar sendo alterada. fechar() libera os recursos da leitura.
+    """
+
+    def __init__(self, registros):
+        self._registros = registros
+
+    def __len__(self):
+        return len(self._registros)
+
+    def __iter__(self):
+        return iter(self._registros)
+
+    def percorrer(self, intervalo=None, **criterios):
+        """Itera os registros em ordem de id que atendem aos critérios (campo=valor).
+
+        intervalo=(campo_data, de, ate) restringe a um período, como em Colecao.intervalo().
+        """
+        registros = iter(self._registros)
+        if intervalo:
+            campo, de, ate = intervalo
+            registros = (r for r in registros if r.datas.get(campo)
+                         and (de is None or r.datas[campo] >= de) and (ate is None or r.datas[campo] <= ate))
+        if criterios:
+            registros = (r for r in registros if _atende(r, criterios))
+        return registros
+
+    def obter(self, id):
+        posicao = bisect_left(self._registros, id, key=lambda r: r['id'])
+        if posicao < len(self._registros) and self._registros[posicao]['id'] == id:
+            return self._registros[posicao]
+        return None
+
+    def fechar(self):
+        self._registros = []
+
+
+class ColecaoBase:
+    """Parte comum aos armazenamentos de coleções: conversão de datas, versão e observadores.
+
+    As implementações (Colecao em memória, ColecaoSQLite em banco.py) têm a
+    mesma interface de consulta e mutação, de modo que os endpoints, os KPIs
+    e os backups não dependem de onde os registros estão guardados.
+    """
+
+    def __init__(self, nome, indices=(), datas=(), numericos=()):
+        self.nome = nome
+        self.campos_indexados = tuple(indices)
+        self.campos_data = tuple(datas)
+        self.campos_numericos = tuple(numericos)
+        self._lock = threading.RLock()
+        self._observadores = []
+        # Versão incrementada a cada mutação; usada para validar caches (ETag)
+        self.versao = 0
+        self.modificado_em = time.time()
+        # Identifica a sequência de versões: só versões da mesma época são comparáveis
+        self.epoca = ''
+
+    def __iter__(self):
+        return iter(self.todos())
+
+    # Observadores
+
+    def observar(self, observador, notificar_existentes=True):
+        """Registra uma função chamada a cada mutação da coleção.
+
+        A função recebe (colecao, evento, registros, anteriores), onde evento é
+        'inserir', 'atualizar' ou 'substituir'. É chamada dentro do lock da
+        coleção, portanto na mesma ordem em que as mutações acontecem.
+        """
+        with self._lock:
+            self._observadores.append(observador)
+            if notificar_existentes:
+                observador(self, 'substituir', self.todos(), [])
+
+    def _notificar(self, evento, registros, anteriores, versao=None, modificado_em=None):
+        # Armazenamentos compartilhados entre processos informam a versão global da mutação
+        self.versao = self.versao + 1 if versao is None else max(self.versao, versao)
+        self.modificado_em = max(self.modificado_em, modificado_em or time.time())
+        for observador in self._observadores:
+            try:
+                observador(self, evento, registros, anteriores)
+            except Exception:
+                # A mutação já foi feita: um observador com erro não pode impedir os demais de
+                # recebê-la, e o estado derivado dele é remontado a partir do conteúdo atual
+                logger.exception(f"{self.nome}: erro no observador {observador!r} ({evento}); remontando")
+                self._ressincronizar(observador)
+
+    def _ressincronizar(self, observador):
+        try:
+            observador(self, 'substituir', self.todos(), [])
+        except Exception:
+            logger.exception(f"{self.nome}: não foi possível remontar o observador {observador!r}")
+
+    # Conversão
+
+    def preparar(self, dados, estrito=True, campos=None):
+        """Converte um dicionário em Registro, normalizando os campos de data e numéricos.
+
+        Com estrito=True uma data ou um número inválido levanta ValueError;
+        caso contrário a data inválida mantém o valor original (e fica como
+        None em registro.datas) e o número inválido vira None. campos limita a
+        conversão a esses campos (os alterados numa atualização).
+        """
+        registro = dados if isinstance(dados, Registro) else Registro(dados)
+        for campo in self.campos_numericos:
+            if campo not in registro or (campos is not None and campo not in campos):
+                continue
+            try:
+                registro[campo] = converter_numero(registro[campo])
+            except ValueError:
+                if estrito:
+                    raise ValueError(f"Campo '{campo}': número inválido ({registro[campo]!r})")
+                logger.warning(f"{self.nome} id={registro.get('id')}: número inválido em '{campo}'")
+                registro[campo] = None
+        for campo in self.campos_data:
+            if campos is not None and campo not in campos:
+                continue
+            try:
+                texto, data = converter_data(registro.get(campo))
+            except ValueError:
+                if estrito:
+                    raise ValueError(f"Campo '{campo}': data inválida ({registro[campo]!r})")
+                logger.warning(f"{self.nome} id={registro.get('id')}: data inválida em '{campo}'")
+                texto, data = registro[campo], None
+            if campo in registro:
+                registro[campo] = texto
+            registro.datas[campo] = data
+        return registro
+
+    def agrupar(self, campo, campo_data, por=(), **criterios):
+        """Retorna {(data, *valores dos campos em por): (quantidade, soma do campo)}.
+
+        A data é a de campo_data (None se vazia) e campo deve ser um dos campos
+        numéricos, já convertidos na entrada. Esta versão percorre os registros
+        que atendem aos critérios; usada para recalcular agregados do zero.
+        """
+        self._exigir_numerico(campo)
+        grupos = {}
+        with self._lock:
+            for registro in self.filtrar(**criterios):
+                chave = (registro.datas.get(campo_data),) + tuple(registro.get(c) for c in por)
+                grupo = grupos.setdefault(chave, [0, 0.0])
+                grupo[0] += 1
+                grupo[1] += registro.get(campo) or 0
+        return {chave: tuple(grupo) for chave, grupo in grupos.items()}
+
+    def _exigir_numerico(self, campo):
+        if campo not in self.campos_numericos:
+            raise ValueError(f"{self.nome}: '{campo}' não é um campo numérico da coleção")
+
+    def _ordenar(self, registros):
+        return sorted((self.preparar(r, estrito=False) for r in registros), key=lambda r: r['id'])
+
+    def substituir(self, registros, proximo_id=None):
+        """Substitui todo o conteúdo da coleção (ex.: restauração de backup)"""
+        self._trocar(self._ordenar(registros), proximo_id)
+
+    def _transacao(self):
+        """Contexto que agrupa mutações de várias coleções (sem efeito em memória)"""
+        return nullcontext()
+
+
+class Colecao(ColecaoBase):
+    """Coleção de registros em memória indexada por id e por campos secundários.
+
+    Cada índice secundário mapeia campo -> valor -> {id: registro}, de modo que
+    buscas por id são O(1) e filtros por campos indexados são O(k), onde k é o
+    número de registros retornados.
+
+    Os campos de data são convertidos uma única vez na entrada: o texto é
+    normalizado para ISO, a data fica em registro.datas e cada campo tem um
+    índice ordenado de (ordinal, id) para consultas por período com bisect.
+    """
+
+    def __init__(self, nome, registros=None, indices=(), datas=(), numericos=()):
+        super().__init__(nome, indices, datas, numericos)
+        # A versão em memória recomeça a cada processo (inclusive ao reaplicar o diário)
+        self.epoca = os.urandom(4).hex()
+        self._por_id = {}
+        self._ids = []
+        self._indices = {campo: {} for campo in self.campos_indexados}
+        self._por_data = {campo: [] for campo in self.campos_data}
+        self._desordenados = set()
+        self._proximo_id = 1
+        self.substituir(registros or [])
+
+    def __len__(self):
+        return len(self._por_id)
+
+    def __contains__(self, id):
+        return id in self._por_id
+
+    # Consultas
+
+    def obter(self, id):
+        """Retorna o registro com o id informado ou None"""
+        return self._por_id.get(id)
+
+    def todos(self):
+        """Retorna uma cópia da lista de registros, ordenada por id"""
+        with self._lock:
+            return list(self._por_id.values())
+
+    def congelar(self):
+        """Retorna (registros, proximo_id) num instante consistente.
+
+        Como as atualizações criam novos dicionários, a lista retornada não
+        muda mesmo que a coleção seja alterada depois.
+        """
+        with self._lock:
+            return list(self._por_id.values()), self._proximo_id
+
+    def instantaneo(self):
+        """Retorna um Instantaneo com os registros atuais (só copia as referências)"""
+        with self._lock:
+            return Instantaneo(list(self._por_id.values()))
+
+    def filtrar(self, **criterios):
+        """Retorna os registros que atendem a todos os critérios (campo=valor), ordenados por id"""
+        with self._lock:
+            if not criterios:
+                return list(self._por_id.values())
+
+            indexados = [c for c in criterios if c in self._indices and _indexavel(criterios[c])]
+            if not indexados:
+                return [r for r in self._por_id.values() if _atende(r, criterios)]
+
+            # Começar pelo menor bucket e conferir os demais critérios em cada registro
+            buckets = [self._bucket(campo, criterios[campo]) for campo in indexados]
+            menor = min(buckets, key=len)
+            return [r for r in menor.values() if _atende(r, criterios)]
+
+    def contar(self, **criterios):
+        """Conta os registros que atendem aos critérios; O(1) para um único campo indexado"""
+        with self._lock:
+            if not criterios:
+                return len(self._por_id)
+            if len(criterios) == 1:
+                campo, valor = next(iter(criterios.items()))
+                if campo in self._indices and _indexavel(valor):
+                    return len(self._indices[campo].get(valor, ()))
+            return len(self.filtrar(**criterios))
+
+    def pagina(self, after_id=None, limit=None, **criterios):
+        """Retorna uma página de registros ordenados por id, a partir do cursor after_id.
+
+        Retorna (registros, proximo_after_id); proximo_after_id é None na última página.
+        """
+        with self._lock:
+            if criterios:
+                candidatos = self.filtrar(**criterios)
+                ids = [r['id'] for r in candidatos]
+            else:
+                candidatos = None
+                ids = self._ids
+            inicio = bisect_right(ids, after_id) if after_id is not None else 0
+            fim = len(ids) if limit is None else min(inicio + limit, len(ids))
+            if candidatos is None:
+                registros = [self._por_id[id] for id in ids[inicio:fim]]
+            else:
+                registros = candidatos[inicio:fim]
+            proximo = registros[-1]['id'] if registros and fim < len(ids) else None
+            return registros, proximo
+
+    def intervalo(self, campo, de=None, ate=None, **criterios):
+        """Retorna os registros com campo de data entre de e ate (inclusive), ordenados pela data"""
+        with self._lock:
+            indice = self._por_data[campo]
+            inicio = bisect_left(indice, (de.toordinal(),)) if de else 0
+            fim = bisect_left(indice, (ate.toordinal() + 1,)) if ate else len(indice)
+            registros = (self._por_id[id] for _, id in indice[inicio:fim])
+            if criterios:
+                return [r for r in registros if _atende(r, criterios)]
+            return list(registros)
+
+    def valores(self, campo):
+        """Retorna os valores distintos de um campo indexado"""
+        with self._lock:
+            return list(self._indices[campo].keys())
+
+    def somar(self, campo, intervalo=None, **criterios):
+        """Retorna (quantidade, soma do campo) dos registros que atendem aos critérios.
+
+        intervalo=(campo_data, de, ate) restringe a um período, como em intervalo().
+        """
+        with self._lock:
+            registros = self.intervalo(*intervalo, **criterios) if intervalo else self.filtrar(**criterios)
+            return len(registros), sum(r.get(campo) or 0 for r in registros)
+
+    # Mutações
+
+    def inserir(self, registro):
+        """Insere um novo registro, alocando um id único.
+
+        Levanta ValueError se algum campo de data ou numérico for inválido.
+        """
+        registro = self.preparar(registro)
+        with self._lock:
+            registro['id'] = self._alocar_id()
+            self._por_id[registro['id']] = registro
+            self._ids.append(registro['id'])  # ids alocados são sempre crescentes
+            self._indexar(registro)
+            for campo in self.campos_data:
+                self._indexar_data(campo, registro)
+            self._notificar('inserir', [registro], [])
+            return registro
+
+    def inserir_lote(self, registros, preparados=False):
+        """Insere vários registros de uma vez, alocando um bloco de ids consecutivos.
+
+        Os índices são atualizados numa única passada e os observadores recebem
+        um único evento 'inserir' com todos os registros. Sem preparados=True,
+        uma data ou um número inválido levanta ValueError antes de qualquer inserção.
+        """
+        if not preparados:
+            registros = [self.preparar(r) for r in registros]
+        if not registros:
+            return []
+        with self._lock:
+            inicio = self._proximo_id
+            self._proximo_id += len(registros)
+            for id, registro in enumerate(registros, inicio):
+                registro['id'] = id
+                self._por_id[id] = registro
+                self._indexar(registro)
+            self._ids.extend(range(inicio, self._proximo_id))
+            for campo, indice in self._por_data.items():
+                # Duas sequências já ordenadas: o sort do Python as intercala em tempo linear
+                indice.extend(sorted((r.datas[campo].toordinal(), r['id']) for r in registros if r.datas[campo]))
+                indice.sort()
+            self._notificar('inserir', registros, [])
+            return registros
+
+    def atualizar(self, id, dados):
+        """Atualiza um registro existente e mantém os índices sincronizados.
+
+        O registro antigo não é alterado: um novo dicionário é criado e
+        colocado no lugar (cópia na escrita), de modo que listas obtidas
+        anteriormente continuam consistentes.
+        """
+        with self._lock:
+            antigo = self._por_id.get(id)
+            if antigo is None:
+                return None
+            novo = Registro(antigo)
+            novo.update(dados)
+            novo['id'] = id  # o id não pode ser alterado por atualização
+            novo.datas = dict(antigo.datas)
+            self.preparar(novo, campos=dados)
+            self._por_id[id] = novo
+            self._reindexar(antigo, novo)
+            self._notificar('atualizar', [novo], [antigo])
+            return novo
+
+    def _trocar(self, registros, proximo_id=None):
+        with self._lock:
+            anteriores = list(self._por_id.values())
+            self._por_id = {}
+            self._indices = {campo: {} for campo in self.campos_indexados}
+            self._desordenados = set()
+            for registro in registros:
+                self._por_id[registro['id']] = registro
+                self._indexar(registro)
+            self._ids = [r['id'] for r in registros]
+            self._por_data = {campo: [] for campo in self.campos_data}
+            for campo, indice in self._por_data.items():
+                indice.extend((r.datas[campo].toordinal(), r['id']) for r in registros if r.datas[campo])
+                indice.sort()
+            maior_id = registros[-1]['id'] if registros else 0
+            # Nunca reutilizar ids já entregues, mesmo após restaurar um backup antigo
+            self._proximo_id = max(self._proximo_id, maior_id + 1, proximo_id or 0)
+            self._notificar('substituir', registros, anteriores)
+
+    # Internos
+
+    def _alocar_id(self):
+        id = self._proximo_id
+        self._proximo_id += 1
+        return id
+
+    def _bucket(self, campo, valor):
+        bucket = self._indices[campo].get(valor)
+        if bucket is None:
+            return {}
+        if (campo, valor) in self._desordenados:
+            # Um registro atualizado entrou no fim do bucket; reordenar por id uma única vez
+            bucket = dict(sorted(bucket.items()))
+            self._indices[campo][valor] = bucket
+            self._desordenados.discard((campo, valor))
+        return bucket
+
+    def _indexar(self, registro, campos=None):
+        id = registro['id']
+        for campo in campos or self.campos_indexados:
+            valor = registro.get(campo)
+            if not _indexavel(valor):
+                continue
+            bucket = self._indices[campo].setdefault(valor, {})
+            if bucket and id < next(reversed(bucket)):
+                self._desordenados.add((campo, valor))
+            bucket[id] = registro
+
+    def _desindexar(self, registro, campos=None):
+        id = registro['id']
+        for campo in campos or self.campos_indexados:
+            valor = registro.get(campo)
+            if not _indexavel(valor):
+                continue
+            bucket = self._indices[campo].get(valor)
+            if bucket is None:
+                continue
+            bucket.pop(id, None)
+            if not bucket:
+                del self._indices[campo][valor]
+                self._desordenados.discard((campo, valor))
+
+    def _indexar_data(self, campo, registro):
+        data = registro.datas[campo]
+        if data:
+            insort(self._por_data[campo], (data.toordinal(), registro['id']))
+
+    def _desindexar_data(self, campo, registro):
+        data = registro.datas[campo]
+        if not data:
+            return
+        chave = (data.toordinal(), registro['id'])
+        indice = self._por_data[campo]
+        posicao = bisect_left(indice, chave)
+        if posicao < len(indice) and indice[posicao] == chave:
+            del indice[posicao]
+
+    def _reindexar(self, antigo, novo):
+        id = novo['id']
+        for campo in self.campos_data:
+            if antigo.datas[campo] != novo.datas[campo]:
+                self._desindexar_data(campo, antigo)
+                self._indexar_data(campo, novo)
+        alterados = []
+        for campo in self.campos_indexados:
+            valor = novo.get(campo)
+            if antigo.get(campo) == valor and _indexavel(valor):
+                # Valor inalterado: trocar a referência sem mudar a posição no bucket
+                self._indices[campo][valor][id] = novo
+            else:
+                alterados.append(campo)
+        if alterados:
+            self._desindexar(antigo, alterados)
+            self._indexar(novo, alterados)
+
+
+@contextmanager
+def bloquear_em_conjunto(*colecoes):
+    """Segura os locks de várias coleções ao mesmo tempo, sempre na mesma ordem (por nome)"""
+    with ExitStack() as pilha:
+        for colecao in sorted(colecoes, key=lambda c: c.nome):
+            pilha.enter_context(colecao._lock)
+        yield
+
+
+def congelar_em_conjunto(*colecoes):
+    """Retorna [(registros, proximo_id), ...] de várias coleções num mesmo instante.
+
+    Só copia as listas de referências: os registros são copy-on-write, então
+    o resultado pode ser serializado depois, fora dos locks.
+    """
+    with bloquear_em_conjunto(*colecoes):
+        return [colecao.congelar() for colecao in colecoes]
+
+
+def instantaneos_em_conjunto(*colecoes):
+    """Retorna {nome: Instantaneo} de várias coleções num mesmo instante.
+
+    Em memória cada instantâneo é uma cópia das referências; no SQLite todos
+    leem de uma única transação de leitura. Feche-os com fechar() após o uso.
+    """
+    banco = getattr(colecoes[0], 'banco', None)
+    with bloquear_em_conjunto(*colecoes):
+        if banco is not None:
+            return banco.instantaneos(*colecoes)
+        return {colecao.nome: colecao.instantaneo() for colecao in colecoes}
+
+
+def substituir_em_conjunto(*pares):
+    """Substitui o conteúdo de várias coleções de uma vez: [(colecao, registros), ...].
+
+    Os registros são preparados antes; depois os locks de todas as coleções
+    são tomados e os conteúdos trocados juntos, de modo que nenhuma leitura
+    vê uma coleção restaurada e outra ainda com os dados antigos.
+    """
+    preparados = [(colecao, colecao._ordenar(registros)) for colecao, registros in pares]
+    with bloquear_em_conjunto(*(colecao for colecao, _ in preparados)), preparados[0][0]._transacao():
+        for colecao, registros in preparados:
+            colecao._trocar(registros)
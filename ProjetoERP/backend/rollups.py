@@ -0,0 +1,260 @@
+import threading
+import logging
+from bisect import bisect_left, bisect_right, insort
+from datetime import date, timedelta
+
+from kpis import TOLERANCIA, _limites_mes
+
+logger = logging.getLogger(__name__)
+
+GRANULARIDADES = ('dia', 'mes')
+
+
+def _campo_data(status):
+    """Data em que o lançamento entra no caixa: o pagamento se pago, senão o vencimento"""
+    return 'data_pagamento' if status == 'pago' else 'data_vencimento'
+
+
+def _classificar(registro):
+    """(chave da série, data de caixa, valor) de um lançamento"""
+    status = registro.get('status')
+    chave = (registro.get('tipo'), status, registro.get('categoria'))
+    return chave, registro.datas.get(_campo_data(status)), registro.get('valor') or 0
+
+
+def _aplicar_bucket(buckets, ordem, chave, quantidade, soma):
+    bucket = buckets.get(chave)
+    if bucket is None:
+        bucket = buckets[chave] = [0, 0.0]
+        insort(ordem, chave)
+    bucket[0] += quantidade
+    bucket[1] += soma
+    if bucket[0] <= 0:
+        del buckets[chave]
+        del ordem[bisect_left(ordem, chave)]
+
+
+class _Serie:
+    """Quantidade e soma dos lançamentos de um (tipo, status, categoria) por dia e por mês"""
+
+    def __init__(self):
+        self.dias = {}          # date -> [quantidade, soma]
+        self.meses = {}         # (ano, mês) -> [quantidade, soma]
+        self.ordem_dias = []    # chaves ordenadas, para buscas por período com bisect
+        self.ordem_meses = []
+        self.sem_data = [0, 0.0]
+
+    def aplicar(self, dia, quantidade, soma):
+        if dia is None:
+            self.sem_data[0] += quantidade
+            self.sem_data[1] += soma
+            return
+        _aplicar_bucket(self.dias, self.ordem_dias, dia, quantidade, soma)
+        _aplicar_bucket(self.meses, self.ordem_meses, (dia.year, dia.month), quantidade, soma)
+
+    def vazia(self):
+        return not self.dias and self.sem_data[0] <= 0
+
+    def por_dia(self, de=None, ate=None):
+        """Gera (dia, [quantidade, soma]) dos dias com lançamentos entre de e ate"""
+        inicio = bisect_left(self.ordem_dias, de) if de else 0
+        fim = bisect_right(self.ordem_dias, ate) if ate else len(self.ordem_dias)
+        for dia in self.ordem_dias[inicio:fim]:
+            yield dia, self.dias[dia]
+
+    def por_mes(self, de=None, ate=None):
+        """Gera ((ano, mês), [quantidade, soma]) entre de e ate; os meses das pontas, se parciais, somados dia a dia"""
+        mes_de = (de.year, de.month) if de else None
+        mes_ate = (ate.year, ate.month) if ate else None
+        inicio = bisect_left(self.ordem_meses, mes_de) if de else 0
+        fim = bisect_right(self.ordem_meses, mes_ate) if ate else len(self.ordem_meses)
+        for mes in self.ordem_meses[inicio:fim]:
+            primeiro, ultimo = _limites_mes(date(mes[0], mes[1], 1))
+            parcial_de = mes == mes_de and de > primeiro
+            parcial_ate = mes == mes_ate and ate < ultimo
+            if not (parcial_de or parcial_ate):
+                yield mes, self.meses[mes]
+                continue
+            total = [0, 0.0]
+            for _, (quantidade, soma) in self.por_dia(de if parcial_de else primeiro, ate if parcial_ate else ultimo):
+                total[0] += quantidade
+                total[1] += soma
+            if total[0]:
+                yield mes, total
+
+    def total(self, de=None, ate=None):
+        """[quantidade, soma] entre de e ate; sem período inclui os lançamentos sem data"""
+        if not (de or ate):
+            total = list(self.sem_data)
+            for quantidade, soma in self.meses.values():
+                total[0] += quantidade
+                total[1] += soma
+            return total
+        total = [0, 0.0]
+        for _, (quantidade, soma) in self.por_mes(de, ate):
+            total[0] += quantidade
+            total[1] += soma
+        return total
+
+
+class Rollups:
+    """Agregados dos lançamentos financeiros por dia, mês e categoria, para fluxo de caixa e relatórios.
+
+    Cada combinação (tipo, status, categoria) tem uma série com quantidade e
+    soma de valor por dia e por mês, na data em que o lançamento entra no
+    caixa (pagamento para os pagos, vencimento para os demais). As consultas
+    por período percorrem só os buckets, nunca os lançamentos.
+
+    Em memória as séries são atualizadas pelo observador da coleção (inserção,
+    atualização, restauração). No SQLite, em que outros processos também
+    gravam, os agregados por dia ficam numa tabela atualizada na transação de
+    cada mutação (AgregadosSQLite); as séries são remontadas a partir dela
+    quando a versão da coleção muda, com custo proporcional aos buckets.
+    """
+
+    def __init__(self, lancamentos_financeiros):
+        # As somas dependem de valor já convertido para número na entrada (Colecao.preparar)
+        if 'valor' not in lancamentos_financeiros.campos_numericos:
+            raise ValueError("Rollups: 'valor' precisa ser um campo numérico dos lançamentos")
+        # Reentrante: as consultas seguram o lock enquanto _atuais() remonta as séries
+        self._lock = threading.RLock()
+        self._lancamentos = lancamentos_financeiros
+        self._series = {}  # (tipo, status, categoria) -> _Serie
+        self._versao = None
+        self._agregados = None
+        if getattr(lancamentos_financeiros, 'banco', None) is not None:
+            self._agregados = lancamentos_financeiros.agregados('caixa', _classificar)
+        else:
+            lancamentos_financeiros.observar(self._ao_alterar)
+
+    # Manutenção
+
+    def _ao_alterar(self, colecao, evento, registros, anteriores):
+        with self._lock:
+            if evento == 'substituir':
+                self._series = {}
+                anteriores = []
+            for registro in anteriores:
+                self._aplicar(registro, -1)
+            for registro in registros:
+                self._aplicar(registro, 1)
+
+    def _aplicar(self, registro, sinal):
+        chave, dia, valor = _classificar(registro)
+        serie = self._series.get(chave)
+        if serie is None:
+            serie = self._series[chave] = _Serie()
+        serie.aplicar(dia, sinal, sinal * valor)
+        if serie.vazia():
+            del self._series[chave]
+
+    @staticmethod
+    def _montar(grupos):
+        """Séries a partir de {((tipo, status, categoria), dia): (quantidade, soma)}"""
+        series = {}
+        for (chave, dia), (quantidade, soma) in grupos.items():
+            serie = series.get(chave)
+            if serie is None:
+                serie = series[chave] = _Serie()
+            serie.aplicar(dia, quantidade, soma)
+        return series
+
+    def recalcular(self):
+        """Monta as séries do zero agregando os lançamentos no armazenamento (verificação)"""
+        grupos = {}
+        por_vencimento = self._lancamentos.agrupar('valor', 'data_vencimento', ('tipo', 'status', 'categoria'))
+        por_pagamento = self._lancamentos.agrupar('valor', 'data_pagamento', ('tipo', 'status', 'categoria'),
+                                                  status='pago')
+        for agrupados, pagos in ((por_vencimento, False), (por_pagamento, True)):
+            for (dia, tipo, status, categoria), totais in agrupados.items():
+                if (status == 'pago') == pagos:
+                    grupos[((tipo, status, categoria), dia)] = totais
+        return self._montar(grupos)
+
+    def _atuais(self):
+        """Séries vigentes; no SQLite, remontadas da tabela de agregados quando a coleção muda"""
+        if self._agregados is None:
+            return self._series
+        versao = self._lancamentos.versao
+        if self._versao != versao:
+            series = self._montar(self._agregados.ler())
+            with self._lock:
+                self._series, self._versao = series, versao
+        return self._series
+
+    def _filtradas(self, tipo=None, status=None, categoria=None):
+        return [(chave, serie) for chave, serie in self._atuais().items()
+                if (tipo is None or chave[0] == tipo) and (status is None or chave[1] == status)
+                and (categoria is None or chave[2] == categoria)]
+
+    # Consultas
+
+    def total(self, de=None, ate=None, **criterios):
+        """Soma de valor dos lançamentos (tipo=, status=, categoria=) com data de caixa entre de e ate"""
+        with self._lock:
+            return sum(serie.total(de, ate)[1] for _, serie in self._filtradas(**criterios))
+
+    def por_categoria(self, de=None, ate=None, **criterios):
+        """Retorna {categoria: soma de valor} dos lançamentos que atendem aos critérios"""
+        totais = {}
+        with self._lock:
+            for (_, _, categoria), serie in self._filtradas(**criterios):
+                totais[categoria] = totais.get(categoria, 0.0) + serie.total(de, ate)[1]
+        return totais
+
+    def serie(self, granularidade, de=None, ate=None, **criterios):
+        """Retorna {período: soma de valor} por dia ('AAAA-MM-DD') ou mês ('AAAA-MM'), só os períodos com lançamentos"""
+        totais = {}
+        with self._lock:
+            for _, serie in self._filtradas(**criterios):
+                if granularidade == 'dia':
+                    buckets = ((dia.isoformat(), bucket) for dia, bucket in serie.por_dia(de, ate))
+                else:
+                    buckets = (('%04d-%02d' % mes, bucket) for mes, bucket in serie.por_mes(de, ate))
+                for periodo, (_, soma) in buckets:
+                    totais[periodo] = totais.get(periodo, 0.0) + soma
+        return totais
+
+    def fluxo_caixa(self, granularidade, de=None, ate=None):
+        """Fluxo de caixa por período, com o saldo projetado ao fim de cada um.
+
+        O saldo inicial é o realizado (recebido menos pago) antes de de; cada
+        período soma entradas e saídas realizadas e o que vence a receber e a
+        pagar. Só aparecem períodos com lançamentos.
+        """
+        colunas = {
+            'entradas': self.serie(granularidade, de, ate, tipo='receber', status='pago'),
+            'saidas': self.serie(granularidade, de, ate, tipo='pagar', status='pago'),
+            'a_receber': self.serie(granularidade, de, ate, tipo='receber', status='pendente'),
+            'a_pagar': self.serie(granularidade, de, ate, tipo='pagar', status='pendente'),
+        }
+        saldo_inicial = 0.0
+        if de:
+            vespera = de - timedelta(days=1)
+            saldo_inicial = (self.total(None, vespera, tipo='receber', status='pago')
+                             - self.total(None, vespera, tipo='pagar', status='pago'))
+        saldo = saldo_inicial
+        periodos = []
+        for periodo in sorted(set().union(*colunas.values())):
+            linha = {'periodo': periodo}
+            for nome, valores in colunas.items():
+                linha[nome] = round(valores.get(periodo, 0.0), 2)
+            saldo += linha['entradas'] - linha['saidas'] + linha['a_receber'] - linha['a_pagar']
+            linha['saldo_projetado'] = round(saldo, 2)
+            periodos.append(linha)
+        return round(saldo_inicial, 2), periodos
+
+    def verificar(self):
+        """Compara as séries incrementais com um recálculo completo e retorna as divergências"""
+        with self._lock:
+            atuais = {chave: serie.total() for chave, serie in self._atuais().items()}
+        recalculadas = {chave: serie.total() for chave, serie in self.recalcular().items()}
+        divergencias = {}
+        for chave in set(atuais) | set(recalculadas):
+            incremental = atuais.get(chave, [0, 0.0])
+            recalculado = recalculadas.get(chave, [0, 0.0])
+            if incremental[0] != recalculado[0] or abs(incremental[1] - recalculado[1]) > TOLERANCIA:
+                divergencias['/'.join(map(str, chave))] = {'incremental': incremental, 'recalculado': recalculado}
+        if divergencias:
+            logger.warning(f"Agregados financeiros divergentes do recálculo completo: {divergencias}")
+        return divergencias
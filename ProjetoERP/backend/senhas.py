@@ -0,0 +1,146 @@
+import os
+import threading
+import logging
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+from werkzeug.security import generate_password_hash, check_password_hash
+
+try:
+    import bcrypt
+except ImportError:  # bcrypt é opcional; sem ele ficam disponíveis pbkdf2 e scrypt
+    bcrypt = None
+
+logger = logging.getLogger(__name__)
+
+
+class ServidorOcupado(Exception):
+    """Muitas verificações de senha em andamento; a requisição deve ser recusada (503)"""
+
+
+class HasherPBKDF2:
+    """PBKDF2-SHA256 (werkzeug); custo = número de iterações"""
+
+    nome = 'pbkdf2'
+
+    def __init__(self, custo=None):
+        self.custo = int(custo or 600000)
+
+    def gerar(self, senha):
+        return generate_password_hash(senha, method=f'pbkdf2:sha256:{self.custo}')
+
+    def atualizado(self, hash_senha):
+        return hash_senha.startswith(f'pbkdf2:sha256:{self.custo}$')
+
+
+class HasherScrypt:
+    """scrypt (werkzeug); custo = log2 de N"""
+
+    nome = 'scrypt'
+
+    def __init__(self, custo=None):
+        self.custo = int(custo or 15)
+
+    def gerar(self, senha):
+        return generate_password_hash(senha, method=f'scrypt:{2 ** self.custo}:8:1')
+
+    def atualizado(self, hash_senha):
+        return hash_senha.startswith(f'scrypt:{2 ** self.custo}:8:1$')
+
+
+class HasherBcrypt:
+    """bcrypt; custo = log2 do número de rodadas"""
+
+    nome = 'bcrypt'
+
+    def __init__(self, custo=None):
+        if bcrypt is None:
+            raise RuntimeError("Algoritmo 'bcrypt' requer o pacote bcrypt instalado")
+        self.custo = int(custo or 12)
+
+    def gerar(self, senha):
+        return bcrypt.hashpw(senha.encode('utf-8'), bcrypt.gensalt(rounds=self.custo)).decode('ascii')
+
+    def atualizado(self, hash_senha):
+        return hash_senha.startswith(f'$2b${self.custo:02d}$')
+
+
+HASHERS = {h.nome: h for h in (HasherPBKDF2, HasherScrypt, HasherBcrypt)}
+
+
+def verificar_hash(hash_senha, senha):
+    """Verifica uma senha contra um hash de qualquer algoritmo suportado"""
+    if hash_senha.startswith('$2'):
+        if bcrypt is None:
+            raise RuntimeError("Hash bcrypt encontrado, mas o pacote bcrypt não está instalado")
+        return bcrypt.checkpw(senha.encode('utf-8'), hash_senha.encode('ascii'))
+    return check_password_hash(hash_senha, senha)
+
+
+class VerificadorSenhas:
+    """Gera e verifica hashes de senha fora da thread da requisição.
+
+    As verificações rodam em um pool limitado de threads (hashlib e bcrypt
+    liberam o GIL), e no máximo `fila` verificações podem estar pendentes ao
+    mesmo tempo: acima disso ServidorOcupado é levantada na hora, sem esperar
+    vaga, para que uma rajada de logins não prenda as threads da API. A vaga
+    só é devolvida quando o pool termina o cálculo, e quem espera o resultado
+    por mais de `espera` segundos também recebe ServidorOcupado.
+    """
+
+    def __init__(self, algoritmo='pbkdf2', custo=None, workers=None, fila=None, espera=5.0):
+        self.hasher = HASHERS[algoritmo](custo)
+        self.workers = int(workers or min(4, os.cpu_count() or 1))
+        self.espera = espera
+        self._vagas = threading.BoundedSemaphore(int(fila or self.workers * 8))
+        self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='senhas')
+        # Hash usado para usuários inexistentes, para que o tempo de resposta não revele quem existe
+        self._hash_ficticio = None
+
+    def _executar(self, funcao, *args):
+        """Roda funcao no pool; levanta ServidorOcupado se a fila estiver cheia ou o resultado demorar"""
+        if not self._vagas.acquire(blocking=False):
+            raise ServidorOcupado()
+        try:
+            futuro = self._pool.submit(funcao, *args)
+        except BaseException:
+            self._vagas.release()
+            raise
+        futuro.add_done_callback(lambda _: self._vagas.release())
+        try:
+            return futuro.result(timeout=self.espera)
+        except TimeoutError:
+            futuro.cancel()
+            raise ServidorOcupado()
+
+    def gerar(self, senha):
+        """Gera o hash da senha no pool; levanta ServidorOcupado se a fila estiver cheia"""
+        return self._executar(self.hasher.gerar, senha)
+
+    def precisa_rehash(self, hash_senha):
+        return not self.hasher.atualizado(hash_senha)
+
+    def verificar(self, hash_senha, senha):
+        """Verifica a senha no pool; levanta ServidorOcupado se a fila estiver cheia"""
+        return self._executar(verificar_hash, hash_senha, senha)
+
+    def verificar_inexistente(self, senha):
+        """Gasta o mesmo tempo de uma verificação real para um usuário que não existe"""
+        if self._hash_ficticio is None:
+            self._hash_ficticio = self.gerar('senha-ficticia')
+        self.verificar(self._hash_ficticio, senha)
+        return False
+
+
+verificador = VerificadorSenhas(
+    algoritmo=os.environ.get('ERP_SENHA_ALGORITMO', 'pbkdf2'),
+    custo=os.environ.get('ERP_SENHA_CUSTO'),
+    workers=os.environ.get('ERP_SENHA_WORKERS'),
+    fila=os.environ.get('ERP_SENHA_FILA'),
+)
+
+
+if __name__ == '__main__':
+    # Gera um hash com o algoritmo/custo configurados, para uso em ERP_SENHAS_ARQUIVO
+    import sys
+    import getpass
+    senha = sys.argv[1] if len(sys.argv) > 1 else getpass.getpass('Senha: ')
+    print(verificador.gerar(senha))
@@ -0,0 +1,60 @@
+import json
+from datetime import date, datetime
+
+from flask.json.provider import JSONProvider
+
+try:
+    import orjson
+except ImportError:  # opcional: sem orjson usa o json da biblioteca padrão
+    orjson = None
+
+
+def _padrao(valor):
+    """Tipos sem representação JSON direta: datas em ISO 8601, o resto como texto"""
+    if isinstance(valor, (date, datetime)):
+        return valor.isoformat()
+    return str(valor)
+
+
+def codificar(obj, ordenar=False, indentar=False):
+    """Serializa obj em JSON compacto (UTF-8, sem escapar acentos) e retorna bytes.
+
+    Usa orjson quando instalado; o resultado é o mesmo do json da biblioteca
+    padrão com separadores compactos e ensure_ascii=False.
+    """
+    if orjson is not None:
+        opcoes = orjson.OPT_NON_STR_KEYS
+        if ordenar:
+            opcoes |= orjson.OPT_SORT_KEYS
+        if indentar:
+            opcoes |= orjson.OPT_INDENT_2
+        return orjson.dumps(obj, default=_padrao, option=opcoes)
+    return json.dumps(obj, ensure_ascii=False, sort_keys=ordenar, indent=2 if indentar else None,
+                      separators=(',', ': ') if indentar else (',', ':'), default=_padrao).encode('utf-8')
+
+
+def decodificar(dados):
+    """Lê JSON de bytes ou str"""
+    if orjson is not None:
+        return orjson.loads(dados)
+    return json.loads(dados)
+
+
+class ProvedorJSON(JSONProvider):
+    """Provedor JSON do Flask (jsonify, request.get_json) usando codificar() e decodificar().
+
+    As respostas saem compactas; indentar=True (ERP_JSON_INDENTADO) volta a
+    formatá-las para leitura.
+    """
+
+    indentar = False
+
+    def dumps(self, obj, **kwargs):
+        return codificar(obj, ordenar=kwargs.get('sort_keys', False), indentar=bool(kwargs.get('indent'))).decode('utf-8')
+
+    def loads(self, s, **kwargs):
+        return decodificar(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(codificar(obj, indentar=self.indentar), mimetype='application/json')
@@ -0,0 +1,10 @@
+"""Ponto de entrada WSGI para produção, com vários workers.
+
+Uso: gunicorn -c gunicorn.conf.py wsgi:app
+
+Cada worker importa a aplicação depois do fork (preload_app desligado) e
+abre suas próprias conexões com o banco SQLite compartilhado.
+"""
+from app import app, iniciar_servicos
+
+iniciar_servicos()